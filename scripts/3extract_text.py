@@ -2,6 +2,8 @@
 # Utilidad: Cálculo de entropía de texto
 # ===========================
 import math
+import re
+import hashlib
 from collections import Counter
 
 def calcular_entropia(texto):
@@ -30,32 +32,17 @@ except OSError as e:
 # Multiprocessing: LD_LIBRARY_PATH workaround for child processes
 # ===========================
 
-def init_worker():
-    global ocr_paddle
-    global predictor_doctr
+def init_worker(eventos=None):
+    global _eventos_tareas
+    # Los modelos OCR se cargan en la primera tarea de cada motor (obtener_modelo)
+    _eventos_tareas = eventos
+    aplicar_limites_hilos()
 
-    try:
-        if config.getboolean('ocr', 'usar_paddleocr', fallback=True):
-            logger.info("Inicializando PaddleOCR...")
-            # Evitar 'use_gpu' para compatibilidad entre versiones
-            ocr_paddle = PaddleOCR(use_angle_cls=True, lang='es', show_log=False)
-            logger.info("PaddleOCR cargado correctamente.")
-        else:
-            ocr_paddle = None
-    except Exception as e:
-        logger.error(f"Error inicializando PaddleOCR: {e}")
-        ocr_paddle = None
-
-    try:
-        if config.getboolean('ocr', 'usar_doctr', fallback=True):
-            predictor_doctr = ocr_predictor(det_arch='db_resnet50', reco_arch='crnn_vgg16_bn', pretrained=True)
-            logger.info("DocTR cargado correctamente.")
-        else:
-            predictor_doctr = None
-    except Exception as e:
-        logger.error(f"Error inicializando DocTR: {e}")
-        predictor_doctr = None
 _models = {}
+# Cola por la que los workers avisan el inicio y fin de las tareas vigiladas y su retiro (ver crear_pool_ocr)
+_eventos_tareas = None
+# Documentos atendidos por este worker (ver motivo_reciclaje)
+_documentos_worker = set()
 #!/usr/bin/env python3
 import os
 import sys
@@ -90,43 +77,30 @@ import logging
 import fitz  # PyMuPDF
 
 logger = logging.getLogger(__name__)
-# Manejo robusto de errores al importar y crear el objeto EasyOCR (con reintento CPU si GPU falla)
-try:
-    import easyocr
-    try:
-        reader_easyocr = easyocr.Reader(['es'], gpu=False)
-        logger.info("EasyOCR cargado correctamente con GPU.")
-    except Exception as gpu_e:
-        logger.warning(f"Fallo carga EasyOCR con GPU: {gpu_e}. Reintentando con CPU...")
-        try:
-            reader_easyocr = easyocr.Reader(['es'], gpu=False)
-            logger.info("EasyOCR cargado correctamente con CPU.")
-        except Exception as cpu_e:
-            logger.error(f"Fallo carga EasyOCR con CPU también: {cpu_e}")
-            reader_easyocr = None
-except Exception as e:
-    logger.error(f"Error al importar EasyOCR: {e}")
-    reader_easyocr = None
 import pymysql
 import configparser
-import io
 import cv2
 import shutil
 import numpy as np
 import multiprocessing
-from paddleocr import PaddleOCR
-from doctr.models import ocr_predictor
+from multiprocessing import shared_memory
 from tqdm import tqdm
 from PIL import Image, ImageOps, ImageEnhance
 from pathlib import Path
-from pdf2image import convert_from_path
 import pytesseract
 import signal
 import warnings
+import queue
+import itertools
+import threading
+import time
+from datetime import datetime
 from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 import argparse
-os.environ["OMP_NUM_THREADS"] = "1"
-os.environ["MKL_NUM_THREADS"] = "1"
+from calidad_texto import metricas_calidad, serializar_metricas
+from layout_ocr import GUARDAR_LAYOUT, guardar_layout
+from plantillas_roi import OCR_POR_REGIONES, reconocer_plantilla, recortar_region
 
 # ===========================
 #  gar configuraciones
@@ -151,6 +125,68 @@ try:
     TEMP_DIR = config.get('paths', 'directorio_temporal', fallback='./tmp')
     logfile = config.get('logs', 'archivo_log', fallback='../logs/actividad.log')
     PROCESAMIENTO_SIMULTANEO = config.getint('ocr', 'procesamiento_simultaneo', fallback=os.cpu_count())
+    DOCTR_TAMANO_LOTE = config.getint('ocr', 'doctr_tamano_lote', fallback=8)
+    SEGMENTO_TOTALES_DESDE_PAGINA = config.getboolean('ocr', 'segmento_totales_desde_pagina', fallback=False)
+    RUTA_NATIVA = config.getboolean('ocr', 'ruta_nativa', fallback=False)
+    RUTA_NATIVA_OCR = config.get('ocr', 'ruta_nativa_ocr', fallback='tesseract6').strip().lower()
+    RUTA_NATIVA_MIN_CARACTERES = config.getint('ocr', 'ruta_nativa_min_caracteres', fallback=500)
+    RUTA_NATIVA_MIN_ALFANUMERICO = config.getfloat('ocr', 'ruta_nativa_min_alfanumerico', fallback=0.6)
+    DETECTAR_PAGINAS_EN_BLANCO = config.getboolean('ocr', 'detectar_paginas_en_blanco', fallback=False)
+    BLANCO_DPI = config.getint('ocr', 'blanco_dpi', fallback=36)
+    BLANCO_MARGEN = config.getfloat('ocr', 'blanco_margen', fallback=0.05)
+    BLANCO_CONTRASTE = config.getint('ocr', 'blanco_contraste', fallback=60)
+    BLANCO_MAX_TINTA = config.getfloat('ocr', 'blanco_max_tinta', fallback=0.002)
+    BLANCO_MAX_DESVIACION = config.getfloat('ocr', 'blanco_max_desviacion', fallback=4.0)
+    MODO_CASCADA = config.getboolean('ocr', 'modo_cascada', fallback=False)
+    ORDEN_CASCADA = [m.strip().lower() for m in config.get('ocr', 'orden_cascada', fallback='nativo, tesseract6, paddleocr, doctr, tesseract4, easyocr').split(',') if m.strip()]
+    CASCADA_MIN_CARACTERES = config.getint('ocr', 'cascada_min_caracteres', fallback=300)
+    CASCADA_MIN_ENTROPIA = config.getfloat('ocr', 'cascada_min_entropia', fallback=3.5)
+    CASCADA_ANCLAS = [a.strip().upper() for a in config.get('ocr', 'cascada_anclas', fallback='RUT, PATENTE, TOTAL').split(',') if a.strip()]
+    CASCADA_MIN_ANCLAS = config.getint('ocr', 'cascada_min_anclas', fallback=2)
+    HILOS_TESSERACT = config.getint('ocr', 'hilos_tesseract', fallback=0)
+    NUCLEOS_OCR = config.getint('ocr', 'nucleos_ocr', fallback=0)
+    HILOS_POR_WORKER = config.getint('ocr', 'hilos_por_worker', fallback=0)
+    BACKEND_INFERENCIA = config.get('ocr', 'backend_inferencia', fallback='nativo').strip().lower()
+    ONNX_HILOS = config.getint('ocr', 'onnx_hilos', fallback=0)
+    ONNX_PADDLE_DET = config.get('ocr', 'onnx_paddle_det', fallback='/AI/ia_sch/models/onnx/det_model_es.onnx')
+    ONNX_PADDLE_REC = config.get('ocr', 'onnx_paddle_rec', fallback='/AI/ia_sch/models/onnx/rec_model_es.onnx')
+    ONNX_PADDLE_CLS = config.get('ocr', 'onnx_paddle_cls', fallback='/AI/ia_sch/models/onnx/cls_model_es.onnx')
+    ONNX_PADDLE_DICCIONARIO = config.get('ocr', 'onnx_paddle_diccionario', fallback='')
+    ONNX_DOCTR_DET = config.get('ocr', 'onnx_doctr_det', fallback='db_resnet50')
+    ONNX_DOCTR_RECO = config.get('ocr', 'onnx_doctr_reco', fallback='crnn_vgg16_bn')
+    DPI_MOTORES = {
+        motor: config.get('ocr', f'dpi_{motor}', fallback='300').strip().lower()
+        for motor in ('paddleocr', 'doctr', 'tesseract', 'easyocr')
+    }
+    DPI_MOTORES = {motor: valor if valor == 'auto' else int(valor) for motor, valor in DPI_MOTORES.items()}
+    DPI_TOPE_MOTORES = {
+        'paddleocr': config.getint('ocr', 'dpi_tope_paddleocr', fallback=200),
+        'doctr': config.getint('ocr', 'dpi_tope_doctr', fallback=200),
+        'tesseract': config.getint('ocr', 'dpi_tope_tesseract', fallback=300),
+        'easyocr': config.getint('ocr', 'dpi_tope_easyocr', fallback=200),
+    }
+    DPI_AUTO_MINIMO = config.getint('ocr', 'dpi_auto_minimo', fallback=150)
+    DESKEW_LADO_MAX = max(64, config.getint('ocr', 'deskew_lado_max', fallback=1024))
+    DESKEW_ANGULO_MINIMO = config.getfloat('ocr', 'deskew_angulo_minimo', fallback=0.3)
+    CACHE_OCR = config.getboolean('ocr', 'cache_ocr', fallback=False)
+    DIRECTORIO_CACHE_OCR = config.get('ocr', 'directorio_cache_ocr', fallback='../tmp/cache_ocr')
+    CACHE_OCR_MAX_MB = config.getint('ocr', 'cache_ocr_max_mb', fallback=2048)
+    DOCTR_PAGINAS_POR_TAREA = max(1, config.getint('ocr', 'doctr_paginas_por_tarea', fallback=max(1, DOCTR_TAMANO_LOTE // 2)))
+    EASYOCR_TAMANO_LOTE = max(1, config.getint('ocr', 'easyocr_tamano_lote', fallback=8))
+    EASYOCR_PAGINAS_POR_TAREA = max(1, config.getint('ocr', 'easyocr_paginas_por_tarea', fallback=4))
+    TIEMPOS_MAX_MOTOR = {
+        motor: config.getfloat('ocr', f'tiempo_max_{motor}', fallback=0)
+        for motor in ('paddleocr', 'doctr', 'tesseract', 'easyocr')
+    }
+    TIEMPO_MAX_DOCUMENTO = config.getfloat('ocr', 'tiempo_max_documento', fallback=0)
+    RSS_MAX_WORKER_MB = config.getint('ocr', 'rss_max_worker_mb', fallback=0)
+    ORIENTACION_POR_PAGINA = config.getboolean('ocr', 'orientacion_por_pagina', fallback=False)
+    ORIENTACION_LADO_MAX = max(256, config.getint('ocr', 'orientacion_lado_max', fallback=1200))
+    ORIENTACION_CONFIANZA_MINIMA = config.getfloat('ocr', 'orientacion_confianza_minima', fallback=2.0)
+    # Con la página ya derecha, PaddleOCR no clasifica el ángulo de cada línea
+    PADDLE_CLASIFICAR_ANGULO = not ORIENTACION_POR_PAGINA
+    DOCUMENTOS_POR_WORKER = config.getint('ocr', 'documentos_por_worker', fallback=0)
+    SERVICIO_TAREAS_ABANDONADAS_MAX = config.getint('ocr', 'servicio_tareas_abandonadas_max', fallback=50)
 except Exception as e:
     print(f"Error cargando configuraciones: {e}")
     sys.exit(1)
@@ -184,14 +220,467 @@ logger.setLevel(logging.DEBUG if debug else logging.INFO)
 if debug:
     logger.info("Logger inicializado correctamente")
 
+# ===========================
+# Presupuesto de hilos por worker
+# ===========================
+# Cada worker del pool corre un motor a la vez, así que todas sus librerías
+# (OpenMP/MKL/OpenBLAS, torch, cv2, onnxruntime, Paddle) comparten el mismo
+# presupuesto: nucleos_ocr // procesos. El padre lo fija en el entorno antes de
+# crear el pool (spawn lo hereda antes de que los workers importen las
+# librerías, que leen esas variables al cargar). Los límites que solo se fijan
+# en tiempo de ejecución se aplican al cargar cada librería: cv2 en init_worker
+# y torch cuando obtener_modelo carga el primer motor que lo importa. Tesseract
+# recibe OMP_THREAD_LIMIT=1 solo en el entorno de su subproceso.
+VARIABLES_HILOS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+def nucleos_ocr():
+    return NUCLEOS_OCR if NUCLEOS_OCR > 0 else (os.cpu_count() or 1)
+
+def presupuesto_hilos(procesos=None):
+    """Hilos por worker para un pool de `procesos` workers (por defecto procesamiento_simultaneo)."""
+    if HILOS_POR_WORKER > 0:
+        return HILOS_POR_WORKER
+    return max(1, nucleos_ocr() // max(1, procesos or PROCESAMIENTO_SIMULTANEO))
+
+def hilos_worker():
+    """Presupuesto fijado por el coordinador del pool o, fuera de él, el de configuración."""
+    return int(os.environ.get('EXTRACT_HILOS_WORKER', 0)) or presupuesto_hilos()
+
+def coordinar_hilos(procesos, hilos=None):
+    """
+    Se llama en el padre justo antes de crear el pool: reparte el presupuesto de
+    núcleos entre `procesos` workers y lo deja en el entorno que heredan.
+    Retorna los hilos por worker.
+    """
+    hilos = hilos or presupuesto_hilos(procesos)
+    for variable in VARIABLES_HILOS:
+        os.environ[variable] = str(hilos)
+    os.environ['EXTRACT_HILOS_WORKER'] = str(hilos)
+    logger.info(f"🧵 Presupuesto de hilos: {procesos} workers x {hilos} hilos ({nucleos_ocr()} núcleos)")
+    return hilos
+
+_limites_torch_aplicados = False
+
+def aplicar_limites_hilos():
+    """En cada worker (init_worker): límite de hilos de cv2, que ya está importado."""
+    hilos = hilos_worker()
+    cv2.setNumThreads(hilos)
+    aplicar_limites_torch()
+    return hilos
+
+def aplicar_limites_torch():
+    """
+    Límites de torch (intra-op y un hilo inter-op), una vez por proceso. Se llama
+    después de cargar cada modelo: con la carga diferida torch recién se importa
+    con DocTR o EasyOCR.
+    """
+    global _limites_torch_aplicados
+    torch = sys.modules.get('torch')
+    if torch is None or _limites_torch_aplicados:
+        return
+    torch.set_num_threads(hilos_worker())
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # ya hubo trabajo paralelo en este proceso
+    _limites_torch_aplicados = True
+
+_subprocess_args_pytesseract = pytesseract.pytesseract.subprocess_args
+
+def _subprocess_args_tesseract(*args, **kwargs):
+    """
+    Argumentos de Popen de pytesseract con OMP_THREAD_LIMIT=1 solo en el entorno
+    del subproceso: en el del worker limitaría a un hilo el OpenMP de torch y
+    Paddle. El paralelismo de Tesseract lo da hilos_tesseract() con un
+    subproceso por página.
+    """
+    argumentos = _subprocess_args_pytesseract(*args, **kwargs)
+    argumentos['env'] = {**(argumentos.get('env') or os.environ), 'OMP_THREAD_LIMIT': '1'}
+    return argumentos
+
+pytesseract.pytesseract.subprocess_args = _subprocess_args_tesseract
+
+def crear_pool_ocr(procesos, hilos=None):
+    """
+    Pool de workers OCR: reparte el presupuesto de hilos, prepara los pesos
+    compartidos y crea la cola por la que los workers avisan cuándo empieza y
+    termina cada tarea vigilada (presupuestos de tiempo) y cuándo se retiran
+    para reciclarse (ver PlanificadorPaginas._vigilar).
+    """
+    global _eventos_tareas
+    coordinar_hilos(procesos, hilos)
+    preparar_pesos_compartidos()
+    # SimpleQueue escribe en la tubería al llamar put (sin hilo alimentador): el
+    # 'fin' de una tarea está en la cola antes de que el worker entregue su resultado
+    _eventos_tareas = multiprocessing.SimpleQueue()
+    return multiprocessing.Pool(processes=procesos, initializer=init_worker, initargs=(_eventos_tareas,))
+
+def rss_worker_mb():
+    """Memoria residente actual del proceso en MB (/proc/self/statm; pico de getrusage fuera de Linux)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def motivo_reciclaje(tarea):
+    """
+    En el worker, al empezar una tarea: si la tarea abre un documento nuevo y el
+    worker ya atendió documentos_por_worker documentos o su RSS supera
+    rss_max_worker_mb, retorna el motivo para reciclarlo. Si no, retorna None y
+    registra el documento.
+
+    "Documento nuevo" se mide sobre las tareas que tomó este worker: como el
+    planificador intercala páginas de varios documentos, el worker puede
+    retirarse con páginas de un documento ya visto aún pendientes en la cola.
+    Esas páginas las toman otros workers; no se pierde trabajo, porque las
+    tareas ya ejecutadas respondieron y la recién tomada se reenvía.
+    """
+    global _documentos_worker
+    documentos = {clave[0] for clave in tarea.get('claves') or ()} or {tarea['path_pdf']}
+    if documentos <= _documentos_worker:
+        return None
+    if 0 < DOCUMENTOS_POR_WORKER <= len(_documentos_worker):
+        return f"{len(_documentos_worker)} documentos atendidos"
+    if RSS_MAX_WORKER_MB > 0:
+        rss = rss_worker_mb()
+        if rss > RSS_MAX_WORKER_MB:
+            return f"RSS {rss:.0f} MB > {RSS_MAX_WORKER_MB} MB"
+    if DOCUMENTOS_POR_WORKER > 0:
+        _documentos_worker |= documentos
+    else:
+        # Sin tope de documentos basta recordar el documento en curso
+        _documentos_worker = documentos
+    return None
+
+def retirar_worker(tarea, motivo):
+    """
+    Termina el worker sin ejecutar la tarea recién tomada: avisa al padre, que
+    la reenvía a otro worker, y sale. El pool reemplaza el proceso por uno nuevo.
+    """
+    _eventos_tareas.put(('retiro', tarea['id'], os.getpid(), motivo))
+    os._exit(0)
+
+def benchmark_hilos(muestra=3):
+    """
+    Mide páginas/segundo de los motores habilitados sobre una muestra de PDFs del
+    directorio de entrada para cada reparto procesos x hilos del presupuesto de
+    núcleos, y sugiere el mejor. No escribe en la base ni mueve archivos.
+    """
+    paths_pdf = listar_pdfs_pendientes()[:muestra]
+    if not paths_pdf:
+        print(f"⚠️ No hay PDFs en {DIRECTORIO_PDFS} para el benchmark")
+        return None
+    metodos = [m for m in motores_habilitados() if m in MOTOR_DE_METODO]
+    motores = sorted({MOTOR_DE_METODO[m] for m in metodos})
+    paginas = []
+    for path_pdf in paths_pdf:
+        with fitz.open(path_pdf) as doc:
+            paginas.extend((path_pdf, num) for num in range(len(doc)))
+
+    nucleos = nucleos_ocr()
+    resultados = []
+    for procesos in [p for p in range(1, nucleos + 1) if nucleos % p == 0]:
+        hilos = nucleos // procesos
+        with crear_pool_ocr(procesos, hilos) as pool:
+            # Carga de modelos fuera de la medición (una tarea por worker, aproximado)
+            pool.map(precargar_modelos, [motores] * procesos, chunksize=1)
+            inicio = time.perf_counter()
+            for motor in motores:
+                dpi = dpi_para_motor(motor, None)
+                variantes = (variante_para_motor(motor),)
+                refs = [ref for ref, _ in pool.starmap(rasterizar_pagina_compartida,
+                                                       [(path, num, variantes, dpi) for path, num in paginas])]
+                por_tarea = PAGINAS_POR_TAREA_LOTE.get(motor, 1)
+                tareas = [{
+                    'tipo': 'motor', 'motor': motor, 'path_pdf': paginas[i][0],
+                    'metodos': [m for m in metodos if MOTOR_DE_METODO[m] == motor],
+                    'claves': paginas[i:i + por_tarea],
+                    'refs': refs[i:i + por_tarea],
+                } for i in range(0, len(paginas), por_tarea)]
+                try:
+                    pool.map(ejecutar_tarea, tareas)
+                finally:
+                    for ref in refs:
+                        liberar_pagina_compartida(ref)
+            duracion = time.perf_counter() - inicio
+        paginas_por_segundo = len(paginas) * len(motores) / duracion
+        resultados.append((paginas_por_segundo, procesos, hilos))
+        print(f"🧪 {procesos} workers x {hilos} hilos: {paginas_por_segundo:.2f} páginas/s ({duracion:.1f}s)")
+
+    mejor, procesos, hilos = max(resultados)
+    print(f"✅ Mejor reparto: procesamiento_simultaneo = {procesos}, hilos_por_worker = {hilos} ({mejor:.2f} páginas/s)")
+    return resultados
+
+# ===========================
+# Backend de inferencia ONNX Runtime (CPU)
+# ===========================
+# Con [ocr] backend_inferencia = onnx, PaddleOCR y DocTR corren sus modelos
+# exportados a ONNX sobre onnxruntime en CPU. Las dependencias (onnxruntime,
+# rapidocr_onnxruntime, onnxtr) son opcionales y solo se importan en ese modo.
+
+def hilos_onnx():
+    """Hilos intra-op por sesión ONNX; por defecto el presupuesto por worker."""
+    if ONNX_HILOS > 0:
+        return ONNX_HILOS
+    return hilos_worker()
+
+class PaddleOCROnnx:
+    """
+    Modelos PP-OCR det/rec/cls en ONNX (vía RapidOCR) con la misma interfaz y
+    formato de salida que PaddleOCR.ocr(): por imagen, [[caja, (texto, confianza)], ...]
+    o None si no hay detecciones.
+    """
+
+    def __init__(self, hilos):
+        from rapidocr_onnxruntime import RapidOCR
+
+        rutas = (ONNX_PADDLE_DET, ONNX_PADDLE_REC) + ((ONNX_PADDLE_CLS,) if PADDLE_CLASIFICAR_ANGULO else ())
+        for ruta in rutas:
+            if not os.path.isfile(ruta):
+                raise FileNotFoundError(f"Modelo ONNX de PaddleOCR no encontrado: {ruta}")
+        parametros = {
+            'det_model_path': ONNX_PADDLE_DET,
+            'rec_model_path': ONNX_PADDLE_REC,
+            'intra_op_num_threads': hilos,
+            'inter_op_num_threads': 1,
+        }
+        if PADDLE_CLASIFICAR_ANGULO:
+            parametros['cls_model_path'] = ONNX_PADDLE_CLS
+        if ONNX_PADDLE_DICCIONARIO:
+            parametros['rec_keys_path'] = ONNX_PADDLE_DICCIONARIO
+        self.motor = RapidOCR(**parametros)
+        logger.info(f"PaddleOCR ONNX cargado ({hilos} hilos intra-op).")
+
+    def ocr(self, img, cls=True):
+        resultado, _ = self.motor(img, use_cls=cls)
+        if not resultado:
+            return [None]
+        return [[[caja, (texto, float(confianza))] for caja, texto, confianza in resultado]]
+
+def crear_predictor_doctr_onnx(hilos):
+    """
+    Predictor DocTR equivalente (OnnxTR: mismas arquitecturas y mismo objeto
+    Document de salida) sobre onnxruntime en CPU.
+    """
+    import onnxruntime as ort
+    from onnxtr.models import EngineConfig, ocr_predictor as ocr_predictor_onnx
+
+    opciones = ort.SessionOptions()
+    opciones.intra_op_num_threads = hilos
+    opciones.inter_op_num_threads = 1
+    motor = EngineConfig(providers=[('CPUExecutionProvider', {})], session_options=opciones)
+    predictor = ocr_predictor_onnx(
+        det_arch=ONNX_DOCTR_DET,
+        reco_arch=ONNX_DOCTR_RECO,
+        det_bs=DOCTR_TAMANO_LOTE,
+        det_engine_cfg=motor,
+        reco_engine_cfg=motor,
+        clf_engine_cfg=motor,
+    )
+    logger.info(f"DocTR ONNX cargado ({ONNX_DOCTR_DET}/{ONNX_DOCTR_RECO}, {hilos} hilos intra-op).")
+    return predictor
+
+# ===========================
+# Carga diferida de modelos OCR
+# ===========================
+# Cada worker carga un motor con su primera tarea (obtener_modelo), no al
+# arrancar: el pool arranca sin importar Paddle/torch, y los motores que el lote
+# no llega a usar (cascada, motores deshabilitados) no ocupan memoria. Los pesos
+# de DocTR se abren con mmap desde la caché de doctr, que el padre completa
+# antes de crear el pool (preparar_pesos_compartidos): sus páginas de solo
+# lectura viven una vez en la caché del sistema y las comparten todos los
+# workers. Paddle Inference y EasyOCR no permiten mapear sus pesos; esos siguen
+# siendo privados de cada worker que los usa.
+DOCTR_DET_ARCH = 'db_resnet50'
+DOCTR_RECO_ARCH = 'crnn_vgg16_bn'
+
+def _cargar_paddleocr():
+    if BACKEND_INFERENCIA == 'onnx':
+        return PaddleOCROnnx(hilos_onnx())
+    from paddleocr import PaddleOCR
+    # Evitar 'use_gpu' para compatibilidad entre versiones
+    return PaddleOCR(use_angle_cls=PADDLE_CLASIFICAR_ANGULO, lang='es', show_log=False, cpu_threads=hilos_worker())
+
+def _pesos_doctr():
+    """Rutas de los pesos det/reco en la caché de doctr; los descarga si faltan."""
+    from doctr.models.detection.differentiable_binarization.pytorch import default_cfgs as cfgs_det
+    from doctr.models.recognition.crnn.pytorch import default_cfgs as cfgs_reco
+    from doctr.utils.data import download_from_url
+    return {
+        'det': download_from_url(cfgs_det[DOCTR_DET_ARCH]['url'], cache_subdir='models'),
+        'reco': download_from_url(cfgs_reco[DOCTR_RECO_ARCH]['url'], cache_subdir='models'),
+    }
+
+def _cargar_doctr():
+    if BACKEND_INFERENCIA == 'onnx':
+        return crear_predictor_doctr_onnx(hilos_onnx())
+    from doctr.models import ocr_predictor
+    try:
+        import torch
+        rutas = _pesos_doctr()
+        predictor = ocr_predictor(det_arch=DOCTR_DET_ARCH, reco_arch=DOCTR_RECO_ARCH, pretrained=False,
+                                  pretrained_backbone=False, det_bs=DOCTR_TAMANO_LOTE)
+        for modelo, parte in ((predictor.det_predictor.model, 'det'), (predictor.reco_predictor.model, 'reco')):
+            # assign=True deja como parámetros los tensores mapeados, sin copiarlos
+            estado = torch.load(rutas[parte], map_location='cpu', mmap=True, weights_only=True)
+            modelo.load_state_dict(estado, assign=True)
+        return predictor
+    except Exception as e:
+        # torch < 2.1 o pesos en formato antiguo: carga privada como antes
+        logger.warning(f"⚠️ DocTR sin pesos mapeados en memoria ({e}); se cargan por worker.")
+        return ocr_predictor(det_arch=DOCTR_DET_ARCH, reco_arch=DOCTR_RECO_ARCH, pretrained=True, det_bs=DOCTR_TAMANO_LOTE)
+
+def _cargar_easyocr():
+    import easyocr
+    return easyocr.Reader(['es'], gpu=False)
+
+CARGADORES_MODELO = {
+    'paddleocr': _cargar_paddleocr,
+    'doctr': _cargar_doctr,
+    'easyocr': _cargar_easyocr,
+}
+
+def obtener_modelo(motor):
+    """
+    Modelo del motor en este proceso, cargado en la primera llamada. Un fallo de
+    carga queda registrado como None para no reintentarlo en cada página.
+    """
+    if motor not in _models:
+        if not config.getboolean('ocr', f'usar_{motor}', fallback=True):
+            _models[motor] = None
+            return None
+        logger.info(f"Inicializando {motor}...")
+        inicio = time.perf_counter()
+        try:
+            _models[motor] = CARGADORES_MODELO[motor]()
+            aplicar_limites_torch()
+            logger.info(f"{motor} cargado correctamente en {time.perf_counter() - inicio:.1f}s.")
+        except Exception as e:
+            logger.error(f"Error inicializando {motor}: {e}")
+            _models[motor] = None
+    return _models[motor]
+
+def precargar_modelos(motores):
+    """Carga en el worker los modelos de `motores` (benchmark: fuera de la medición)."""
+    for motor in motores:
+        if motor in CARGADORES_MODELO:
+            obtener_modelo(motor)
+
+def preparar_pesos_compartidos():
+    """
+    En el padre, antes de crear el pool: deja los pesos de DocTR en la caché para
+    que los workers solo los mapeen (sin descargas concurrentes).
+    """
+    if not USE_DOCTR or BACKEND_INFERENCIA == 'onnx':
+        return
+    try:
+        _pesos_doctr()
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudieron preparar los pesos de DocTR: {e}")
+
+# ===========================
+# Rasterización compartida de páginas
+# ===========================
+DPI_OCR = 300
+
+def pixmap_a_array(pix, gris=False, copiar=False):
+    """
+    Envuelve el buffer del Pixmap (pix.samples_mv) como array NumPy, sin pasar
+    por PNG ni copiar. Retorna (alto, ancho, 3) RGB o, con gris=True, (alto, ancho)
+    en escala de grises. Si no hubo conversión el array es una vista de solo
+    lectura que vale mientras pix exista; copiar=True retorna una copia propia
+    para arrays que sobreviven al Pixmap.
+    """
+    img_np = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+    img_np.setflags(write=False)
+    if pix.alpha:
+        img_np = img_np[:, :, :pix.n - 1]
+    canales = img_np.shape[2]
+    if gris:
+        if canales == 1:
+            return img_np[:, :, 0].copy() if copiar else img_np[:, :, 0]
+        return cv2.cvtColor(img_np, cv2.COLOR_RGB2GRAY)
+    if canales == 1:
+        return cv2.cvtColor(img_np[:, :, 0], cv2.COLOR_GRAY2RGB)
+    if pix.alpha:
+        return np.ascontiguousarray(img_np)
+    return img_np.copy() if copiar else img_np
+
+def resolucion_efectiva_ppi(path_pdf):
+    """
+    Resolución efectiva del escaneo: píxeles de la imagen más grande de la primera
+    página sobre el tamaño en que se dibuja (pulgadas de su bbox). Retorna 0 si
+    la página no tiene imágenes (PDF vectorial).
+    """
+    doc = fitz.open(path_pdf)
+    try:
+        if not doc.page_count:
+            return 0
+        pagina = doc[0]
+        mejor_area, ppi = 0, 0
+        for imagen in pagina.get_images(full=True):
+            xref, ancho_px, alto_px = imagen[0], imagen[2], imagen[3]
+            for rect in pagina.get_image_rects(xref):
+                if rect.width <= 0 or rect.height <= 0 or rect.width * rect.height <= mejor_area:
+                    continue
+                # Imagen dibujada girada 90°: el ancho en píxeles corresponde al alto de la caja
+                if (ancho_px > alto_px) != (rect.width > rect.height):
+                    ancho_px, alto_px = alto_px, ancho_px
+                mejor_area = rect.width * rect.height
+                ppi = (ancho_px / (rect.width / 72) + alto_px / (rect.height / 72)) / 2
+        return ppi
+    finally:
+        doc.close()
+
+def dpi_para_motor(motor, resolucion_ppi=None):
+    """
+    DPI de renderizado de un motor ([ocr] dpi_<motor>). En 'auto' usa la resolución
+    efectiva de las imágenes del PDF (resolucion_efectiva_ppi) acotada entre
+    dpi_auto_minimo y dpi_tope_<motor>: renderizar por encima del escaneo solo
+    multiplica píxeles. Sin imágenes embebidas (PDF vectorial) se usa el tope.
+    """
+    valor = DPI_MOTORES.get(motor, DPI_OCR)
+    if valor != 'auto':
+        return valor
+    tope = DPI_TOPE_MOTORES.get(motor, DPI_OCR)
+    if not resolucion_ppi or float(resolucion_ppi) <= 0:
+        return tope
+    return int(max(DPI_AUTO_MINIMO, min(tope, round(float(resolucion_ppi)))))
+
+def renderizar_paginas(path_pdf, dpi=DPI_OCR):
+    """
+    Renderiza cada página del PDF una sola vez y retorna una lista de arrays
+    NumPy RGB (alto, ancho, 3) que comparten todos los motores OCR habilitados.
+    Los arrays quedan en solo lectura: cada motor debe copiar antes de modificar.
+    """
+    paginas = []
+    doc = fitz.open(path_pdf)
+    try:
+        for page in doc:
+            pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csRGB, alpha=False)
+            img_np = pixmap_a_array(pix, copiar=True)
+            if ORIENTACION_POR_PAGINA:
+                img_np, _ = orientar_pagina(img_np)
+            img_np.setflags(write=False)
+            paginas.append(img_np)
+    finally:
+        doc.close()
+    return paginas
+
+def _como_array_rgb(imagen):
+    """Acepta PIL.Image o array RGB y retorna un array RGB."""
+    if isinstance(imagen, Image.Image):
+        return np.array(imagen.convert("RGB"))
+    return imagen
+
 # ===========================
 # Preprocesamiento de imagen
 # ===========================
 
 def preprocesar_imagen(pix):
-    img_data = pix.tobytes("png")
-    img = Image.open(io.BytesIO(img_data))
-    img = ImageOps.grayscale(img)
+    img = Image.fromarray(pixmap_a_array(pix, gris=True))
     enhancer = ImageEnhance.Contrast(img)
     img = enhancer.enhance(2.0)
     img_np = np.array(img)
@@ -200,33 +689,206 @@ def preprocesar_imagen(pix):
 
 
 
+# ===========================
+# Preprocesamiento compartido por todos los motores OCR
+# ===========================
+
+# Variante de página que consume cada motor cuando usar_preprocesamiento_cv2 está activo
+VARIANTE_POR_MOTOR = {
+    'tesseract': 'binarizada',
+    'doctr': 'enderezada',
+    'easyocr': 'ecualizada',
+}
+KERNEL_CIERRE = np.ones((2, 2), np.uint8)
+
+_clahe = None
+_buffers_preprocesamiento = {}
+
+def obtener_clahe():
+    """CLAHE único por proceso (antes se creaba uno en cada llamada)."""
+    global _clahe
+    if _clahe is None:
+        _clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+    return _clahe
+
+def _buffer(nombre, forma):
+    """
+    Buffer de trabajo preasignado para resultados intermedios, reutilizado entre
+    páginas del mismo tamaño. Su contenido solo es válido hasta el próximo uso.
+    """
+    clave = (nombre, forma)
+    buf = _buffers_preprocesamiento.get(clave)
+    if buf is None:
+        if len(_buffers_preprocesamiento) >= 16:
+            _buffers_preprocesamiento.clear()
+        buf = _buffers_preprocesamiento[clave] = np.empty(forma, dtype=np.uint8)
+    return buf
+
+def variante_para_motor(motor):
+    if not USAR_PREPROCESAMIENTO_CV2:
+        return 'rgb'
+    return VARIANTE_POR_MOTOR.get(motor, 'rgb')
+
+def _gris(imagen):
+    if imagen.ndim == 2:
+        return imagen
+    return cv2.cvtColor(imagen, cv2.COLOR_RGB2GRAY, dst=_buffer('gris', imagen.shape[:2]))
+
+def _binarizar(gris, blockSize=11, C=2, kernel_size=3):
+    """CLAHE, umbral adaptativo invertido y mediana. Retorna un array propio."""
+    realzada = obtener_clahe().apply(gris, dst=_buffer('clahe', gris.shape))
+    umbral = cv2.adaptiveThreshold(realzada, 255,
+                                   cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                   cv2.THRESH_BINARY_INV, blockSize, C,
+                                   dst=_buffer('umbral', gris.shape))
+    return cv2.medianBlur(umbral, kernel_size)
+
+def estimar_angulo_deskew(binarizada):
+    """
+    Estima el ángulo de inclinación sobre una copia reducida (lado mayor
+    <= [ocr] deskew_lado_max): el costo queda fijo en vez de materializar las
+    coordenadas de todos los píxeles de la página. Retorna None si no hay tinta.
+    """
+    alto, ancho = binarizada.shape[:2]
+    escala = min(1.0, DESKEW_LADO_MAX / max(alto, ancho))
+    if escala < 1.0:
+        reducida = cv2.resize(binarizada, (max(1, int(ancho * escala)), max(1, int(alto * escala))),
+                              interpolation=cv2.INTER_AREA)
+        _, reducida = cv2.threshold(reducida, 127, 255, cv2.THRESH_BINARY)
+    else:
+        reducida = binarizada
+
+    puntos = cv2.findNonZero(reducida)
+    if puntos is None:
+        return None
+    # (fila, columna) como en la versión original con np.where, para conservar la convención del ángulo
+    coords = np.ascontiguousarray(puntos.reshape(-1, 2)[:, ::-1])
+    angle = cv2.minAreaRect(coords)[-1]
+    if angle < -45:
+        return -(90 + angle)
+    if angle > 45:
+        return -(90 - angle)
+    return -angle
+
+ROTACIONES_CV2 = {
+    90: cv2.ROTATE_90_CLOCKWISE,
+    180: cv2.ROTATE_180,
+    270: cv2.ROTATE_90_COUNTERCLOCKWISE,
+}
+
+def detectar_orientacion(rgb):
+    """
+    Orientación de la página con Tesseract OSD sobre una miniatura (lado mayor
+    <= [ocr] orientacion_lado_max). Retorna los grados (0, 90, 180, 270) que
+    hay que girar la página en sentido horario para dejarla derecha; 0 si OSD
+    no está seguro (orientacion_confianza_minima) o no encuentra texto.
+    """
+    alto, ancho = rgb.shape[:2]
+    escala = min(1.0, ORIENTACION_LADO_MAX / max(alto, ancho))
+    miniatura = _gris(rgb)
+    if escala < 1.0:
+        miniatura = cv2.resize(miniatura, (max(1, int(ancho * escala)), max(1, int(alto * escala))),
+                               interpolation=cv2.INTER_AREA)
+    try:
+        osd = pytesseract.image_to_osd(miniatura, config='--psm 0', output_type=pytesseract.Output.DICT)
+    except (pytesseract.TesseractError, RuntimeError) as e:
+        # Páginas con poco texto: OSD no decide y se dejan como están
+        logging.debug(f"OSD sin resultado: {e}")
+        return 0
+    if osd.get('orientation_conf', 0) < ORIENTACION_CONFIANZA_MINIMA:
+        return 0
+    return int(osd.get('rotate', 0)) % 360
+
+def orientar_pagina(rgb, rotacion=None):
+    """
+    Gira la página (una vez, antes de cualquier variante o motor) y retorna
+    (página, rotación). Sin rotación conocida la detecta con detectar_orientacion.
+    """
+    if rotacion is None:
+        rotacion = detectar_orientacion(rgb)
+    if rotacion not in ROTACIONES_CV2:
+        return rgb, rotacion
+    return cv2.rotate(rgb, ROTACIONES_CV2[rotacion]), rotacion
+
+def _enderezar(binarizada):
+    """
+    Cierre morfológico y deskew. El ángulo se estima en baja resolución y la
+    rotación se aplica una sola vez a resolución completa, salvo que sea menor
+    que [ocr] deskew_angulo_minimo. Retorna un array propio.
+    """
+    procesada = cv2.morphologyEx(binarizada, cv2.MORPH_CLOSE, KERNEL_CIERRE,
+                                 dst=_buffer('cierre', binarizada.shape))
+
+    angle = estimar_angulo_deskew(procesada)
+    if angle is None or abs(angle) < DESKEW_ANGULO_MINIMO:
+        return procesada.copy()
+
+    (h, w) = procesada.shape[:2]
+    M = cv2.getRotationMatrix2D((w // 2, h // 2), angle, 1.0)
+    return cv2.warpAffine(procesada, M, (w, h),
+                          flags=cv2.INTER_CUBIC,
+                          borderMode=cv2.BORDER_REPLICATE)
+
+class VariantesPagina:
+    """
+    Variantes preprocesadas de una página, calculadas una sola vez y bajo demanda:
+
+        'rgb'         página original
+        'binarizada'  CLAHE + umbral adaptativo + mediana (Tesseract)
+        'enderezada'  binarizada + cierre + deskew (DocTR)
+        'ecualizada'  gris con histograma ecualizado (EasyOCR)
+
+    Quedan memorizadas mientras viva el objeto (el documento en curso); en el pool
+    las calcula la tarea de rasterizado y viajan en memoria compartida
+    (precalculadas) para que cada motor tome la suya sin repetir trabajo.
+    """
+
+    def __init__(self, rgb, precalculadas=None):
+        self.rgb = rgb
+        self._variantes = dict(precalculadas or {})
+
+    def obtener(self, nombre):
+        if nombre == 'rgb':
+            return self.rgb
+        if nombre not in self._variantes:
+            self._variantes[nombre] = self._calcular(nombre)
+        return self._variantes[nombre]
+
+    def para_motor(self, motor):
+        return self.obtener(variante_para_motor(motor))
+
+    def _calcular(self, nombre):
+        if nombre == 'binarizada':
+            return _binarizar(_gris(self.rgb))
+        if nombre == 'enderezada':
+            return _enderezar(self.obtener('binarizada'))
+        if nombre == 'ecualizada':
+            return cv2.equalizeHist(_gris(self.rgb))
+        raise ValueError(f"Variante de preprocesamiento desconocida: {nombre}")
+
+def como_variantes(pagina):
+    """Acepta VariantesPagina, PIL.Image o array RGB."""
+    if isinstance(pagina, VariantesPagina):
+        return pagina
+    return VariantesPagina(_como_array_rgb(pagina))
+
 # ===========================
 # Preprocesamiento específico por motor OCR
 # ===========================
 
 def preprocesar_para_tesseract(imagen_pil):
-    imagen = cv2.cvtColor(np.array(imagen_pil.convert("RGB")), cv2.COLOR_RGB2BGR)
-    gris = cv2.cvtColor(imagen, cv2.COLOR_BGR2GRAY)
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-    gris = clahe.apply(gris)
-    binarizada = cv2.adaptiveThreshold(gris, 255,
-                                       cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                                       cv2.THRESH_BINARY_INV, 11, 2)
-    desenfocada = cv2.medianBlur(binarizada, 3)
-    return desenfocada
+    return como_variantes(imagen_pil).obtener('binarizada')
 
 def preprocesar_para_paddleocr(imagen_pil):
     # PaddleOCR requiere imagen en RGB y clara
-    return cv2.cvtColor(np.array(imagen_pil.convert("RGB")), cv2.COLOR_RGB2BGR)
+    return cv2.cvtColor(_como_array_rgb(imagen_pil), cv2.COLOR_RGB2BGR)
 
 def preprocesar_para_easyocr(imagen_pil):
-    imagen = cv2.cvtColor(np.array(imagen_pil.convert("RGB")), cv2.COLOR_RGB2BGR)
-    gris = cv2.cvtColor(imagen, cv2.COLOR_BGR2GRAY)
-    return cv2.equalizeHist(gris)
+    return como_variantes(imagen_pil).obtener('ecualizada')
 
 def preprocesar_imagen_cv2(entrada, blockSize=11, C=2, kernel_size=3):
     """
-    Preprocesa una imagen (ruta, PIL.Image o numpy array) con OpenCV.
+    Preprocesa una imagen (ruta, PIL.Image o numpy array BGR/gris) con OpenCV.
     Aplica CLAHE, binarización adaptativa, limpieza de ruido y deskew.
     Retorna un array listo para OCR.
     """
@@ -241,55 +903,32 @@ def preprocesar_imagen_cv2(entrada, blockSize=11, C=2, kernel_size=3):
     else:
         raise TypeError("Tipo de entrada no válido para preprocesamiento")
 
-    gris = cv2.cvtColor(imagen, cv2.COLOR_BGR2GRAY)
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-    gris = clahe.apply(gris)
-    binarizada = cv2.adaptiveThreshold(gris, 255,
-                                       cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                                       cv2.THRESH_BINARY_INV, blockSize, C)
-    desenfocada = cv2.medianBlur(binarizada, kernel_size)
-    kernel = np.ones((2, 2), np.uint8)
-    procesada = cv2.morphologyEx(desenfocada, cv2.MORPH_CLOSE, kernel)
-
-    coords = np.column_stack(np.where(procesada > 0))
-    if len(coords) > 0:
-        angle = cv2.minAreaRect(coords)[-1]
-        if angle < -45:
-            angle = -(90 + angle)
-        elif angle > 45:
-            angle = -(90 - angle)
-        else:
-            angle = -angle
-
-        (h, w) = procesada.shape[:2]
-        M = cv2.getRotationMatrix2D((w // 2, h // 2), angle, 1.0)
-        enderezada = cv2.warpAffine(procesada, M, (w, h),
-                                    flags=cv2.INTER_CUBIC,
-                                    borderMode=cv2.BORDER_REPLICATE)
-    else:
-        enderezada = procesada
-
-    return enderezada
+    gris = imagen if imagen.ndim == 2 else cv2.cvtColor(imagen, cv2.COLOR_BGR2GRAY)
+    return _enderezar(_binarizar(gris, blockSize, C, kernel_size))
 
 
 # ===========================
 # Funciones de extraccion OCR
 # ===========================
-def extraer_texto_paddleocr_v2(path_pdf, ocr, debug=False):
-    dpi = 300
+def extraer_texto_paddleocr_v2(path_pdf, ocr, debug=False, paginas=None, layout=None, segmento_totales=True):
+    """
+    OCR con PaddleOCR de cada página más su segmento de totales. Si se pasa la
+    lista layout, agrega cada línea de la página completa como
+    (página, texto, x0, y0, x1, y1, confianza) con la caja normalizada (0-1).
+    Con segmento_totales=False (recortes de regiones) solo se reconoce la imagen.
+    """
     try:
-        # Usar la variable global ocr_paddle si ocr es None
-        global ocr_paddle
         if ocr is None:
-            ocr = ocr_paddle
-        imagenes = convert_from_path(path_pdf, dpi=dpi)
+            ocr = obtener_modelo('paddleocr')
+        if paginas is None:
+            paginas = renderizar_paginas(path_pdf)
         texto = ""
 
-        for imagen in imagenes:
-            imagen_np = np.array(imagen)
+        for num_pagina, pagina in enumerate(paginas):
+            imagen_np = como_variantes(pagina).rgb
 
             # OCR sobre la imagen completa
-            resultados = ocr.ocr(imagen_np, cls=True)
+            resultados = ocr.ocr(imagen_np, cls=PADDLE_CLASIFICAR_ANGULO)
             if resultados is None:
                 logging.warning("PaddleOCR retornó None en resultados de imagen principal.")
                 continue
@@ -298,17 +937,32 @@ def extraer_texto_paddleocr_v2(path_pdf, ocr, debug=False):
                     if bloque:
                         for linea in bloque:
                             texto += linea[1][0] + "\n"
+                            if layout is not None:
+                                layout.append(_entrada_layout_paddle(num_pagina, linea, imagen_np.shape))
             else:
                 logging.warning("PaddleOCR retornó resultados vacíos en imagen principal.")
 
+            if not segmento_totales:
+                continue
+
+            # Segmento de totales filtrando las detecciones de la página completa
+            if SEGMENTO_TOTALES_DESDE_PAGINA:
+                alto, ancho = imagen_np.shape[:2]
+                lineas_segmento = _lineas_paddle_en_segmento_totales(resultados, ancho, alto)
+                texto += "\n[SEGMENTO_TOTALES]\n"
+                if lineas_segmento:
+                    texto += "\n".join(lineas_segmento) + "\n"
+                else:
+                    texto += "[Sin texto detectado en segmento totales]\n"
+                continue
+
             # OCR sobre el bloque derecho inferior
-            bloque_derecho = dividir_y_extraer_inferior_derecha(imagen, debug=debug)
-            if bloque_derecho is None:
+            bloque_np = dividir_y_extraer_inferior_derecha(imagen_np, debug=debug)
+            if bloque_np is None:
                 logging.warning("Segmento derecho inferior no generado correctamente.")
                 continue  # pasa a la siguiente página
             else:
-                bloque_np = np.array(bloque_derecho)
-                resultado_bloque = ocr.ocr(bloque_np, cls=True)
+                resultado_bloque = ocr.ocr(bloque_np, cls=PADDLE_CLASIFICAR_ANGULO)
                 if resultado_bloque is None:
                     logging.warning("PaddleOCR retornó None en resultados del bloque inferior derecho.")
                     continue
@@ -331,13 +985,44 @@ def extraer_texto_paddleocr_v2(path_pdf, ocr, debug=False):
         logging.error(f"Error en PaddleOCR v2: {e}")
         return ""
 
-def dividir_y_extraer_inferior_derecha(img: Image.Image, debug=False):
-    if img is None or not hasattr(img, "size"):
+def _entrada_layout_paddle(num_pagina, linea, forma):
+    alto, ancho = forma[:2]
+    xs = [float(punto[0]) for punto in linea[0]]
+    ys = [float(punto[1]) for punto in linea[0]]
+    return (num_pagina, linea[1][0], min(xs) / ancho, min(ys) / alto, max(xs) / ancho, max(ys) / alto, float(linea[1][1]))
+
+def _centro_en_segmento_totales(puntos, ancho=1.0, alto=1.0):
+    """
+    Indica si el centro de una caja cae en el cuadrante inferior derecho, el mismo
+    que recorta dividir_y_extraer_inferior_derecha. Con ancho=alto=1.0 acepta
+    coordenadas normalizadas (DocTR).
+    """
+    cx = sum(p[0] for p in puntos) / len(puntos)
+    cy = sum(p[1] for p in puntos) / len(puntos)
+    return cx >= ancho / 2 and cy >= alto / 2
+
+def _lineas_paddle_en_segmento_totales(resultados, ancho, alto):
+    lineas = []
+    for bloque in resultados:
+        if bloque:
+            for linea in bloque:
+                if _centro_en_segmento_totales(linea[0], ancho, alto):
+                    lineas.append(linea[1][0])
+    return lineas
+
+def dividir_y_extraer_inferior_derecha(img, debug=False):
+    """
+    Retorna el cuadrante inferior derecho de la página. Acepta PIL.Image
+    (retorna PIL.Image) o array NumPy (retorna array contiguo).
+    """
+    if isinstance(img, np.ndarray):
+        alto, ancho = img.shape[:2]
+    elif img is not None and hasattr(img, "size"):
+        ancho, alto = img.size
+    else:
         logging.error("Imagen inválida al intentar dividir.")
         return None
 
-    ancho, alto = img.size
-
     if ancho < 10 or alto < 10:
         logging.error("Tamaño de imagen muy pequeño para segmentar.")
         return None
@@ -347,10 +1032,16 @@ def dividir_y_extraer_inferior_derecha(img: Image.Image, debug=False):
     mitad_alto = alto // 2
 
     # Extraer el bloque inferior derecho
-    bloque_inferior_derecho = img.crop((mitad_ancho, mitad_alto, ancho, alto))
+    if isinstance(img, np.ndarray):
+        bloque_inferior_derecho = np.ascontiguousarray(img[mitad_alto:alto, mitad_ancho:ancho])
+    else:
+        bloque_inferior_derecho = img.crop((mitad_ancho, mitad_alto, ancho, alto))
 
     if debug:
-        bloque_inferior_derecho.save("bloque_inferior_derecho.png")
+        if isinstance(bloque_inferior_derecho, np.ndarray):
+            Image.fromarray(bloque_inferior_derecho).save("bloque_inferior_derecho.png")
+        else:
+            bloque_inferior_derecho.save("bloque_inferior_derecho.png")
         logging.info("Bloque inferior derecho guardado como imagen de depuración.")
 
     return bloque_inferior_derecho
@@ -392,6 +1083,7 @@ def dividir_y_extraer_inferior_derecha(img: Image.Image, debug=False):
 
 def extraer_texto_paddleocr(path_pdf):
     try:
+        from paddleocr import PaddleOCR
         #ocr = PaddleOCR(use_angle_cls=True, lang='es')
         ocr = PaddleOCR(
                 use_angle_cls=True,
@@ -442,41 +1134,69 @@ def extraer_texto_paddleocr(path_pdf):
         return ""
 """
 
-def extraer_texto_easyocr(path_pdf, reader, debug=False):
-    try:
-        doc = fitz.open(path_pdf)
-        texto = "" 
-        
-        for i, page in enumerate(doc):
-            pix = page.get_pixmap(dpi=300)
-            img_pil = Image.open(io.BytesIO(pix.tobytes("png")))
-
-            # === Preprocesar si está habilitado ===
-            if USAR_PREPROCESAMIENTO_CV2:
-                img_np = preprocesar_para_easyocr(img_pil)
-                img_pil = Image.fromarray(img_np)
+def extraer_texto_easyocr_lote(documentos, reader, tamano_lote=None, debug=False):
+    """
+    Ejecuta EasyOCR en memoria (sin archivos temporales) sobre las páginas de uno
+    o varios documentos. Las páginas del mismo tamaño van juntas a
+    readtext_batched, que exige imágenes de igual forma.
 
-            temp_path = os.path.join(TEMP_DIR, f"temp_easyocr_{i}.png")
-            img_pil.save(temp_path)
+    Parámetros:
+        documentos (dict): {clave: lista de páginas (array RGB o VariantesPagina)}.
+        reader: easyocr.Reader (None usa el del worker, ver obtener_modelo).
+        tamano_lote (int): recortes por lote de reconocimiento ([ocr] easyocr_tamano_lote).
 
-            # Validar si reader_easyocr está disponible antes de llamar readtext
-            if reader is not None:
-                results = reader.readtext(temp_path, detail=0)
+    Retorna:
+        dict: {clave: texto}. Un grupo con error deja "" en los documentos que
+        participaban en él.
+    """
+    if reader is None:
+        reader = obtener_modelo('easyocr')
+    if reader is None:
+        raise ValueError("EasyOCR no está disponible.")
+    tamano_lote = max(1, tamano_lote or EASYOCR_TAMANO_LOTE)
+
+    # Variante ecualizada si el preprocesamiento está habilitado, agrupada por forma
+    por_forma = {}
+    for clave, paginas in documentos.items():
+        for idx, pagina in enumerate(paginas):
+            imagen = np.ascontiguousarray(como_variantes(pagina).para_motor('easyocr'))
+            por_forma.setdefault(imagen.shape, []).append((clave, idx, imagen))
+
+    salidas = {}
+    con_error = set()
+    for grupo in por_forma.values():
+        try:
+            if len(grupo) == 1:
+                resultados = [reader.readtext(grupo[0][2], detail=0, batch_size=tamano_lote)]
             else:
-                raise ValueError("EasyOCR no está disponible.")
-            texto_pagina = " ".join(results)
-            texto += texto_pagina + "\n"
-
+                resultados = reader.readtext_batched([imagen for _, _, imagen in grupo], detail=0, batch_size=tamano_lote)
+            for (clave, idx, _), lineas in zip(grupo, resultados):
+                salidas[(clave, idx)] = " ".join(lineas)
+        except Exception as e:
+            logging.error(f"Error en EasyOCR (lote de {len(grupo)} páginas): {e}")
+            con_error.update(clave for clave, _, _ in grupo)
+
+    textos = {}
+    for clave, paginas in documentos.items():
+        if clave in con_error:
+            textos[clave] = ""
+            continue
+        texto = ""
+        for idx in range(len(paginas)):
+            texto += salidas[(clave, idx)] + "\n"
             if debug:
-                print(f"[DEBUG] Página {i+1}: {texto_pagina}")
-
-            os.remove(temp_path)
+                print(f"[DEBUG] Página {idx+1}: {salidas[(clave, idx)]}")
+        textos[clave] = texto.strip()
+    return textos
 
-        doc.close()
+def extraer_texto_easyocr(path_pdf, reader, debug=False, paginas=None):
+    try:
+        if paginas is None:
+            paginas = renderizar_paginas(path_pdf)
+        texto = extraer_texto_easyocr_lote({path_pdf: paginas}, reader, debug=debug)[path_pdf]
         if debug:
             logging.info("EasyOCR extracción exitosa.")
-        return texto.strip()
-
+        return texto
     except Exception as e:
         logging.error(f"Error en EasyOCR: {e}")
         return ""
@@ -488,14 +1208,13 @@ def extraer_texto_tesseract_old(path_pdf):
 
         for page in doc:
             pix = page.get_pixmap(dpi=300)
-            img_pil = Image.open(io.BytesIO(pix.tobytes("png")))
+            img_rgb = pixmap_a_array(pix)
 
             # === Preprocesamiento condicional ===
             if USAR_PREPROCESAMIENTO_CV2:
-                img_np = preprocesar_para_tesseract(img_pil)      # procesado con OpenCV
-                img = Image.fromarray(img_np)                 # convertir a PIL.Image
+                img = preprocesar_para_tesseract(img_rgb)      # procesado con OpenCV
             else:
-                img = img_pil
+                img = img_rgb
 
             texto += pytesseract.image_to_string(img, lang='spa')
 
@@ -507,115 +1226,191 @@ def extraer_texto_tesseract_old(path_pdf):
         logging.error(f"Error en Tesseract: {e}")
         return ""
 
-def extraer_texto_tesseract_psm6(path_pdf, debug=False):
-    try:
-        doc = fitz.open(path_pdf)
-        texto = ""
-        whitelist = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_.:,;/()$%&+°ÑñáéíóúÁÉÍÓÚ"
-        custom_config = f'--psm 6 -l spa -c tessedit_char_whitelist="{whitelist}"'
-
-        for num, page in enumerate(doc, 1):
-            pix = page.get_pixmap(dpi=300)
-            img_pil = Image.open(io.BytesIO(pix.tobytes("png")))
+TESSERACT_WHITELIST = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_.:,;/()$%&+°ÑñáéíóúÁÉÍÓÚ"
+TESSERACT_PSM = {'tesseract4': 4, 'tesseract6': 6}
 
-            if USAR_PREPROCESAMIENTO_CV2:
-                img_np = preprocesar_para_tesseract(img_pil)
-                img = Image.fromarray(img_np)
-            else:
-                img = img_pil
-
-            texto_extraido = pytesseract.image_to_string(img, config=custom_config)
-            if debug:
-                print(f"Texto extraído página {num}:\n{texto_extraido}\n{'-'*40}")
-            texto += texto_extraido + "\n"
-
-        doc.close()
-        logging.info("Tesseract PSM6 extracción exitosa.")
-        return texto.strip()
-    except Exception as e:
-        logging.error(f"Error en Tesseract PSM6: {e}")
-        return ""
-        
-def extraer_texto_tesseract_psm4(path_pdf, debug=False):
-    try:
-        doc = fitz.open(path_pdf)
-        texto = ""
-        whitelist = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_.:,;/()$%&+°ÑñáéíóúÁÉÍÓÚ"
-        custom_config = f'--psm 4 -l spa -c tessedit_char_whitelist="{whitelist}"'
+def hilos_tesseract():
+    """
+    Hilos por worker para Tesseract: sale del presupuesto por worker
+    (ver coordinar_hilos) para no sobresuscribir la CPU.
+    """
+    if HILOS_TESSERACT > 0:
+        return HILOS_TESSERACT
+    return hilos_worker()
 
-        for num, page in enumerate(doc, 1):
-            pix = page.get_pixmap(dpi=300)
-            img_pil = Image.open(io.BytesIO(pix.tobytes("png")))
+def extraer_texto_tesseract_modos(path_pdf, metodos, debug=False, paginas=None, timeout=0, excedidos=None):
+    """
+    Preprocesa cada página una sola vez y ejecuta los modos PSM pedidos
+    ('tesseract4', 'tesseract6') en paralelo con un pool de hilos acotado.
+    Cada llamada a tesseract es un subproceso externo, por lo que los hilos no
+    compiten por el GIL. Retorna {metodo: texto}; un modo con error queda en "".
 
-            if USAR_PREPROCESAMIENTO_CV2:
-                img_np = preprocesar_para_tesseract(img_pil)
-                img = Image.fromarray(img_np)
-            else:
-                img = img_pil
+    Con timeout (segundos) pytesseract mata el subproceso que lo supera: esa
+    página queda sin texto y se cuenta en excedidos ({metodo: páginas}).
+    """
+    if paginas is None:
+        paginas = renderizar_paginas(path_pdf)
+    por_pagina = _tesseract_por_pagina(paginas, metodos, debug=debug, timeout=timeout, excedidos=excedidos)
+    return {
+        metodo: "".join(texto + "\n" for texto in textos if texto is not None).strip()
+        for metodo, textos in por_pagina.items()
+    }
+
+def _tesseract_por_pagina(paginas, metodos, debug=False, timeout=0, excedidos=None):
+    """
+    Ejecuta los modos PSM pedidos sobre todas las páginas (o recortes) en un
+    solo pool de hilos. Retorna {metodo: [texto de cada página]}: None en las
+    páginas que superaron el timeout y en todas las de un modo con error.
+    """
+    imagenes = [como_variantes(pagina).para_motor('tesseract') for pagina in paginas]
+
+    with ThreadPoolExecutor(max_workers=hilos_tesseract()) as executor:
+        futuros = {
+            metodo: [
+                executor.submit(
+                    pytesseract.image_to_string, img,
+                    config=f'--psm {TESSERACT_PSM[metodo]} -l spa -c tessedit_char_whitelist="{TESSERACT_WHITELIST}"',
+                    timeout=timeout,
+                )
+                for img in imagenes
+            ]
+            for metodo in metodos
+        }
+
+        textos = {}
+        for metodo, futuros_paginas in futuros.items():
+            psm = TESSERACT_PSM[metodo]
+            try:
+                textos[metodo] = []
+                for num, futuro in enumerate(futuros_paginas, 1):
+                    try:
+                        texto_extraido = futuro.result()
+                    except RuntimeError as e:
+                        if 'timeout' not in str(e).lower():
+                            raise
+                        logging.warning(f"⏱️ Tesseract PSM{psm} superó {timeout:.0f}s en la página {num}")
+                        if excedidos is not None:
+                            excedidos[metodo] = excedidos.get(metodo, 0) + 1
+                        textos[metodo].append(None)
+                        continue
+                    if debug:
+                        print(f"Texto extraído página {num}:\n{texto_extraido}\n{'-'*40}")
+                    textos[metodo].append(texto_extraido)
+                if debug:
+                    logging.info(f"Tesseract PSM{psm} extracción exitosa.")
+            except Exception as e:
+                logging.error(f"Error en Tesseract PSM{psm}: {e}")
+                textos[metodo] = [None] * len(imagenes)
+    return textos
+
+def _preparar_imagen_doctr(imagen):
+    """Acepta VariantesPagina o array RGB (p. ej. el recorte del segmento de totales)."""
+    img_np = como_variantes(imagen).para_motor('doctr')
+    # Asegurar que img_np tenga 3 canales (RGB) para DocTR
+    if len(img_np.shape) == 2:
+        img_np = cv2.cvtColor(img_np, cv2.COLOR_GRAY2RGB)
+    return img_np
+
+def _texto_pagina_doctr(pagina_doctr):
+    texto = ""
+    for block in pagina_doctr.blocks:
+        for line in block.lines:
+            texto += " ".join([word.value for word in line.words]) + "\n"
+    return texto
+
+def _texto_segmento_desde_pagina_doctr(pagina_doctr):
+    """Texto del cuadrante inferior derecho a partir de la geometría de las palabras de la página."""
+    texto = ""
+    for block in pagina_doctr.blocks:
+        for line in block.lines:
+            palabras = [word.value for word in line.words if _centro_en_segmento_totales(word.geometry)]
+            if palabras:
+                texto += " ".join(palabras) + "\n"
+    return texto
+
+def extraer_texto_doctr_lote(documentos, model, tamano_lote=None, debug=False, layout=None, sin_segmento=()):
+    """
+    Ejecuta DocTR en lotes sobre las páginas y segmentos de totales de varios documentos.
 
-            texto_extraido = pytesseract.image_to_string(img, config=custom_config)
-            if debug:
-                print(f"Texto extraído página {num}:\n{texto_extraido}\n{'-'*40}")
-            texto += texto_extraido + "\n"
+    Parámetros:
+        documentos (dict): {clave: lista de páginas (array RGB o VariantesPagina)}.
+        model: predictor DocTR (None usa el global del worker).
+        tamano_lote (int): imágenes por llamada al modelo ([ocr] doctr_tamano_lote).
+        layout (dict): si se pasa, recibe {clave: [(página, palabra, x0, y0, x1, y1, confianza), ...]}
+            con la geometría normalizada de DocTR.
+        sin_segmento: claves sin segmento de totales (recortes de regiones).
 
-        doc.close()
+    Retorna:
+        dict: {clave: texto} con el mismo formato que extraer_texto_doctr
+        (texto de página + [SEGMENTO_TOTALES]). Un lote con error deja "" en
+        los documentos que participaban en él.
+    """
+    if model is None:
+        model = obtener_modelo('doctr')
+    tamano_lote = max(1, tamano_lote or DOCTR_TAMANO_LOTE)
+
+    # Entradas en orden de aparición: (clave, página, tipo, imagen RGB)
+    entradas = []
+    for clave, paginas in documentos.items():
+        for idx, pagina in enumerate(paginas):
+            entradas.append((clave, idx, 'pagina', pagina))
+            if SEGMENTO_TOTALES_DESDE_PAGINA or clave in sin_segmento:
+                continue
+            bloque = dividir_y_extraer_inferior_derecha(como_variantes(pagina).rgb, debug=False)
+            if bloque is not None:
+                entradas.append((clave, idx, 'segmento', bloque))
+
+    salidas = {}
+    con_error = set()
+    for inicio in range(0, len(entradas), tamano_lote):
+        tanda = entradas[inicio:inicio + tamano_lote]
+        try:
+            resultado = model([_preparar_imagen_doctr(e[3]) for e in tanda])
+            for (clave, idx, tipo, _), pagina_doctr in zip(tanda, resultado.pages):
+                salidas[(clave, idx, tipo)] = pagina_doctr
+        except Exception as e:
+            logging.error(f"Error en DocTR (lote de {len(tanda)} imágenes): {e}")
+            con_error.update(e[0] for e in tanda)
         if debug:
-            logging.info("Tesseract PSM4 extracción exitosa.")
-        return texto.strip()
-    except Exception as e:
-        logging.error(f"Error en Tesseract PSM4: {e}")
-        return ""
+            logging.info(f"DocTR lote {inicio // tamano_lote + 1}: {len(tanda)} imágenes.")
 
-def extraer_texto_doctr(path_pdf, model, debug=False):
-    try:
-        global predictor_doctr
-        if model is None:
-            model = predictor_doctr
-        doc = fitz.open(path_pdf)
+    textos = {}
+    for clave, paginas in documentos.items():
+        if clave in con_error:
+            textos[clave] = ""
+            continue
         texto = ""
-
-        for page in doc:
-            pix = page.get_pixmap(dpi=300)
-            img_pil = Image.open(io.BytesIO(pix.tobytes('png'))).convert('RGB')
-
-            if USAR_PREPROCESAMIENTO_CV2:
-                img_np = preprocesar_imagen_cv2(img_pil)
-                # Asegurar que img_np tenga 3 canales (RGB) para DocTR
-                if len(img_np.shape) == 2:
-                    img_np = cv2.cvtColor(img_np, cv2.COLOR_GRAY2RGB)
-            else:
-                img_np = np.array(img_pil)
-
-            result = model([img_np])
-            for block in result.pages[0].blocks:
-                for line in block.lines:
-                    texto += " ".join([word.value for word in line.words]) + "\n"
-
-            bloque_inferior_derecho = dividir_y_extraer_inferior_derecha(img_pil, debug=False)
+        for idx in range(len(paginas)):
+            pagina_doctr = salidas[(clave, idx, 'pagina')]
+            texto += _texto_pagina_doctr(pagina_doctr)
+            if layout is not None:
+                layout.setdefault(clave, []).extend(
+                    (idx, word.value, float(x0), float(y0), float(x1), float(y1), float(word.confidence))
+                    for block in pagina_doctr.blocks for line in block.lines for word in line.words
+                    for (x0, y0), (x1, y1) in [word.geometry]
+                )
+            if clave in sin_segmento:
+                continue
             texto += "\n[SEGMENTO_TOTALES]\n"
-
-            if bloque_inferior_derecho:
-                if USAR_PREPROCESAMIENTO_CV2:
-                    bloque_np = preprocesar_imagen_cv2(bloque_inferior_derecho)
-                    # Asegurar que bloque_np tenga 3 canales (RGB) para DocTR
-                    if len(bloque_np.shape) == 2:
-                        bloque_np = cv2.cvtColor(bloque_np, cv2.COLOR_GRAY2RGB)
-                else:
-                    bloque_np = np.array(bloque_inferior_derecho)
-
-                resultado_segmento = model([bloque_np])
-                if resultado_segmento.pages[0].blocks:
-                    for block in resultado_segmento.pages[0].blocks:
-                        for line in block.lines:
-                            texto += " ".join([word.value for word in line.words]) + "\n"
-                else:
-                    texto += "[Sin texto detectado en segmento totales]\n"
+            if SEGMENTO_TOTALES_DESDE_PAGINA:
+                texto_segmento = _texto_segmento_desde_pagina_doctr(pagina_doctr)
+                texto += texto_segmento or "[Sin texto detectado en segmento totales]\n"
+                continue
+            segmento = salidas.get((clave, idx, 'segmento'))
+            if segmento is not None and segmento.blocks:
+                texto += _texto_pagina_doctr(segmento)
             else:
                 texto += "[Sin texto detectado en segmento totales]\n"
+        textos[clave] = texto.strip()
+    return textos
 
-        doc.close()
+def extraer_texto_doctr(path_pdf, model, debug=False, paginas=None):
+    try:
+        if paginas is None:
+            paginas = renderizar_paginas(path_pdf)
+        texto = extraer_texto_doctr_lote({path_pdf: paginas}, model, debug=debug)[path_pdf]
         logging.info("DocTR extracción exitosa.")
-        return texto.strip()
+        return texto
     except Exception as e:
         logging.error(f"Error en DocTR: {e}")
         return ""
@@ -675,54 +1470,279 @@ def extraer_texto_nativo(pdf_path, modo="blocks", debug=False):
         return ""
     
     
+# ===========================
+# Caché de resultados OCR (direccionada por contenido)
+# ===========================
+_firmas_motor = {}
+_escrituras_cache = 0
+
+def calcular_hash_archivo(path_pdf):
+    sha256_hash = hashlib.sha256()
+    with open(path_pdf, "rb") as f:
+        for byte_block in iter(lambda: f.read(1024 * 1024), b""):
+            sha256_hash.update(byte_block)
+    return sha256_hash.hexdigest()
+
+def firma_motor(metodo):
+    """
+    Versión del motor + DPI + flags de preprocesamiento que afectan su salida.
+    Forma parte de la clave de caché: cambiar cualquiera invalida los resultados previos.
+    """
+    if metodo in _firmas_motor:
+        return _firmas_motor[metodo]
+    try:
+        if metodo == 'paddleocr':
+            import paddleocr
+            version = paddleocr.__version__
+        elif metodo == 'doctr':
+            import doctr
+            version = doctr.__version__
+        elif metodo in ('tesseract4', 'tesseract6'):
+            version = str(pytesseract.get_tesseract_version())
+        elif metodo == 'easyocr':
+            import easyocr
+            version = easyocr.__version__
+        else:
+            version = fitz.VersionBind
+    except Exception:
+        version = 'desconocida'
+    flags = f"cv2={int(USAR_PREPROCESAMIENTO_CV2)}"
+    if ORIENTACION_POR_PAGINA and metodo in MOTOR_DE_METODO:
+        flags += f",orientacion={ORIENTACION_LADO_MAX}/{ORIENTACION_CONFIANZA_MINIMA}"
+    if metodo == 'doctr' and USAR_PREPROCESAMIENTO_CV2:
+        flags += f",deskew={DESKEW_LADO_MAX}/{DESKEW_ANGULO_MINIMO}"
+    if metodo in ('paddleocr', 'doctr'):
+        flags += f",segmento_pagina={int(SEGMENTO_TOTALES_DESDE_PAGINA)},backend={BACKEND_INFERENCIA}"
+    motor = MOTOR_DE_METODO.get(metodo)
+    if motor is None:
+        dpi = 0
+    elif DPI_MOTORES[motor] == 'auto':
+        dpi = f"auto[{DPI_AUTO_MINIMO}-{DPI_TOPE_MOTORES[motor]}]"
+    else:
+        dpi = DPI_MOTORES[motor]
+    _firmas_motor[metodo] = f"{metodo}|{version}|dpi={dpi}|{flags}"
+    return _firmas_motor[metodo]
+
+def _ruta_cache_ocr(hash_archivo, metodo):
+    clave = hashlib.sha256(f"{hash_archivo}|{firma_motor(metodo)}".encode("utf-8")).hexdigest()
+    return os.path.join(DIRECTORIO_CACHE_OCR, clave[:2], clave + ".txt")
+
+def leer_cache_ocr(hash_archivo, metodo):
+    """Retorna el texto cacheado o None. Un acierto renueva el mtime (orden de desalojo LRU)."""
+    if not CACHE_OCR or not hash_archivo:
+        return None
+    ruta = _ruta_cache_ocr(hash_archivo, metodo)
+    try:
+        with open(ruta, "r", encoding="utf-8") as f:
+            texto = f.read()
+        os.utime(ruta, None)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Error leyendo caché OCR ({metodo}): {e}")
+        return None
+    logger.info(f"Caché OCR: acierto {metodo} para hash {hash_archivo[:12]}")
+    return texto
+
+def leer_cache_metodos(hash_archivo, metodos):
+    textos = {}
+    for metodo in metodos:
+        texto = leer_cache_ocr(hash_archivo, metodo)
+        if texto is not None:
+            textos[metodo] = texto
+    return textos
+
+def guardar_cache_ocr(hash_archivo, metodo, texto):
+    global _escrituras_cache
+    if not CACHE_OCR or not hash_archivo or not texto.strip():
+        return
+    ruta = _ruta_cache_ocr(hash_archivo, metodo)
+    try:
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        temporal = f"{ruta}.{os.getpid()}.tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            f.write(texto)
+        os.replace(temporal, ruta)
+    except Exception as e:
+        logger.warning(f"Error guardando caché OCR ({metodo}): {e}")
+        return
+    _escrituras_cache += 1
+    if _escrituras_cache % 50 == 0:
+        podar_cache_ocr()
+
+def podar_cache_ocr():
+    """
+    Desaloja por tamaño: si la caché supera [ocr] cache_ocr_max_mb, elimina los
+    archivos con mtime más antiguo hasta quedar bajo el 90% del límite.
+    """
+    if not CACHE_OCR or not os.path.isdir(DIRECTORIO_CACHE_OCR):
+        return
+    archivos = []
+    total = 0
+    for raiz, _, nombres in os.walk(DIRECTORIO_CACHE_OCR):
+        for nombre in nombres:
+            ruta = os.path.join(raiz, nombre)
+            try:
+                st = os.stat(ruta)
+            except FileNotFoundError:
+                continue
+            archivos.append((st.st_mtime, st.st_size, ruta))
+            total += st.st_size
+    limite = CACHE_OCR_MAX_MB * 1024 * 1024
+    if total <= limite:
+        return
+    objetivo = limite * 0.9
+    eliminados = 0
+    for _, tamano, ruta in sorted(archivos):
+        if total <= objetivo:
+            break
+        try:
+            os.remove(ruta)
+            total -= tamano
+            eliminados += 1
+        except FileNotFoundError:
+            pass
+    logger.info(f"Caché OCR podada: {eliminados} archivos eliminados, {total / 1024 / 1024:.1f} MB restantes.")
+
 # ===========================
 # Funciones de Base de Datos
 # ===========================
 
-def guardar_texto_total(nombre_archivo, metodo, texto):
+# Conexión persistente por proceso e hilo: el planificador hace todas las escrituras
+_bd_local = threading.local()
+
+SQL_INSERTAR_TEXTO = """
+    INSERT INTO extracciones_texto_total (documento_id, metodo, texto_extraccion, entropia, metricas_calidad, estado_ocr, motivo_ocr)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE texto_extraccion = VALUES(texto_extraccion), entropia = VALUES(entropia),
+        metricas_calidad = VALUES(metricas_calidad), estado_ocr = VALUES(estado_ocr), motivo_ocr = VALUES(motivo_ocr)
+"""
+
+# Columnas que escribe este script y la migración de sql/ que las crea: todas son obligatorias
+COLUMNAS_REQUERIDAS = (
+    ('extracciones_texto_total', 'estado_ocr', 'sql/001_extracciones_estado_ocr.sql'),
+    ('extracciones_texto_total', 'motivo_ocr', 'sql/001_extracciones_estado_ocr.sql'),
+    ('extracciones_texto_total', 'metricas_calidad', 'sql/002_extracciones_metricas_calidad.sql'),
+    ('documentos', 'en_blanco', 'sql/003_documentos_en_blanco.sql'),
+)
+
+def verificar_esquema_bd():
+    """
+    Antes de procesar: confirma que la base tiene las columnas de COLUMNAS_REQUERIDAS.
+    Si falta alguna termina con el listado de migraciones a aplicar, en vez de
+    fallar documento por documento en cada INSERT.
+    """
+    connection = obtener_conexion_bd()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT TABLE_NAME, COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS "
+            "WHERE TABLE_SCHEMA = %s AND TABLE_NAME IN ('documentos', 'extracciones_texto_total')",
+            (DB_NAME,))
+        existentes = {(tabla, columna) for tabla, columna in cursor.fetchall()}
+    faltantes = [(tabla, columna, migracion) for tabla, columna, migracion in COLUMNAS_REQUERIDAS
+                 if (tabla, columna) not in existentes]
+    if not faltantes:
+        return
+    migraciones = sorted({migracion for _, _, migracion in faltantes})
+    mensaje = (f"Esquema de base de datos desactualizado, faltan "
+               f"{', '.join(f'{tabla}.{columna}' for tabla, columna, _ in faltantes)}. "
+               f"Aplicar: {', '.join(migraciones)}")
+    logger.error(f"❌ {mensaje}")
+    print(f"❌ {mensaje}")
+    sys.exit(1)
+
+def obtener_conexion_bd():
+    """
+    Retorna la conexión persistente del hilo actual, abriéndola la primera vez y
+    revalidándola con ping (reconecta si el servidor la cerró). Reemplaza el
+    connect/close por cada documento y método.
+    """
+    connection = getattr(_bd_local, 'connection', None)
+    if connection is not None:
+        try:
+            connection.ping(reconnect=True)
+            return connection
+        except Exception as e:
+            logger.warning(f"Conexión a base de datos perdida, se abrirá una nueva: {e}")
+            cerrar_conexion_bd()
+    _bd_local.connection = pymysql.connect(host=DB_HOST, user=DB_USER, password=DB_PASS, database=DB_NAME)
+    return _bd_local.connection
+
+def cerrar_conexion_bd():
+    connection = getattr(_bd_local, 'connection', None)
+    _bd_local.connection = None
+    if connection is not None:
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+def _revertir(connection):
+    try:
+        connection.rollback()
+    except Exception:
+        pass
+
+def guardar_textos_documento(documento_id, nombre_archivo, textos, omitidos=None, metricas=None, en_blanco=False, incompletos=None):
     """
-    Guarda el texto extraído en la base de datos. Usa logger para registrar eventos.
-    Compatible con multiprocessing.
-    Incluye cálculo y guardado de entropía del texto.
+    Guarda todos los métodos de un documento en una sola transacción: un INSERT
+    multi-fila con textos extraídos (con su vector de métricas de calidad) y
+    métodos omitidos (estado_ocr = 'omitido', texto vacío) más el paso del
+    documento a estado 2 ('texto_ok'). Si algo falla no queda nada a medias.
+    Con en_blanco=True el documento pasa a estado 2 marcado en documentos.en_blanco
+    aunque no tenga textos. Los métodos en incompletos ({metodo: (estado_ocr, motivo)})
+    no terminaron todas sus páginas: su texto parcial queda con estado_ocr = 'timeout'
+    (cortado por tiempo) o 'error' (falló alguna tarea). Retorna False si la
+    transacción falló y se revirtió.
     """
+    metricas = metricas or {}
+    incompletos = incompletos or {}
+    filas = []
+    for metodo, texto in textos.items():
+        estado, motivo = incompletos.get(metodo, ('ejecutado', None))
+        if not texto.strip():
+            if motivo:
+                filas.append((documento_id, metodo, '', 0, None, estado, motivo[:255]))
+                logger.info(f"Método incompleto registrado - Documento ID: {documento_id}, Metodo: {metodo}, {estado} ({motivo})")
+                continue
+            logger.warning(f"No se extrajo texto con {metodo}, no se guarda.")
+            continue
+        metricas_metodo = metricas.get(metodo) or metricas_calidad(texto)
+        entropia_valor = metricas_metodo['entropia']
+        filas.append((documento_id, metodo, texto, entropia_valor, serializar_metricas(metricas_metodo),
+                      estado, motivo[:255] if motivo else None))
+        logger.info(f"Texto con entropía {entropia_valor:.2f} para el método {metodo}")
+    guardados = len(filas)
+    for metodo, motivo in (omitidos or {}).items():
+        filas.append((documento_id, metodo, '', 0, None, 'omitido', motivo[:255]))
+        logger.info(f"Método omitido registrado - Documento ID: {documento_id}, Metodo: {metodo} ({motivo})")
+    if not filas:
+        return True
+
     connection = None
     try:
-        connection = pymysql.connect(host=DB_HOST, user=DB_USER, password=DB_PASS, database=DB_NAME)
-        try:
-            with connection.cursor() as cursor:
-                sql_doc_id = "SELECT id FROM documentos WHERE nombre_archivo = %s and estado=1 LIMIT 10"
-                cursor.execute(sql_doc_id, (nombre_archivo,))
-                result = cursor.fetchone()
-                if result:
-                    documento_id = result[0]
-                    # Calcular entropía antes de insertar
-                    entropia_valor = calcular_entropia(texto)
-                    sql_insert = """
-                        INSERT INTO extracciones_texto_total (documento_id, metodo, texto_extraccion, entropia)
-                        VALUES (%s, %s, %s, %s)
-                        ON DUPLICATE KEY UPDATE texto_extraccion = VALUES(texto_extraccion), entropia = VALUES(entropia)
-                    """
-                    cursor.execute(sql_insert, (documento_id, metodo, texto, entropia_valor))
-                       # Actualizar estado en la base de datos a 2 'texto_ok'
-                    actualizar_estado_documento(nombre_archivo, 2)
-                    
-                    logger.info(f"Texto guardado exitosamente - Documento: {nombre_archivo}, Metodo: {metodo}")
-                    logger.info(f"Texto con entropía {entropia_valor:.2f} para el método {metodo}")
-                else:
-                    logger.warning(f"Documento no encontrado en base de datos: {nombre_archivo}")
-            connection.commit()
-        except Exception as inner_e:
-            logger.error(f"Error al insertar texto total: {inner_e}")
+        connection = obtener_conexion_bd()
+        with connection.cursor() as cursor:
+            # pymysql arma un solo INSERT ... VALUES (...), (...) para executemany
+            cursor.executemany(SQL_INSERTAR_TEXTO, filas)
+            if en_blanco:
+                cursor.execute("UPDATE documentos SET estado = %s, en_blanco = 1 WHERE id = %s", (2, documento_id))
+            elif guardados:
+                # Actualizar estado en la base de datos a 2 'texto_ok'
+                cursor.execute("UPDATE documentos SET estado = %s WHERE id = %s", (2, documento_id))
+        connection.commit()
+        logger.info(f"Textos guardados exitosamente - Documento: {nombre_archivo}, métodos: {guardados}")
+        return True
     except Exception as e:
-        logger.error(f"Error conectando a la base de datos: {e}")
-    finally:
         if connection:
-            connection.close()
+            _revertir(connection)
+        logger.error(f"Error guardando textos de '{nombre_archivo}': {e}")
+        return False
 
 def actualizar_estado_documento(nombre_archivo, estado):
     connection = None
     try:
-        connection = pymysql.connect(host=DB_HOST, user=DB_USER, password=DB_PASS, database=DB_NAME)
+        connection = obtener_conexion_bd()
         with connection.cursor() as cursor:
             sql_update = """
                 UPDATE documentos
@@ -730,13 +1750,12 @@ def actualizar_estado_documento(nombre_archivo, estado):
                 WHERE nombre_archivo = %s 
             """
             cursor.execute(sql_update, (estado, nombre_archivo))
-            connection.commit()
-            logging.info(f"Estado actualizado: {nombre_archivo} -> {estado}")
+        connection.commit()
+        logging.info(f"Estado actualizado: {nombre_archivo} -> {estado}")
     except Exception as e:
-        logging.error(f"Error actualizando estado documento: {e}")
-    finally:
         if connection:
-            connection.close()
+            _revertir(connection)
+        logging.error(f"Error actualizando estado documento: {e}")
 
 def mover_a_errores(path_pdf, mensaje_error=""):
     nombre_archivo = os.path.basename(path_pdf)
@@ -767,122 +1786,918 @@ def mover_a_errores(path_pdf, mensaje_error=""):
 # ===========================
 
 
-def procesar_archivo_con_modelos(path_pdf):
-    global _models
+def documento_pendiente(path_pdf):
+    """
+    Valida en la base de datos que el documento esté registrado y en estado 1 (pendiente).
+    Si el estado es distinto, mueve el PDF a excepciones.
+    Retorna la fila del documento (id, estado, tipo_documento, hash_archivo, resolucion_ppi) o None.
+    """
     archivo = os.path.basename(path_pdf)
-    try:
-        logger.info(f"[{multiprocessing.current_process().name}] Procesando archivo: {archivo}")
-        connection = None
-        try:
-            connection = pymysql.connect(host=DB_HOST, user=DB_USER, password=DB_PASS, database=DB_NAME, cursorclass=pymysql.cursors.DictCursor)
-            with connection.cursor() as cursor:
-                cursor.execute("SELECT id, estado FROM documentos WHERE nombre_archivo = %s and estado=1 order by id desc ", (archivo,))
-                doc = cursor.fetchone()
-
-                if not doc:
-                    logger.warning(f"Documento '{archivo}' no está registrado en la base de datos. Falta procesamiento previo.")
-                    return
-
-                if doc['estado'] != 1:
-                    logger.warning(f"Documento '{archivo}' ya fue procesado (estado actual: {doc['estado']}). Se moverá a excepciones.")
-                    mover_a_errores(path_pdf, mensaje_error="Documento ya procesado o con estado diferente a 1 o 'pendiente'.")
-                    return
-
-                if doc['estado'] == 1:
-                    if debug:
-                        logger.info(f"Iniciando extracción de texto para: {path_pdf}")
-                    textos = {}
-
-                
-                    try:
-                        if USE_PADDLEOCR:
-                            ocr_paddle = _models.get('paddleocr', None)
-                            textos['paddleocr'] = extraer_texto_paddleocr_v2(path_pdf, ocr_paddle, debug=False)
-                        if USE_EASYOCR:
-                            ocr_easy = _models.get('easyocr', None)
-                            textos['easyocr'] = extraer_texto_easyocr(path_pdf, ocr_easy, debug=False)
-                        if USE_TESSERACT4:
-                            textos['tesseract4'] = extraer_texto_tesseract_psm4(path_pdf, debug=False)
-                        if USE_TESSERACT6:
-                            textos['tesseract6'] = extraer_texto_tesseract_psm6(path_pdf, debug=False)
-                        if USE_DOCTR:
-                            ocr_doctr = _models.get('doctr', None)
-                            textos['doctr'] = extraer_texto_doctr(path_pdf, ocr_doctr, debug=False)
-                        if USE_NATIVO:
-                            textos['nativo'] = extraer_texto_nativo(path_pdf, modo="blocks", debug=False)
-                    except Exception as ocr_e:
-                        logger.error(f"Error durante extracción OCR de '{archivo}': {ocr_e}")
-                        mover_a_errores(path_pdf, mensaje_error=f"Error OCR: {ocr_e}")
-                        return
-
-                    for metodo, texto in textos.items():
-                        if texto.strip():
-                            guardar_texto_total(archivo, metodo, texto)
-                        else:
-                            logger.warning(f"No se extrajo texto con {metodo}, no se guarda.")
-
-                    # Mover archivo PDF a carpeta de procesados
-                    if not os.path.exists(CARPETA_PROCESADOS):
-                        os.makedirs(CARPETA_PROCESADOS)
-                    destino = os.path.join(CARPETA_PROCESADOS, archivo)
-                    os.rename(path_pdf, destino)
-                    if debug:
-                        logger.info(f"Archivo movido a: {destino}")
-                        logger.info(f"[{multiprocessing.current_process().name}] Finalizado: {archivo}")
-                else:   
-                    logger.info(f"archivo no en estado 1  no se proceso. : {path_pdf}")
-                          
+    connection = obtener_conexion_bd()
+    with connection.cursor(pymysql.cursors.DictCursor) as cursor:
+        cursor.execute("SELECT id, estado, tipo_documento, hash_archivo, resolucion_ppi FROM documentos WHERE nombre_archivo = %s and estado=1 order by id desc ", (archivo,))
+        doc = cursor.fetchone()
+    # Cerrar la transacción de lectura para que la próxima consulta vea datos frescos
+    connection.commit()
+
+    if not doc:
+        logger.warning(f"Documento '{archivo}' no está registrado en la base de datos. Falta procesamiento previo.")
+        return None
 
-        except Exception as e:
-            logger.error(f"Error procesando archivo '{archivo}': {e}")
-        finally:
-            if connection:
-                connection.close()
-    except Exception as e:
-        logger.error(f"Error general al procesar '{archivo}': {e}")
+    if doc['estado'] != 1:
+        logger.warning(f"Documento '{archivo}' ya fue procesado (estado actual: {doc['estado']}). Se moverá a excepciones.")
+        mover_a_errores(path_pdf, mensaje_error="Documento ya procesado o con estado diferente a 1 o 'pendiente'.")
+        return None
+    return doc
+
+MOTORES_RASTER = ('paddleocr', 'easyocr', 'tesseract4', 'tesseract6', 'doctr')
+
+def motores_habilitados():
+    """Métodos habilitados en [ocr], en el orden histórico de ejecución."""
+    activos = {
+        'paddleocr': USE_PADDLEOCR,
+        'easyocr': USE_EASYOCR,
+        'tesseract4': USE_TESSERACT4,
+        'tesseract6': USE_TESSERACT6,
+        'doctr': USE_DOCTR,
+        'nativo': USE_NATIVO,
+    }
+    return [metodo for metodo, activo in activos.items() if activo]
+
+def texto_nativo_utilizable(texto):
+    """
+    Indica si la capa de texto del PDF sirve sin OCR: largo mínimo y proporción de
+    caracteres alfanuméricos (descarta fuentes sin mapa Unicode que extraen basura).
+    """
+    caracteres = [c for c in texto if not c.isspace()]
+    if len(caracteres) < RUTA_NATIVA_MIN_CARACTERES:
+        return False
+    alfanumericos = sum(1 for c in caracteres if c.isalnum())
+    return alfanumericos / len(caracteres) >= RUTA_NATIVA_MIN_ALFANUMERICO
 
+def medir_pagina_en_blanco(page):
+    """
+    Decide si una página fitz está en blanco a partir de un render en gris a
+    [ocr] blanco_dpi, sin los márgenes (bordes oscuros del escáner): desviación
+    estándar y fracción de píxeles con tinta (más oscuros que el fondo, la
+    mediana, en blanco_contraste niveles). Una página con capa de texto nunca es
+    blanca. Retorna (en_blanco, detalle).
+    """
+    if page.get_text("text").strip():
+        return False, "capa de texto"
+    pix = page.get_pixmap(dpi=BLANCO_DPI, colorspace=fitz.csGRAY, alpha=False)
+    gris = pixmap_a_array(pix, gris=True)
+    alto, ancho = gris.shape
+    margen_y, margen_x = int(alto * BLANCO_MARGEN), int(ancho * BLANCO_MARGEN)
+    zona = gris[margen_y:alto - margen_y, margen_x:ancho - margen_x]
+    if zona.size == 0:
+        zona = gris
+    desviacion = float(zona.std())
+    tinta = np.count_nonzero(zona < float(np.median(zona)) - BLANCO_CONTRASTE) / zona.size
+    en_blanco = desviacion <= BLANCO_MAX_DESVIACION or tinta <= BLANCO_MAX_TINTA
+    return en_blanco, f"tinta={tinta:.4f}, desv={desviacion:.1f}"
+
+def paginas_en_blanco(path_pdf):
+    """Lista (en_blanco, detalle) por página del PDF (ver medir_pagina_en_blanco)."""
+    with fitz.open(path_pdf) as doc:
+        return [medir_pagina_en_blanco(page) for page in doc]
+
+def planificar_metodos(path_pdf, doc):
+    """
+    Decide qué métodos correr para un documento. Si está registrado como 'nativo'
+    y su capa de texto es utilizable, solo se usa el texto nativo más, a lo sumo,
+    el motor [ocr] ruta_nativa_ocr. Retorna (metodos, textos ya extraídos).
+    """
+    metodos = motores_habilitados()
+    if not RUTA_NATIVA or doc.get('tipo_documento') != 'nativo':
+        return metodos, {}
+
+    texto_nativo = extraer_texto_nativo(path_pdf, modo="blocks", debug=False)
+    if not texto_nativo_utilizable(texto_nativo):
+        logger.info(f"Ruta nativa descartada para '{os.path.basename(path_pdf)}': capa de texto insuficiente.")
+        return metodos, {}
+
+    metodos_ocr = [RUTA_NATIVA_OCR] if RUTA_NATIVA_OCR in metodos and RUTA_NATIVA_OCR != 'nativo' else []
+    logger.info(f"Ruta nativa para '{os.path.basename(path_pdf)}': OCR adicional = {metodos_ocr or 'ninguno'}")
+    return metodos_ocr, {'nativo': texto_nativo}
+
+# Patrones de anclas conocidas para la compuerta de calidad; otras se buscan como palabra
+PATRONES_ANCLAS = {
+    'RUT': r"R\.?\s?U\.?\s?T|\d{1,2}\.?\d{3}\.?\d{3}\s?-\s?[\dK]\b",
+    'PATENTE': r"PATENTE|P\.?\s?P\.?\s?U\b|PLACA",
+    'TOTAL': r"TOTAL",
+}
+
+def evaluar_compuerta_calidad(texto, metricas=None):
+    """
+    Compuerta barata de la cascada: largo, entropía y anclas presentes. Si ya se
+    calcularon las métricas de calidad del texto, se reutiliza su entropía.
+    Retorna (suficiente, detalle).
+    """
+    limpio = texto.strip()
+    entropia = metricas['entropia'] if metricas else calcular_entropia(limpio)
+    texto_mayus = limpio.upper()
+    anclas = [
+        ancla for ancla in CASCADA_ANCLAS
+        if re.search(PATRONES_ANCLAS.get(ancla, rf"\b{re.escape(ancla)}\b"), texto_mayus)
+    ]
+    suficiente = (
+        len(limpio) >= CASCADA_MIN_CARACTERES
+        and entropia >= CASCADA_MIN_ENTROPIA
+        and len(anclas) >= CASCADA_MIN_ANCLAS
+    )
+    detalle = f"largo={len(limpio)} entropia={entropia:.2f} anclas={','.join(anclas) or '-'}"
+    return suficiente, detalle
 
-# Inicializador para modelos OCR con validación de rutas y logs
-DETECT_MODEL_DIR = '/AI/ia_sch/models/paddle/det_model_es'
-REC_MODEL_DIR = '/AI/ia_sch/models/paddle/rec_model_es'
-CLS_MODEL_DIR = '/AI/ia_sch/models/paddle/cls_model_es'
+# ===========================
+# Planificación por página: unidades (documento, página, motor)
+# ===========================
 
-def initializer():
-    global _models
+# Unidad de trabajo del pool para cada método; ambos PSM de Tesseract comparten preprocesamiento
+MOTOR_DE_METODO = {
+    'paddleocr': 'paddleocr',
+    'easyocr': 'easyocr',
+    'tesseract4': 'tesseract',
+    'tesseract6': 'tesseract',
+    'doctr': 'doctr',
+}
+
+# Motores que corren dentro del worker: se cortan por tiempo reciclando el worker
+MOTORES_EN_PROCESO = ('paddleocr', 'doctr', 'easyocr')
+
+# Motores que procesan en lote páginas de varios documentos: páginas por tarea del pool
+PAGINAS_POR_TAREA_LOTE = {
+    'doctr': DOCTR_PAGINAS_POR_TAREA,
+    'easyocr': EASYOCR_PAGINAS_POR_TAREA,
+}
+
+def _copiar_a_memoria_compartida(img_np):
+    shm = shared_memory.SharedMemory(create=True, size=max(1, img_np.nbytes))
+    destino = np.ndarray(img_np.shape, dtype=np.uint8, buffer=shm.buf)
+    destino[:] = img_np
+    del destino
+    shm.close()
+    return shm.name, img_np.shape
+
+def rasterizar_pagina_compartida(path_pdf, num_pagina, variantes=(), dpi=DPI_OCR, rotacion=None):
+    """
+    Renderiza una página, calcula las variantes de preprocesamiento pedidas y deja
+    todo en memoria compartida para que los motores lo lean sin copiarlo ni
+    volver a preprocesar. Retorna ({variante: (nombre del bloque, forma)}, rotación);
+    el proceso principal libera los bloques cuando el documento termina. Con
+    [ocr] orientacion_por_pagina la página se gira aquí, una vez para todos los
+    motores; la rotación ya detectada en otro DPI se pasa en rotacion y evita OSD.
+    """
+    doc = fitz.open(path_pdf)
+    try:
+        pix = doc[num_pagina].get_pixmap(dpi=dpi, colorspace=fitz.csRGB, alpha=False)
+        rgb = pixmap_a_array(pix)
+        if ORIENTACION_POR_PAGINA:
+            rgb, rotacion = orientar_pagina(rgb, rotacion)
+        pagina = VariantesPagina(rgb)
+    finally:
+        doc.close()
+    ref = {}
     try:
-        if USE_PADDLEOCR:
-            # Validación explícita de rutas
-            if not (os.path.isdir(DETECT_MODEL_DIR) and os.path.isdir(REC_MODEL_DIR) and os.path.isdir(CLS_MODEL_DIR)):
-                logger.error(f"Una o más rutas de modelos PaddleOCR no existen: det={DETECT_MODEL_DIR}, rec={REC_MODEL_DIR}, cls={CLS_MODEL_DIR}")
+        for nombre in ('rgb',) + tuple(variantes):
+            ref[nombre] = _copiar_a_memoria_compartida(pagina.obtener(nombre))
+    except Exception:
+        liberar_pagina_compartida(ref)
+        raise
+    return ref, rotacion or 0
+
+def _adjuntar_paginas(refs):
+    """Páginas de solo lectura sobre memoria compartida (sin copia), como VariantesPagina."""
+    bloques = []
+    paginas = []
+    for ref in refs:
+        vistas = {}
+        for nombre, (bloque, forma) in ref.items():
+            shm = shared_memory.SharedMemory(name=bloque)
+            bloques.append(shm)
+            vista = np.ndarray(forma, dtype=np.uint8, buffer=shm.buf)
+            vista.setflags(write=False)
+            vistas[nombre] = vista
+        paginas.append(VariantesPagina(vistas.pop('rgb'), precalculadas=vistas))
+    return bloques, paginas
+
+def liberar_pagina_compartida(ref):
+    for bloque, _ in ref.values():
+        try:
+            shm = shared_memory.SharedMemory(name=bloque)
+            shm.close()
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+def _recortes_roi(pagina, roi):
+    """Recortes de la página por región de plantilla, reducidos al DPI que necesita cada región."""
+    rgb = como_variantes(pagina).rgb
+    recortes = {}
+    for nombre, region in roi['regiones'].items():
+        recorte = recortar_region(rgb, region['caja'], min(1.0, region['dpi'] / roi['dpi']))
+        if min(recorte.shape[:2]) >= 10:
+            recortes[nombre] = recorte
+    return recortes
+
+# Motores cuyo texto de página trae [SEGMENTO_TOTALES] (ver extraer_texto_paddleocr_v2 y extraer_texto_doctr_lote)
+MOTORES_CON_SEGMENTO = ('paddleocr', 'doctr')
+# Orden de lectura de las regiones de una plantilla (plantillas_roi.REGIONES más las de respaldo)
+ORDEN_REGIONES = ('cabecera', 'cuerpo', 'resto', 'totales', 'pie')
+
+def _unir_regiones(textos, motor):
+    """
+    Texto de página con el formato del OCR completo del motor: todas las regiones
+    en orden de lectura (los totales incluidos, como en la página completa) y,
+    solo en PaddleOCR/DocTR, el [SEGMENTO_TOTALES] con la región de totales.
+    """
+    texto = "\n".join(textos[nombre] for nombre in ORDEN_REGIONES if textos.get(nombre))
+    if motor not in MOTORES_CON_SEGMENTO:
+        return texto.strip()
+    return f"{texto}\n[SEGMENTO_TOTALES]\n{textos.get('totales') or '[Sin texto detectado en segmento totales]'}".strip()
+
+def _tiempo_tesseract(tarea):
+    """Timeout por llamada a tesseract: el de [ocr] tiempo_max_tesseract, acotado por lo que le queda al documento."""
+    limites = [TIEMPOS_MAX_MOTOR['tesseract']] if TIEMPOS_MAX_MOTOR['tesseract'] > 0 else []
+    if tarea.get('vence'):
+        limites.append(max(1.0, tarea['vence'] - time.time()))
+    return min(limites) if limites else 0
+
+def _ejecutar_motor_en_regiones(tarea, pagina):
+    """OCR de una página solo en las regiones de su plantilla (tarea['roi'])."""
+    motor = tarea['motor']
+    recortes = _recortes_roi(pagina, tarea['roi'])
+    if motor == 'paddleocr':
+        modelo = obtener_modelo('paddleocr')
+        return _unir_regiones({
+            nombre: extraer_texto_paddleocr_v2(tarea['path_pdf'], modelo, paginas=[recorte], segmento_totales=False)
+            for nombre, recorte in recortes.items()
+        }, motor), []
+    if motor == 'tesseract':
+        # Todas las regiones en un solo pool de hilos, como las páginas
+        por_region = _tesseract_por_pagina(list(recortes.values()), tarea['metodos'],
+                                           timeout=_tiempo_tesseract(tarea), excedidos=tarea['excedidos'])
+        return {
+            metodo: _unir_regiones({
+                nombre: "" if texto is None else texto.strip()
+                for nombre, texto in zip(recortes, por_region[metodo])
+            }, motor)
+            for metodo in tarea['metodos']
+        }, []
+    raise ValueError(f"Motor OCR desconocido: {motor}")
+
+def _ejecutar_motor_en_paginas(tarea, paginas):
+    """Retorna (resultado, layout); en motores en lote ambos van por clave."""
+    motor = tarea['motor']
+    if tarea.get('roi') and motor not in PAGINAS_POR_TAREA_LOTE:
+        return _ejecutar_motor_en_regiones(tarea, paginas[0])
+    if motor == 'paddleocr':
+        layout = []
+        texto = extraer_texto_paddleocr_v2(tarea['path_pdf'], obtener_modelo('paddleocr'), debug=False, paginas=paginas, layout=layout)
+        return texto, layout
+    if motor == 'tesseract':
+        return extraer_texto_tesseract_modos(tarea['path_pdf'], tarea['metodos'], debug=False, paginas=paginas,
+                                             timeout=_tiempo_tesseract(tarea), excedidos=tarea['excedidos']), []
+    if motor in PAGINAS_POR_TAREA_LOTE:
+        # Una página por clave: el lote puede mezclar páginas de varios documentos.
+        # Las páginas con plantilla entran como un recorte por (clave, región).
+        documentos = {}
+        rois = tarea.get('roi') or [None] * len(paginas)
+        for clave, pagina, roi in zip(tarea['claves'], paginas, rois):
+            if roi:
+                documentos.update({(clave, nombre): [recorte] for nombre, recorte in _recortes_roi(pagina, roi).items()})
             else:
+                documentos[clave] = [pagina]
+        regiones = [clave for clave in documentos if clave not in tarea['claves']]
+        layout = {}
+        if motor == 'doctr':
+            textos = extraer_texto_doctr_lote(documentos, obtener_modelo('doctr'), layout=layout, sin_segmento=set(regiones))
+        else:
+            textos = extraer_texto_easyocr_lote(documentos, obtener_modelo('easyocr'))
+        for clave, roi in zip(tarea['claves'], rois):
+            if roi:
+                textos[clave] = _unir_regiones({nombre: textos.pop((clave, nombre)) for (c, nombre) in regiones if c == clave}, motor)
+        return textos, {clave: entradas for clave, entradas in layout.items() if clave in tarea['claves']}
+    raise ValueError(f"Motor OCR desconocido: {motor}")
+
+def ejecutar_tarea(tarea):
+    """
+    Punto de entrada de los workers: ejecuta una unidad de trabajo y retorna su
+    resultado ('raster' -> referencias de la página, motor -> (texto, layout,
+    {metodo: partes que excedieron su tiempo})).
+    """
+    # Solo las tareas del planificador (con id) pueden devolverse al reciclar el worker
+    if 'id' in tarea and _eventos_tareas is not None and (RSS_MAX_WORKER_MB > 0 or DOCUMENTOS_POR_WORKER > 0):
+        motivo = motivo_reciclaje(tarea)
+        if motivo:
+            retirar_worker(tarea, motivo)
+    if tarea['tipo'] == 'raster':
+        return rasterizar_pagina_compartida(tarea['path_pdf'], tarea['pagina'], tarea['variantes'],
+                                            dpi=tarea.get('dpi_render') or tarea['dpi'], rotacion=tarea.get('rotacion'))
+
+    if tarea.get('vence') and time.time() > tarea['vence']:
+        raise TimeoutError("tiempo del documento agotado antes de iniciar la tarea")
+    vigilada = tarea.get('vigilada') and _eventos_tareas is not None
+    if vigilada:
+        _eventos_tareas.put(('inicio', tarea['id'], os.getpid(), time.time()))
+    tarea['excedidos'] = {}
+    bloques, paginas = _adjuntar_paginas(tarea['refs'])
+    try:
+        resultado, layout = _ejecutar_motor_en_paginas(tarea, paginas)
+        return resultado, layout, tarea['excedidos']
+    finally:
+        if vigilada:
+            # Desde aquí el planificador ya no puede matar este worker por la tarea
+            _eventos_tareas.put(('fin', tarea['id'], os.getpid(), time.time()))
+        del paginas
+        for shm in bloques:
+            try:
+                shm.close()
+            except BufferError:
+                # Aún hay vistas vivas (p. ej. en un traceback); el mapeo se libera con ellas
+                pass
+
+class PlanificadorPaginas:
+    """
+    Reparte un lote sobre el pool en unidades (documento, página, motor) para que
+    ningún worker quede esperando detrás de un documento largo o un motor lento.
+
+    Cada página se rasteriza y preprocesa una vez (las variantes que piden los
+    motores del documento) en memoria compartida y se encola para cada motor
+    pendiente; las páginas de los motores en lote (DocTR, EasyOCR) se acumulan
+    entre documentos hasta completar [ocr] <motor>_paginas_por_tarea. Cuando todas las partes de un
+    documento terminan, sus textos se reensamblan en orden de página y se guardan
+    en una sola transacción. En modo cascada cada documento avanza de a un método.
+
+    Con presupuestos de tiempo ([ocr] tiempo_max_<motor> por página,
+    tiempo_max_documento) una tarea que se pasa se corta: Tesseract mata su
+    subproceso y los motores que corren dentro del worker (MOTORES_EN_PROCESO)
+    se cortan matando el worker, que el pool reemplaza. El texto parcial se
+    guarda con estado_ocr = 'timeout' y el resto del lote sigue.
+
+    Todo el estado vive en el proceso principal; los callbacks del pool solo
+    encolan resultados.
+    """
+
+    def __init__(self, pool, debug=False):
+        self.pool = pool
+        self.debug = debug
+        self.resultados = queue.Queue()
+        self.documentos = {}
+        self.tareas_en_curso = 0
+        self.rasters_en_curso = 0
+        self.buffers_lote = {motor: [] for motor in PAGINAS_POR_TAREA_LOTE}
+        self.progreso = None
+        self.ids_tarea = itertools.count()
+        # Tareas sin resultado procesado {id: (tarea, AsyncResult)}, vigiladas en ejecución
+        # {id: (pid, inicio)} y último aviso de cada worker {pid: (evento, id)}
+        self.pendientes = {}
+        self.en_ejecucion = {}
+        self.ultimo_evento = {}
+        self.vigilar = (TIEMPO_MAX_DOCUMENTO > 0 or any(TIEMPOS_MAX_MOTOR[m] > 0 for m in MOTORES_EN_PROCESO)
+                        or RSS_MAX_WORKER_MB > 0 or DOCUMENTOS_POR_WORKER > 0)
+        self.ultima_vigilancia = 0.0
+        self.workers_reciclados = 0
+        # Tareas de workers matados o retirados: su trabajo queda sin resolver en la caché del pool
+        self.tareas_abandonadas = 0
+
+    def ejecutar(self, paths_pdf):
+        self.progreso = tqdm(total=len(paths_pdf), desc="Procesando PDF")
+        try:
+            for path_pdf in paths_pdf:
                 try:
-                    logger.info("Inicializando PaddleOCR...")
-                    _models['paddleocr'] = PaddleOCR(
-                        use_angle_cls=True,
-                        lang='es',
-                        det_model_dir=DETECT_MODEL_DIR,
-                        rec_model_dir=REC_MODEL_DIR,
-                        cls_model_dir=CLS_MODEL_DIR
-                    )
-                    logger.info("PaddleOCR cargado correctamente.")
+                    self._agregar(path_pdf)
                 except Exception as e:
-                    logger.error("❌ Error al cargar PaddleOCR: %s", e)
-                    raise
-        if USE_EASYOCR:
-            # Usar el reader_easyocr si está disponible, si no, None
-            _models['easyocr'] = reader_easyocr
-            if reader_easyocr is not None:
-                logger.info("EasyOCR cargado correctamente.")
+                    logger.error(f"Error procesando archivo '{os.path.basename(path_pdf)}': {e}")
+                    self._descartar(path_pdf)
+                self._vaciar_lotes(forzar=self.rasters_en_curso == 0)
+
+            while self.tareas_en_curso > 0:
+                try:
+                    tarea, resultado, error = self.resultados.get(timeout=1.0 if self.vigilar else None)
+                except queue.Empty:
+                    self._vigilar()
+                    continue
+                # Una tarea resuelta por el planificador (worker reciclado) puede
+                # recibir además su respuesta real: solo cuenta la primera
+                if self.pendientes.pop(tarea['id'], None) is None:
+                    continue
+                self.tareas_en_curso -= 1
+                self.en_ejecucion.pop(tarea['id'], None)
+                try:
+                    self._procesar_resultado(tarea, resultado, error)
+                except Exception as e:
+                    logger.error(f"Error en planificador OCR ({tarea['tipo']} {os.path.basename(tarea['path_pdf'])}): {e}")
+                self._vaciar_lotes(forzar=self.rasters_en_curso == 0)
+                if self.vigilar and time.time() - self.ultima_vigilancia >= 1.0:
+                    self._vigilar()
+
+            for path_pdf in list(self.documentos):
+                logger.error(f"Documento '{os.path.basename(path_pdf)}' quedó incompleto; se reintentará en la próxima tanda.")
+                self._descartar(path_pdf)
+            if self.workers_reciclados:
+                logger.info(f"♻️ Workers reciclados en el lote: {self.workers_reciclados}")
+        finally:
+            for path_pdf in list(self.documentos):
+                self._descartar(path_pdf)
+            self.progreso.close()
+
+    # --- Alta y avance de documentos ---
+
+    def _agregar(self, path_pdf):
+        archivo = os.path.basename(path_pdf)
+        logger.info(f"Procesando archivo: {archivo}")
+        doc = documento_pendiente(path_pdf)
+        if not doc:
+            self.progreso.update(1)
+            return
+        hash_archivo = None
+        if CACHE_OCR:
+            hash_archivo = doc.get('hash_archivo') or calcular_hash_archivo(path_pdf)
+        metodos, textos = planificar_metodos(path_pdf, doc)
+
+        # Cada motor renderiza a su DPI; los motores con el mismo DPI comparten páginas y variantes.
+        # documentos.resolucion_ppi no sirve para 'auto': se mide sobre el PDF
+        motores = list(dict.fromkeys(MOTOR_DE_METODO[m] for m in metodos if m in MOTOR_DE_METODO))
+        ppi = resolucion_efectiva_ppi(path_pdf) if any(DPI_MOTORES[motor] == 'auto' for motor in motores) else None
+        dpi_motor = {motor: dpi_para_motor(motor, ppi) for motor in motores}
+        variantes = {}
+        for motor, dpi in dpi_motor.items():
+            variantes.setdefault(dpi, set()).add(variante_para_motor(motor))
+        regiones = None
+        if OCR_POR_REGIONES:
+            rut, plantilla = reconocer_plantilla(path_pdf)
+            if plantilla:
+                regiones = plantilla['regiones']
+                # La clave de caché no distingue OCR por regiones
+                hash_archivo = None
+                logger.info(f"🧩 '{archivo}': plantilla {rut}, OCR de la primera página por regiones")
+        if debug:
+            logger.info(f"DPI por motor para '{archivo}' (resolución efectiva={ppi}): {dpi_motor}")
+
+        d = {
+            'path_pdf': path_pdf,
+            'documento_id': doc['id'],
+            'hash_archivo': hash_archivo,
+            'textos': textos,
+            'omitidos': {},
+            'metricas': {},
+            'layout': {},
+            'total_paginas': None,
+            'dpi': dpi_motor,
+            'variantes': {dpi: sorted(v - {'rgb'}) for dpi, v in variantes.items()},
+            'rasters': {},
+            # Rotación detectada por página y DPIs que esperan a conocerla {num: [dpi, ...]}
+            'rotaciones': {},
+            'rasters_en_espera': {},
+            'pasos': {},
+            'cascada': None,
+            'ultimo_cascada': None,
+            'blancas': set(),
+            'en_blanco': False,
+            'regiones': regiones,
+            # La primera página basta renderizarla al DPI de la región más exigente; cada recorte se reduce al suyo
+            'dpi_regiones': max(region['dpi'] for region in regiones.values()) if regiones else None,
+            'incompletos': {},
+            'vence': time.time() + TIEMPO_MAX_DOCUMENTO if TIEMPO_MAX_DOCUMENTO > 0 else None,
+        }
+        self.documentos[path_pdf] = d
+
+        if DETECTAR_PAGINAS_EN_BLANCO:
+            medidas = paginas_en_blanco(path_pdf)
+            d['total_paginas'] = len(medidas)
+            d['blancas'] = {num for num, (en_blanco, _) in enumerate(medidas) if en_blanco}
+            if medidas and len(d['blancas']) == len(medidas):
+                motivo = f"página en blanco ({medidas[0][1]})" if len(medidas) == 1 else f"{len(medidas)} páginas en blanco"
+                logger.info(f"📄 '{archivo}': {motivo}, se omite el OCR.")
+                d['omitidos'] = {metodo: motivo for metodo in metodos if metodo not in textos}
+                d['en_blanco'] = True
+                self._finalizar(d)
+                return
+            if d['blancas']:
+                logger.info(f"📄 '{archivo}': páginas en blanco sin OCR: {sorted(num + 1 for num in d['blancas'])}")
+
+        if MODO_CASCADA:
+            orden = [m for m in ORDEN_CASCADA if m in metodos]
+            orden += [m for m in metodos if m not in orden]
+            # Los textos ya extraídos (ruta nativa) se evalúan primero
+            d['cascada'] = [m for m in textos if m not in orden] + orden
+            self._avanzar_cascada(d)
+            return
+
+        textos.update(leer_cache_metodos(hash_archivo, [m for m in metodos if m not in textos]))
+        if 'nativo' in metodos and 'nativo' not in textos:
+            textos['nativo'] = extraer_texto_nativo(path_pdf, modo="blocks", debug=False)
+            guardar_cache_ocr(hash_archivo, 'nativo', textos['nativo'])
+        # Los textos que no vienen de metodos (ruta nativa: 'nativo') van primero
+        d['orden'] = [m for m in textos if m not in metodos] + metodos
+        self._iniciar_paso(d, [m for m in metodos if m not in textos])
+
+    def _iniciar_paso(self, d, metodos):
+        """Lanza los métodos indicados sobre todas las páginas del documento."""
+        d['pasos'] = {}
+        for metodo in metodos:
+            paso = d['pasos'].setdefault(MOTOR_DE_METODO[metodo], {'metodos': []})
+            paso['metodos'].append(metodo)
+        if not d['pasos']:
+            self._paso_terminado(d)
+            return
+
+        if d['total_paginas'] is None:
+            doc = fitz.open(d['path_pdf'])
+            d['total_paginas'] = doc.page_count
+            doc.close()
+        total_paginas = d['total_paginas']
+
+        for motor, paso in d['pasos'].items():
+            paso['partes'] = [None] * total_paginas
+            paso['faltan'] = total_paginas - len(d['blancas'])
+            paso['layout'] = []
+            paso['excedidos'] = {}
+            paso['errores'] = {}
+            for num in d['blancas']:
+                paso['partes'][num] = {metodo: "" for metodo in paso['metodos']} if motor == 'tesseract' else ""
+        if total_paginas == 0:
+            for paso in d['pasos'].values():
+                d['textos'].update({metodo: "" for metodo in paso['metodos']})
+            d['pasos'] = {}
+            self._paso_terminado(d)
+            return
+
+        # Rasterizar cada página una sola vez por DPI requerido
+        nuevos = sorted({d['dpi'][motor] for motor in d['pasos']} - set(d['rasters']))
+        for dpi in nuevos:
+            d['rasters'][dpi] = [None] * total_paginas
+        for num in range(total_paginas):
+            if num in d['blancas'] or not nuevos:
+                continue
+            if ORIENTACION_POR_PAGINA and num not in d['rotaciones']:
+                # OSD una vez por página, en el DPI más bajo; los demás reusan el ángulo
+                self._enviar_raster(d, num, nuevos[0])
+                d['rasters_en_espera'][num] = nuevos[1:]
             else:
-                logger.error("EasyOCR no está disponible.")
-        if USE_DOCTR:
-            _models['doctr'] = ocr_predictor(pretrained=True)
-            logger.info("DocTR cargado correctamente.")
-    except Exception as e:
-        logger.error(f"Error inicializando modelos OCR: {e}")
+                for dpi in nuevos:
+                    self._enviar_raster(d, num, dpi)
+        for dpi, refs in d['rasters'].items():
+            for num, ref in enumerate(refs):
+                if ref is not None:
+                    self._enviar_pagina(d, dpi, num)
+
+    def _enviar_raster(self, d, num, dpi):
+        self.rasters_en_curso += 1
+        tarea = {
+            'tipo': 'raster', 'path_pdf': d['path_pdf'], 'pagina': num,
+            'dpi': dpi, 'variantes': d['variantes'][dpi], 'rotacion': d['rotaciones'].get(num),
+        }
+        if num == 0 and d['regiones']:
+            # Página de la plantilla: los motores solo ven recortes, sin variantes
+            tarea.update(dpi_render=min(dpi, d['dpi_regiones']), variantes=[])
+        self._enviar(tarea)
+
+    def _paso_terminado(self, d):
+        if d['cascada'] is not None:
+            self._avanzar_cascada(d)
+        else:
+            self._finalizar(d)
+
+    def _avanzar_cascada(self, d):
+        """
+        Evalúa la compuerta de calidad sobre el último método y lanza el siguiente
+        del orden [ocr] orden_cascada, o finaliza el documento si ya es suficiente.
+        """
+        archivo = os.path.basename(d['path_pdf'])
+        while True:
+            metodo = d['ultimo_cascada']
+            if metodo is not None:
+                suficiente, detalle = evaluar_compuerta_calidad(d['textos'].get(metodo, ""), d['metricas'].get(metodo))
+                logger.info(f"Cascada '{archivo}': {metodo} -> {'suficiente' if suficiente else 'continuar'} ({detalle})")
+                if suficiente:
+                    for restante in d['cascada']:
+                        d['omitidos'][restante] = f"cascada: {metodo} suficiente ({detalle})"
+                    d['cascada'] = []
+            if not d['cascada']:
+                self._finalizar(d)
+                return
+
+            metodo = d['cascada'].pop(0)
+            d['ultimo_cascada'] = metodo
+            if metodo in d['textos']:
+                continue
+            texto = leer_cache_ocr(d['hash_archivo'], metodo)
+            if texto is None and metodo == 'nativo':
+                texto = extraer_texto_nativo(d['path_pdf'], modo="blocks", debug=False)
+                guardar_cache_ocr(d['hash_archivo'], metodo, texto)
+            if texto is not None:
+                d['textos'][metodo] = texto
+                continue
+            self._iniciar_paso(d, [metodo])
+            return
+
+    def _finalizar(self, d):
+        path_pdf = d['path_pdf']
+        archivo = os.path.basename(path_pdf)
+        self.documentos.pop(path_pdf, None)
+        self._liberar_paginas(d)
+        # Mantener el orden de los métodos configurados
+        orden = d.get('orden') or []
+        orden = orden + [metodo for metodo in d['textos'] if metodo not in orden]
+        textos = {metodo: d['textos'][metodo] for metodo in orden if metodo in d['textos']}
+        try:
+            # Textos que no pasaron por el pool (nativo, caché) aún no tienen métricas
+            metricas = {metodo: d['metricas'].get(metodo) or metricas_calidad(texto) for metodo, texto in textos.items()}
+            if not guardar_textos_documento(d['documento_id'], archivo, textos, d['omitidos'], metricas,
+                                            en_blanco=d['en_blanco'], incompletos=d['incompletos']):
+                # Sin textos en la base el documento sigue en estado 1: no puede ir a procesados
+                mover_a_errores(path_pdf, mensaje_error="Error OCR: no se pudieron guardar los textos")
+                self.progreso.update(1)
+                return
+            if GUARDAR_LAYOUT:
+                ruta = guardar_layout(d['documento_id'], archivo, d['layout'])
+                if ruta and self.debug:
+                    logger.info(f"Layout OCR guardado en: {ruta}")
+
+            # Mover archivo PDF a carpeta de procesados
+            if not os.path.exists(CARPETA_PROCESADOS):
+                os.makedirs(CARPETA_PROCESADOS)
+            destino = os.path.join(CARPETA_PROCESADOS, archivo)
+            os.rename(path_pdf, destino)
+            if self.debug:
+                logger.info(f"Archivo movido a: {destino}")
+        except Exception as e:
+            logger.error(f"Error general al procesar '{archivo}': {e}")
+        logger.debug(f"Documento finalizado: {archivo}")
+        self.progreso.update(1)
+
+    def _fallar(self, d, mensaje):
+        self.documentos.pop(d['path_pdf'], None)
+        self._liberar_paginas(d)
+        logger.error(f"Error durante extracción OCR de '{os.path.basename(d['path_pdf'])}': {mensaje}")
+        mover_a_errores(d['path_pdf'], mensaje_error=f"Error OCR: {mensaje}")
+        self.progreso.update(1)
+
+    def _descartar(self, path_pdf):
+        d = self.documentos.pop(path_pdf, None)
+        if d is not None:
+            self._liberar_paginas(d)
+        self.progreso.update(1)
+
+    def _liberar_paginas(self, d):
+        # Sacar del lote las páginas pendientes: sus bloques dejan de existir
+        for buffer in self.buffers_lote.values():
+            buffer[:] = [entrada for entrada in buffer if entrada[0] != d['path_pdf']]
+        for refs in d['rasters'].values():
+            for ref in refs:
+                if ref is not None:
+                    liberar_pagina_compartida(ref)
+        d['rasters'] = {}
+
+    # --- Envío de tareas y recepción de resultados ---
+
+    def _enviar(self, tarea):
+        self.tareas_en_curso += 1
+        tarea['id'] = next(self.ids_tarea)
+        asincrono = self.pool.apply_async(
+            ejecutar_tarea, (tarea,),
+            callback=lambda resultado, t=tarea: self.resultados.put((t, resultado, None)),
+            error_callback=lambda error, t=tarea: self.resultados.put((t, None, error)),
+        )
+        self.pendientes[tarea['id']] = (tarea, asincrono)
+
+    def _con_presupuesto(self, tarea, vence=None):
+        """
+        Agrega a una tarea de motor su límite ([ocr] tiempo_max_<motor> por página)
+        y el vencimiento de su documento; las de motores en proceso se vigilan.
+        """
+        motor = tarea['motor']
+        if motor in MOTORES_EN_PROCESO and TIEMPOS_MAX_MOTOR[motor] > 0:
+            tarea['limite'] = TIEMPOS_MAX_MOTOR[motor] * len(tarea.get('claves') or [None])
+        if vence:
+            tarea['vence'] = vence
+        tarea['vigilada'] = motor in MOTORES_EN_PROCESO and bool(tarea.get('limite') or vence)
+        return tarea
+
+    def _vigilar(self):
+        """
+        Atiende los avisos de los workers (inicio y fin de tareas vigiladas,
+        retiro por memoria o documentos atendidos), recicla los workers cuyas
+        tareas superaron su límite o el vencimiento de su documento, y cierra con
+        lo obtenido los documentos vencidos.
+
+        Solo se mata un worker cuyo último aviso es el inicio de la tarea vencida:
+        uno que ya la terminó puede estar con una tarea no vigilada (raster,
+        Tesseract) o esperando en la cola del pool con su lock tomado.
+        """
+        ahora = self.ultima_vigilancia = time.time()
+        while _eventos_tareas is not None and not _eventos_tareas.empty():
+            evento, id_tarea, pid, dato = _eventos_tareas.get()
+            if evento == 'retiro':
+                self.ultimo_evento.pop(pid, None)
+                if id_tarea in self.pendientes:
+                    self._devolver_tarea(id_tarea, pid, dato)
+                continue
+            self.ultimo_evento[pid] = (evento, id_tarea)
+            if evento == 'fin':
+                self.en_ejecucion.pop(id_tarea, None)
+            elif id_tarea in self.pendientes:
+                self.en_ejecucion[id_tarea] = (pid, dato)
+
+        for id_tarea, (pid, inicio) in list(self.en_ejecucion.items()):
+            if id_tarea not in self.pendientes or self.ultimo_evento.get(pid) != ('inicio', id_tarea):
+                del self.en_ejecucion[id_tarea]
+                continue
+            tarea, _ = self.pendientes[id_tarea]
+            vencimientos = [inicio + tarea['limite']] if tarea.get('limite') else []
+            if tarea.get('vence'):
+                vencimientos.append(tarea['vence'])
+            if ahora < min(vencimientos):
+                continue
+            del self.en_ejecucion[id_tarea]
+            del self.ultimo_evento[pid]
+            self._reciclar_worker(pid, tarea, ahora - inicio)
+
+        for d in list(self.documentos.values()):
+            if d['vence'] and ahora > d['vence']:
+                self._vencer_documento(d)
+
+    def _devolver_tarea(self, id_tarea, pid, motivo):
+        """
+        Un worker se retiró antes de ejecutar la tarea que tomó: se da por cerrada
+        (su trabajo en el pool queda abandonado) y se reenvía como tarea nueva.
+        """
+        tarea, _ = self.pendientes.pop(id_tarea)
+        self.tareas_en_curso -= 1
+        self.workers_reciclados += 1
+        self.tareas_abandonadas += 1
+        logger.info(f"♻️ Worker {pid} reciclado ({motivo}); su tarea de '{os.path.basename(tarea['path_pdf'])}' se reenvía")
+        self._enviar({clave: valor for clave, valor in tarea.items() if clave != 'id'})
+
+    def _reciclar_worker(self, pid, tarea, duracion):
+        """
+        Mata el worker de una tarea vencida y encola su resultado como TimeoutError.
+        La tarea muerta nunca responderá en el pool; si la respuesta real llega
+        igual (terminó justo antes), el bucle de ejecutar descarta la segunda.
+        """
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        self.workers_reciclados += 1
+        self.tareas_abandonadas += 1
+        mensaje = f"{tarea['motor']} superó su tiempo ({duracion:.0f}s); worker {pid} reciclado"
+        logger.warning(f"♻️ {mensaje} ('{os.path.basename(tarea['path_pdf'])}')")
+        self.resultados.put((tarea, None, TimeoutError(mensaje)))
+
+    def _vencer_documento(self, d):
+        """Cierra un documento que superó tiempo_max_documento con los textos parciales."""
+        motivo = f"tiempo del documento excedido ({TIEMPO_MAX_DOCUMENTO:.0f}s)"
+        logger.warning(f"⏱️ '{os.path.basename(d['path_pdf'])}': {motivo}; se guarda lo obtenido.")
+        for motor, paso in d['pasos'].items():
+            self._ensamblar_paso(d, motor, paso, motivo)
+        d['pasos'] = {}
+        for restante in d['cascada'] or []:
+            d['omitidos'][restante] = motivo
+        d['cascada'] = None
+        self._finalizar(d)
+
+    def _enviar_pagina(self, d, dpi, num):
+        ref = d['rasters'][dpi][num]
+        # Las plantillas describen la primera página
+        roi = {'regiones': d['regiones'], 'dpi': min(dpi, d['dpi_regiones'])} if d['regiones'] and num == 0 else None
+        for motor, paso in d['pasos'].items():
+            if d['dpi'][motor] != dpi:
+                continue
+            if motor in self.buffers_lote:
+                self.buffers_lote[motor].append((d['path_pdf'], num, ref, roi))
+                continue
+            self._enviar(self._con_presupuesto({
+                'tipo': 'motor', 'motor': motor, 'metodos': paso['metodos'],
+                'path_pdf': d['path_pdf'], 'pagina': num, 'refs': [ref], 'roi': roi,
+            }, d['vence']))
+
+    def _vaciar_lotes(self, forzar=False):
+        """
+        Envía las páginas acumuladas de cada motor en lote en tareas de
+        <motor>_paginas_por_tarea. Con forzar=True (no quedan páginas por
+        rasterizar) se envía también el resto.
+        """
+        for motor, buffer in self.buffers_lote.items():
+            por_tarea = PAGINAS_POR_TAREA_LOTE[motor]
+            while buffer and (forzar or len(buffer) >= por_tarea):
+                tanda = buffer[:por_tarea]
+                del buffer[:len(tanda)]
+                # Un lote mezcla documentos: solo rige el límite por página del motor
+                self._enviar(self._con_presupuesto({
+                    'tipo': 'motor', 'motor': motor, 'path_pdf': tanda[0][0],
+                    'claves': [(path_pdf, num) for path_pdf, num, _, _ in tanda],
+                    'refs': [ref for _, _, ref, _ in tanda],
+                    'roi': [roi for _, _, _, roi in tanda],
+                }))
+
+    def _procesar_resultado(self, tarea, resultado, error):
+        if tarea['tipo'] == 'raster':
+            self.rasters_en_curso -= 1
+            d = self.documentos.get(tarea['path_pdf'])
+            if error is not None:
+                if d is not None:
+                    self._fallar(d, f"rasterizando página {tarea['pagina'] + 1}: {error}")
+                return
+            ref, rotacion = resultado
+            if d is None:
+                liberar_pagina_compartida(ref)
+                return
+            d['rotaciones'][tarea['pagina']] = rotacion
+            d['rasters'][tarea['dpi']][tarea['pagina']] = ref
+            for dpi in d['rasters_en_espera'].pop(tarea['pagina'], ()):
+                self._enviar_raster(d, tarea['pagina'], dpi)
+            self._enviar_pagina(d, tarea['dpi'], tarea['pagina'])
+            return
+
+        excedidos = errores = {}
+        if isinstance(error, TimeoutError):
+            logging.warning(f"⏱️ {tarea['motor']} ({os.path.basename(tarea['path_pdf'])}): {error}")
+            excedidos = {metodo: 1 for metodo in tarea.get('metodos') or [tarea['motor']]}
+            resultado, layout = None, None
+        elif error is not None:
+            logging.error(f"Error en {tarea['motor']} ({os.path.basename(tarea['path_pdf'])}): {error}")
+            errores = {metodo: 1 for metodo in tarea.get('metodos') or [tarea['motor']]}
+            resultado, layout = None, None
+        else:
+            resultado, layout, excedidos = resultado
+        if 'claves' in tarea:
+            for clave in tarea['claves']:
+                texto = "" if resultado is None else resultado.get(clave, "")
+                self._registrar_parte(clave[0], tarea['motor'], clave[1], texto, (layout or {}).get(clave), excedidos, errores)
+        else:
+            self._registrar_parte(tarea['path_pdf'], tarea['motor'], tarea['pagina'], resultado, layout, excedidos, errores)
+
+    def _registrar_parte(self, path_pdf, motor, num, resultado, layout=None, excedidos=None, errores=None):
+        d = self.documentos.get(path_pdf)
+        if d is None or motor not in d['pasos']:
+            return
+        paso = d['pasos'][motor]
+        if resultado is None:
+            resultado = {metodo: "" for metodo in paso['metodos']} if motor == 'tesseract' else ""
+        paso['partes'][num] = resultado
+        # Las tareas procesan una página: se reemplaza el índice local por el del documento
+        paso['layout'].extend((num,) + tuple(entrada[1:]) for entrada in layout or ())
+        for metodo, partes in (excedidos or {}).items():
+            paso['excedidos'][metodo] = paso['excedidos'].get(metodo, 0) + partes
+        for metodo, partes in (errores or {}).items():
+            paso['errores'][metodo] = paso['errores'].get(metodo, 0) + partes
+        paso['faltan'] -= 1
+        if paso['faltan'] > 0:
+            return
+
+        self._ensamblar_paso(d, motor, paso)
+        del d['pasos'][motor]
+        if not d['pasos']:
+            self._paso_terminado(d)
+
+    def _ensamblar_paso(self, d, motor, paso, motivo=None):
+        """
+        Reensambla en orden de página el texto de cada método del paso (las partes
+        que faltan quedan vacías). Los textos incompletos (partes con error, cortadas
+        por tiempo o el motivo del corte del documento) quedan en d['incompletos']
+        y no van a la caché.
+        """
+        for metodo in paso['metodos']:
+            partes = [(p or {}).get(metodo, "") for p in paso['partes']] if motor == 'tesseract' else paso['partes']
+            texto = "\n".join(parte for parte in partes if parte).strip()
+            d['textos'][metodo] = texto
+            confianzas = [entrada[6] for entrada in paso['layout']]
+            confianza = sum(confianzas) / len(confianzas) if confianzas else None
+            d['metricas'][metodo] = metricas_calidad(texto, confianza)
+            if paso['layout']:
+                d['layout'][metodo] = paso['layout']
+            fallidas = paso['errores'].get(metodo)
+            excedidas = paso['excedidos'].get(metodo)
+            if fallidas:
+                d['incompletos'][metodo] = ('error', f"error en {fallidas} parte(s) de {len(paso['partes'])} página(s)")
+            elif motivo or excedidas:
+                d['incompletos'][metodo] = ('timeout', motivo or f"tiempo excedido en {excedidas} parte(s) de {len(paso['partes'])} página(s)")
+            else:
+                guardar_cache_ocr(d['hash_archivo'], metodo, texto)
 
 
+def procesar_lote(pool, paths_pdf, debug=False):
+    """
+    Reparte un lote de PDFs en un pool ya inicializado, a nivel de página y motor
+    (PlanificadorPaginas). Lo usan tanto la ejecución por script como el servicio
+    persistente. Retorna (archivos del lote, tareas abandonadas en el pool).
+    """
+    total = len(paths_pdf)
+    podar_cache_ocr()
+    planificador = PlanificadorPaginas(pool, debug=debug)
+    planificador.ejecutar(paths_pdf)
+    if debug:
+        logger.info(f"Lote finalizado: {total} archivos.")
+    return total, planificador.tareas_abandonadas
 
+def listar_pdfs_pendientes():
+    if not os.path.exists(DIRECTORIO_PDFS):
+        logger.error(f"Directorio no existe: {DIRECTORIO_PDFS}")
+        return []
+    return [os.path.join(DIRECTORIO_PDFS, f) for f in os.listdir(DIRECTORIO_PDFS) if f.lower().endswith('.pdf')]
 
 def procesar_directorio(debug=False):
     if not os.path.exists(DIRECTORIO_PDFS):
@@ -905,7 +2720,9 @@ def procesar_directorio(debug=False):
         return
 
     cantidad_archivos = len(paths_pdf)
-    procesos_a_utilizar = min(PROCESAMIENTO_SIMULTANEO, cantidad_archivos)
+    # El trabajo se reparte por página y motor: un solo PDF ya puede ocupar varios procesos
+    motores = len([m for m in motores_habilitados() if m in MOTORES_RASTER]) or 1
+    procesos_a_utilizar = min(PROCESAMIENTO_SIMULTANEO, cantidad_archivos * motores)
 
     if procesos_a_utilizar == 0:
         logging.info("📭 No hay archivos PDF para procesar.")
@@ -925,15 +2742,13 @@ def procesar_directorio(debug=False):
 
     warnings.filterwarnings("ignore", message=".*SIGTERM.*")
 
-    with multiprocessing.Pool(
-        processes=procesos_a_utilizar,
-        initializer=init_worker
-    ) as pool:
-        for resultado in tqdm(pool.imap_unordered(procesar_archivo_con_modelos, paths_pdf), total=total, desc="Procesando PDF"):
-            print("Subproceso ejecutado")
-            if debug:
-                logger.info("Subproceso ejecutado")
-        pool.close()
+    verificar_esquema_bd()
+    with crear_pool_ocr(procesos_a_utilizar) as pool:
+        procesar_lote(pool, paths_pdf, debug=debug)
+        cerrar_conexion_bd()
+        # Todas las tareas ya respondieron; las de workers reciclados quedan abandonadas
+        # en el pool y nunca terminan, así que close() + join() esperaría para siempre
+        pool.terminate()
         pool.join()
         if debug:
             logger.info("Procesamiento completo. Todos los subprocesos finalizados correctamente.")
@@ -946,12 +2761,118 @@ def procesar_directorio(debug=False):
 
 
 
+# ===========================
+# Servicio OCR persistente
+# ===========================
+
+class ServicioOCR:
+    """
+    Mantiene un pool de workers con los modelos OCR cargados y recibe lotes
+    por una cola local. Los lotes se procesan de a uno para no sobrecargar CPU.
+    Las tareas abandonadas por workers reciclados quedan para siempre en la caché
+    del pool: tras [ocr] servicio_tareas_abandonadas_max el pool se recrea entre lotes.
+    """
+
+    def __init__(self, pool, procesos, debug=False):
+        self.pool = pool
+        self.procesos = procesos
+        self.debug = debug
+        self.cola_lotes = queue.Queue()
+        self.lotes_procesados = 0
+        self.documentos_procesados = 0
+        self.tareas_abandonadas = 0
+        self.inicio = datetime.now()
+        threading.Thread(target=self._despachar, daemon=True).start()
+
+    def _despachar(self):
+        while True:
+            paths_pdf, listo, resumen = self.cola_lotes.get()
+            t0 = time.time()
+            try:
+                resumen['total'], abandonadas = procesar_lote(self.pool, paths_pdf, debug=self.debug)
+                self.lotes_procesados += 1
+                self.documentos_procesados += resumen['total']
+                self.tareas_abandonadas += abandonadas
+                if 0 < SERVICIO_TAREAS_ABANDONADAS_MAX <= self.tareas_abandonadas:
+                    self._renovar_pool()
+            except Exception as e:
+                logger.error(f"Error procesando lote en servicio OCR: {e}")
+                resumen['error'] = str(e)
+            finally:
+                resumen['duracion_seg'] = round(time.time() - t0, 2)
+                listo.set()
+
+    def _renovar_pool(self):
+        """Reemplaza el pool (sin tareas en curso entre lotes); los modelos se recargan."""
+        logger.info(f"♻️ Servicio OCR: {self.tareas_abandonadas} tareas abandonadas en el pool, se recrea.")
+        self.pool.terminate()
+        self.pool.join()
+        self.pool = crear_pool_ocr(self.procesos)
+        self.tareas_abandonadas = 0
+
+    def procesar_directorio(self):
+        """Encola los PDFs pendientes y bloquea hasta que el lote termine."""
+        paths_pdf = listar_pdfs_pendientes()
+        resumen = {'total': 0}
+        if not paths_pdf:
+            logger.warning("No hay archivos PDF para procesar.")
+            return resumen
+        logger.info(f"📥 Servicio OCR: lote recibido con {len(paths_pdf)} archivos.")
+        listo = threading.Event()
+        self.cola_lotes.put((paths_pdf, listo, resumen))
+        listo.wait()
+        logger.info(f"✅ Servicio OCR: lote finalizado {resumen}")
+        return resumen
+
+    def estado(self):
+        return {
+            'procesos': self.procesos,
+            'lotes_en_cola': self.cola_lotes.qsize(),
+            'lotes_procesados': self.lotes_procesados,
+            'documentos_procesados': self.documentos_procesados,
+            'tareas_abandonadas': self.tareas_abandonadas,
+            'activo_desde': self.inicio.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+
+def iniciar_servicio(debug=False):
+    from servicio_ocr import GestorServicioOCR, clave_servicio, crear_gestor, SERVICIO_OCR_HOST, SERVICIO_OCR_PUERTO
+
+    clave = clave_servicio(crear=True)
+    if clave is None:
+        print("❌ Servicio OCR sin clave utilizable: se cancela el inicio.")
+        sys.exit(1)
+    verificar_esquema_bd()
+    procesos = max(1, PROCESAMIENTO_SIMULTANEO)
+    logging.info(f"🧵 Servicio OCR: iniciando pool persistente con {procesos} procesos.")
+    pool = crear_pool_ocr(procesos)
+    servicio = ServicioOCR(pool, procesos, debug=debug)
+
+    GestorServicioOCR.register('servicio', callable=lambda: servicio)
+    servidor = crear_gestor(clave).get_server()
+
+    def handler_sigterm(signum, frame):
+        logger.info(f"Señal de finalización recibida en servicio OCR: {signum}")
+        servicio.pool.terminate()
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, handler_sigterm)
+    print(f"Servicio OCR escuchando en {SERVICIO_OCR_HOST}:{SERVICIO_OCR_PUERTO}")
+    logging.info(f"👂 Servicio OCR escuchando en {SERVICIO_OCR_HOST}:{SERVICIO_OCR_PUERTO}")
+    try:
+        servidor.serve_forever()
+    finally:
+        servicio.pool.terminate()
+        servicio.pool.join()
+
 def main():
 
     multiprocessing.set_start_method("spawn", force=True)
 
     parser = argparse.ArgumentParser()
     parser.add_argument('--debug', action='store_true', help='Activa modo debug')
+    parser.add_argument('--servicio', action='store_true', help='Inicia el servicio OCR persistente (modelos cargados entre tandas)')
+    parser.add_argument('--benchmark-hilos', type=int, nargs='?', const=3, metavar='PDFS',
+                        help='Mide cada reparto procesos x hilos del presupuesto de núcleos sobre PDFS archivos de entrada (por defecto 3)')
     args, _ = parser.parse_known_args()
     global debug
     debug = args.debug
@@ -965,7 +2886,12 @@ def main():
         logging.getLogger('ppocr').propagate = True
 
     print("Main iniciado correctamente")
-    procesar_directorio(debug=args.debug)
+    if args.benchmark_hilos:
+        benchmark_hilos(muestra=args.benchmark_hilos)
+    elif args.servicio:
+        iniciar_servicio(debug=args.debug)
+    else:
+        procesar_directorio(debug=args.debug)
 
 if __name__ == "__main__":
     try:
@@ -2889,7 +2889,7 @@ def cargar_textos_desde_bd(forzar_id=None):
                 sql = """
                     SELECT id, documento_id, metodo, texto_extraccion
                     FROM extracciones_texto_total
-                    WHERE documento_id = %s AND deleted_at IS NULL
+                    WHERE documento_id = %s AND deleted_at IS NULL AND texto_extraccion <> ''
                 """
                 cursor.execute(sql, (forzar_id,))
             else:
@@ -2898,6 +2898,7 @@ def cargar_textos_desde_bd(forzar_id=None):
                     FROM extracciones_texto_total
                     inner join documentos on documentos.id = extracciones_texto_total.documento_id
                     WHERE documentos.estado = 2 AND documentos.deleted_at IS NULL 
+                    AND extracciones_texto_total.texto_extraccion <> ''
                 """
                 cursor.execute(sql)
 
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# ===========================
+# Métricas de calidad de texto OCR
+# ===========================
+# Vector pequeño de características que se guarda junto a la entropía en
+# extracciones_texto_total.metricas_calidad (JSON), para que cascada, consenso
+# y scoring decidan sin volver a leer el texto:
+#
+#   entropia               entropía de Shannon por carácter (igual que calcular_entropia)
+#   caracteres             caracteres sin contar espacios
+#   proporcion_alfabetica  letras / caracteres
+#   proporcion_digitos     dígitos / caracteres
+#   tasa_diccionario       palabras (3+ letras) presentes en diccionarios/ / palabras
+#   confianza_media        confianza media del motor (PaddleOCR, DocTR) o None
+#   lineas                 líneas no vacías
+#
+# Solo usa la librería estándar para que cualquier etapa pueda importarlo.
+import configparser
+import csv
+import json
+import logging
+import math
+import os
+import re
+from collections import Counter
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+config = configparser.ConfigParser()
+config.read(os.path.join(BASE_DIR, '../config/config.cf'))
+RUTAS_DICCIONARIOS = [
+    config.get('extraccion', clave, fallback=ruta)
+    for clave, ruta in (
+        ('ruta_diccionario_colores', '../diccionarios/Diccionario_colores.csv'),
+        ('ruta_diccionario_carrocerias', '../diccionarios/carrocerias.csv'),
+        ('ruta_diccionario_comunas', '../diccionarios/Diccionario_comunas.csv'),
+        ('ruta_diccionario_ciudades', '../diccionarios/Diccionario_ciudades.csv'),
+        ('ruta_diccionario_marcas', '../diccionarios/Diccionario_marcas.csv'),
+    )
+]
+
+PATRON_PALABRA = re.compile(r"[A-ZÁÉÍÓÚÜÑ]{3,}")
+
+_vocabulario = None
+
+
+def cargar_vocabulario():
+    """
+    Palabras (3+ letras, en mayúsculas) de todos los diccionarios de extracción.
+    Se carga una sola vez por proceso.
+    """
+    global _vocabulario
+    if _vocabulario is not None:
+        return _vocabulario
+    vocabulario = set()
+    for ruta in RUTAS_DICCIONARIOS:
+        if not os.path.isabs(ruta):
+            ruta = os.path.join(BASE_DIR, ruta)
+        try:
+            with open(ruta, encoding='utf-8-sig', newline='') as f:
+                filas = csv.reader(f)
+                next(filas, None)  # encabezado
+                for fila in filas:
+                    for celda in fila:
+                        vocabulario.update(PATRON_PALABRA.findall(celda.upper()))
+        except OSError as e:
+            logging.warning(f"Diccionario no disponible para métricas de calidad: {ruta} ({e})")
+    _vocabulario = vocabulario
+    return _vocabulario
+
+
+def metricas_calidad(texto, confianza_media=None):
+    """
+    Calcula el vector de calidad de un texto. Un solo recorrido con Counter da la
+    entropía y, a partir de los caracteres distintos, las proporciones por clase.
+    Retorna un dict con las claves documentadas arriba.
+    """
+    frecuencia = Counter(texto)
+    total = len(texto)
+    entropia = -sum((f / total) * math.log2(f / total) for f in frecuencia.values()) if total else 0.0
+
+    caracteres = alfabeticos = digitos = 0
+    for caracter, f in frecuencia.items():
+        if caracter.isspace():
+            continue
+        caracteres += f
+        if caracter.isalpha():
+            alfabeticos += f
+        elif caracter.isdigit():
+            digitos += f
+
+    palabras = PATRON_PALABRA.findall(texto.upper())
+    vocabulario = cargar_vocabulario()
+    aciertos = sum(1 for palabra in palabras if palabra in vocabulario)
+
+    return {
+        'entropia': entropia,
+        'caracteres': caracteres,
+        'proporcion_alfabetica': round(alfabeticos / caracteres, 4) if caracteres else 0.0,
+        'proporcion_digitos': round(digitos / caracteres, 4) if caracteres else 0.0,
+        'tasa_diccionario': round(aciertos / len(palabras), 4) if palabras else 0.0,
+        'confianza_media': round(confianza_media, 4) if confianza_media is not None else None,
+        'lineas': sum(1 for linea in texto.splitlines() if linea.strip()),
+    }
+
+
+def serializar_metricas(metricas):
+    return json.dumps(metricas, ensure_ascii=False, sort_keys=True) if metricas else None
+
+
+def leer_metricas(valor):
+    """Inverso de serializar_metricas para las etapas que leen la columna."""
+    if not valor:
+        return {}
+    if isinstance(valor, dict):
+        return valor
+    try:
+        return json.loads(valor)
+    except (TypeError, ValueError):
+        return {}
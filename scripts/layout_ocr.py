@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# ===========================
+# Artefacto de layout OCR por documento
+# ===========================
+# 3extract_text.py guarda, por documento, las palabras/líneas detectadas por los
+# motores con geometría (PaddleOCR, DocTR) en un .npz columnar:
+#
+#   documento_id  int64
+#   metodo        (N,)   str    motor que produjo la entrada
+#   pagina        (N,)   int16  página (desde 0)
+#   caja          (N, 4) float32 x0, y0, x1, y1 normalizados a la página (0-1)
+#   confianza     (N,)   float32
+#   texto         (N,)   str    palabra (DocTR) o línea (PaddleOCR)
+#
+# Ruta: [ocr] directorio_layout/<nombre del PDF sin extensión>.npz
+# Las etapas posteriores lo leen con cargar_layout() para usar geometría y
+# confianza sin volver a parsear el texto plano.
+import configparser
+import os
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+config = configparser.ConfigParser()
+config.read(os.path.join(BASE_DIR, '../config/config.cf'))
+GUARDAR_LAYOUT = config.getboolean('ocr', 'guardar_layout', fallback=False)
+DIRECTORIO_LAYOUT = config.get('ocr', 'directorio_layout', fallback='../resultados/layout')
+
+
+def ruta_layout(nombre_archivo):
+    directorio = DIRECTORIO_LAYOUT
+    if not os.path.isabs(directorio):
+        directorio = os.path.join(BASE_DIR, directorio)
+    return os.path.join(directorio, f"{os.path.splitext(os.path.basename(nombre_archivo))[0]}.npz")
+
+
+def guardar_layout(documento_id, nombre_archivo, layout):
+    """
+    Escribe el artefacto de un documento.
+
+    Parámetros:
+        layout (dict): {metodo: [(pagina, texto, x0, y0, x1, y1, confianza), ...]}
+
+    Retorna la ruta escrita o None si no hay entradas.
+    """
+    filas = [(metodo,) + tuple(entrada) for metodo, entradas in layout.items() for entrada in entradas]
+    if not filas:
+        return None
+    ruta = ruta_layout(nombre_archivo)
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    metodos, paginas, textos, x0, y0, x1, y1, confianzas = zip(*filas)
+    temporal = ruta + '.tmp'
+    with open(temporal, 'wb') as f:
+        np.savez_compressed(
+            f,
+            documento_id=np.int64(documento_id),
+            metodo=np.array(metodos, dtype=str),
+            pagina=np.array(paginas, dtype=np.int16),
+            caja=np.column_stack([x0, y0, x1, y1]).astype(np.float32),
+            confianza=np.array(confianzas, dtype=np.float32),
+            texto=np.array(textos, dtype=str),
+        )
+    os.replace(temporal, ruta)
+    return ruta
+
+
+def cargar_layout(nombre_archivo, metodo=None):
+    """
+    Lee el artefacto de un documento como dict de arrays (ver encabezado).
+    Con metodo, filtra las entradas de ese motor. Retorna None si no existe.
+    """
+    ruta = ruta_layout(nombre_archivo)
+    if not os.path.exists(ruta):
+        return None
+    with np.load(ruta, allow_pickle=False) as datos:
+        layout = {clave: datos[clave] for clave in datos.files}
+    if metodo is not None:
+        mascara = layout['metodo'] == metodo
+        for clave in ('metodo', 'pagina', 'caja', 'confianza', 'texto'):
+            layout[clave] = layout[clave][mascara]
+    return layout
@@ -64,6 +64,27 @@ def ejecutar_script(script_comando):
         logging.error(f"❌ Excepción al ejecutar {script_comando}: {e}")
         return False
 
+def ejecutar_en_servicio_ocr():
+    """
+    Envía la tanda al servicio OCR persistente (3extract_text.py --servicio).
+    Retorna True/False según el resultado, o None si el servicio no está disponible.
+    """
+    from servicio_ocr import procesar_en_servicio
+    logging.info("🟡 Enviando tanda al servicio OCR persistente")
+    try:
+        resumen = procesar_en_servicio()
+    except Exception as e:
+        logging.error(f"❌ Excepción al enviar tanda al servicio OCR: {e}")
+        return False
+    if resumen is None:
+        return None
+    logging.info(f"📊 Resumen servicio OCR: {resumen}")
+    if resumen.get('error'):
+        logging.error(f"🔴 Servicio OCR terminó con error: {resumen['error']}")
+        return False
+    logging.info("✅ Tanda procesada por el servicio OCR.")
+    return True
+
 class PDFWatcherHandler(FileSystemEventHandler):
     def __init__(self, callback, delay=5):
         super().__init__()
@@ -99,6 +120,7 @@ def main():
     directorio_local_para_procesar = config.get('paths', 'directorio_local_para_procesar', fallback=None)
     delay_pipeline = config.getint('pipeline', 'delay_pipeline', fallback=5)
     max_archivos_por_tanda = config.getint('pipeline', 'max_archivos_por_tanda', fallback=30)
+    usar_servicio_ocr = config.getboolean('ocr', 'usar_servicio_ocr', fallback=False)
 
     if not directorio_local_para_procesar or not os.path.exists(directorio_local_para_procesar):
         logging.error(f"❌ Directorio inválido o no configurado: {directorio_local_para_procesar}")
@@ -122,7 +144,13 @@ def main():
 
         for script in scripts_a_ejecutar:
             tiempo_inicio = datetime.now()
-            resultado = ejecutar_script(script)
+            resultado = None
+            if usar_servicio_ocr and script.startswith("3extract_text.py"):
+                resultado = ejecutar_en_servicio_ocr()
+                if resultado is None:
+                    logging.warning("⚠️ Servicio OCR no disponible, se ejecuta 3extract_text.py como subproceso.")
+            if resultado is None:
+                resultado = ejecutar_script(script)
             if resultado == "sin_archivos" and script.startswith("1get_pdf_of_remote.py"):
                 logging.info("🛑 Pipeline detenido: no hay PDFs nuevos para procesar.")
                 return
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+# ===========================
+# Plantillas de regiones OCR por emisor
+# ===========================
+# extraer_datos (4texts_parse_campos.py) solo usa tres regiones del texto. Para
+# emisores recurrentes (rut_proveedor), 3extract_text.py puede reconocer solo
+# esas regiones en lugar de la página completa más el cuadrante de totales:
+#
+#   cabecera  del borde superior a la línea de corte (DETALLE, CÓDIGO, ...)
+#   cuerpo    de la línea de corte al bloque de totales
+#   totales   líneas TOTAL / NETO / IVA, ampliadas hasta el borde derecho
+#
+# más dos regiones de respaldo, derivadas de totales al cargar, para que ninguna
+# parte de la página quede sin OCR:
+#
+#   resto     a la izquierda de totales, en su misma franja
+#   pie       bajo totales, de borde a borde
+#
+# Cada plantilla guarda las cajas normalizadas (0-1) de la primera página, el
+# DPI que necesita cada región (según el alto de sus líneas) y una huella visual
+# de la página para reconocerla sin OCR. Se aprenden de los documentos
+# consolidados (extraccion_campos_consolidada) que tienen layout OCR guardado
+# ([ocr] guardar_layout) y su PDF en carpeta_procesados:
+#
+#   python3 plantillas_roi.py --aprender
+#   python3 plantillas_roi.py --listar
+import argparse
+import configparser
+import json
+import logging
+import math
+import os
+from datetime import datetime
+
+import cv2
+import fitz  # PyMuPDF
+import numpy as np
+
+from layout_ocr import cargar_layout
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+config = configparser.ConfigParser()
+config.read(os.path.join(BASE_DIR, '../config/config.cf'))
+OCR_POR_REGIONES = config.getboolean('ocr', 'ocr_por_regiones', fallback=False)
+ARCHIVO_PLANTILLAS = config.get('ocr', 'archivo_plantillas', fallback='../resultados/plantillas_roi.json')
+PLANTILLAS_UMBRAL = config.getfloat('ocr', 'plantillas_umbral', fallback=0.92)
+PLANTILLAS_MIN_DOCUMENTOS = config.getint('ocr', 'plantillas_min_documentos', fallback=3)
+PLANTILLAS_DOCUMENTOS_POR_EMISOR = config.getint('ocr', 'plantillas_documentos_por_emisor', fallback=50)
+PLANTILLAS_ALTO_LINEA_PX = config.getint('ocr', 'plantillas_alto_linea_px', fallback=24)
+CARPETA_PROCESADOS = config.get('paths', 'carpeta_procesados', fallback='../procesados')
+
+REGIONES = ('cabecera', 'cuerpo', 'totales')
+# Mismos patrones de corte que dividir_texto_en_cabecera_y_cuerpo
+PATRONES_CORTE = (
+    "DETALLE", "DETALL1E", "DETAL1ES", "CÓDIGO", "CODIGO", "C0DIG0", "CÓD1G0",
+    "DESCRIPCION", "DESCRIPCIÓN", "DESCR1PC1ON", "DESCR1PCION",
+    "DOCUMENTO REF.", "DOCUMENTOS REFERENCIADOS", "NOMBRE ITEM", "NOMBRE ARTICULO",
+    "POR LO SIGUIENTE", "PORSIGUIENTE", "POR VENTA DE",
+)
+PATRONES_TOTALES = ("TOTAL", "NETO", "IVA")
+MARGEN_REGION = 0.02
+DPI_HUELLA = 36
+FORMA_HUELLA = (24, 32)  # alto, ancho
+DPI_REGION_MINIMO = 150
+DPI_REGION_MAXIMO = 300
+
+
+def _ruta(ruta):
+    return ruta if os.path.isabs(ruta) else os.path.join(BASE_DIR, ruta)
+
+
+def huella_pagina(page):
+    """
+    Huella visual de una página fitz: render en gris a DPI_HUELLA reducido a
+    32x24, invertido (tinta alta), centrado y de norma 1, de modo que el producto
+    punto entre dos huellas es su correlación.
+    """
+    pix = page.get_pixmap(dpi=DPI_HUELLA, colorspace=fitz.csGRAY, alpha=False)
+    gris = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width)
+    reducida = cv2.resize(gris, FORMA_HUELLA[::-1], interpolation=cv2.INTER_AREA).astype(np.float32)
+    vector = (255.0 - reducida).ravel()
+    vector -= vector.mean()
+    norma = np.linalg.norm(vector)
+    return vector / norma if norma else vector
+
+
+_plantillas = None
+_mtime_plantillas = None
+
+
+def cargar_plantillas():
+    """
+    Plantillas utilizables (aprendidas de plantillas_min_documentos o más).
+    Se releen si el archivo cambió, para el servicio OCR persistente.
+    """
+    global _plantillas, _mtime_plantillas
+    ruta = _ruta(ARCHIVO_PLANTILLAS)
+    try:
+        mtime = os.path.getmtime(ruta)
+    except OSError:
+        return {}
+    if _plantillas is None or mtime != _mtime_plantillas:
+        with open(ruta, encoding='utf-8') as f:
+            datos = json.load(f)
+        _plantillas = {
+            rut: dict(
+                plantilla,
+                huella=np.asarray(plantilla['huella'], dtype=np.float32),
+                regiones={**plantilla['regiones'], **regiones_de_respaldo(plantilla['regiones'])},
+            )
+            for rut, plantilla in datos.items()
+            if plantilla.get('documentos', 0) >= PLANTILLAS_MIN_DOCUMENTOS
+        }
+        _mtime_plantillas = mtime
+    return _plantillas
+
+
+def regiones_de_respaldo(regiones):
+    """
+    Cajas que cabecera/cuerpo/totales no cubren: 'resto' y 'pie' (ver encabezado).
+    Usan el DPI del cuerpo.
+    """
+    x0, y0, _, y1 = regiones['totales']['caja']
+    dpi = regiones['cuerpo']['dpi']
+    return {
+        'resto': {'caja': [0.0, y0, x0, y1], 'dpi': dpi},
+        'pie': {'caja': [0.0, y1, 1.0, 1.0], 'dpi': dpi},
+    }
+
+
+def reconocer_plantilla(path_pdf):
+    """
+    Elige la plantilla cuya huella más se parece a la primera página del PDF.
+    Retorna (rut_proveedor, plantilla) o (None, None) si ninguna llega a plantillas_umbral.
+    """
+    plantillas = cargar_plantillas()
+    if not plantillas:
+        return None, None
+    with fitz.open(path_pdf) as doc:
+        if doc.page_count == 0:
+            return None, None
+        huella = huella_pagina(doc[0])
+    rut, similitud = max(
+        ((rut, float(np.dot(huella, plantilla['huella']))) for rut, plantilla in plantillas.items()),
+        key=lambda par: par[1],
+    )
+    if similitud < PLANTILLAS_UMBRAL:
+        return None, None
+    logging.info(f"Plantilla {rut} reconocida para '{os.path.basename(path_pdf)}' (similitud {similitud:.3f})")
+    return rut, plantillas[rut]
+
+
+def recortar_region(imagen, caja, escala=1.0):
+    """Recorta una caja normalizada (x0, y0, x1, y1) de la imagen y la reduce por escala (< 1)."""
+    alto, ancho = imagen.shape[:2]
+    x0, y0, x1, y1 = caja
+    recorte = imagen[int(y0 * alto):math.ceil(y1 * alto), int(x0 * ancho):math.ceil(x1 * ancho)]
+    if escala < 1.0 and min(recorte.shape[:2]) > 0:
+        recorte = cv2.resize(recorte, None, fx=escala, fy=escala, interpolation=cv2.INTER_AREA)
+    return np.ascontiguousarray(recorte)
+
+
+def _dpi_region(alto_linea, alto_pulgadas):
+    """DPI con el que una línea de alto_linea (fracción de la página) mide plantillas_alto_linea_px."""
+    if not alto_linea or alto_linea <= 0 or alto_pulgadas <= 0:
+        return DPI_REGION_MAXIMO
+    dpi = PLANTILLAS_ALTO_LINEA_PX / (alto_linea * alto_pulgadas)
+    return int(min(DPI_REGION_MAXIMO, max(DPI_REGION_MINIMO, math.ceil(dpi / 25) * 25)))
+
+
+def regiones_desde_layout(layout, alto_pulgadas):
+    """
+    Regiones de la primera página a partir del layout OCR de un documento (dict
+    de arrays de cargar_layout). Retorna {region: {'caja': [...], 'dpi': n}} o
+    None si no aparece la línea de corte en la mitad superior.
+    """
+    mascara = layout['pagina'] == 0
+    cajas = layout['caja'][mascara].astype(float)
+    textos = [str(t).upper() for t in layout['texto'][mascara]]
+    if not len(cajas):
+        return None
+
+    cortes = [caja[1] for caja, texto in zip(cajas, textos) if caja[1] <= 0.5 and any(p in texto for p in PATRONES_CORTE)]
+    if not cortes:
+        return None
+    corte = min(cortes)
+    totales = np.array([caja for caja, texto in zip(cajas, textos) if caja[1] >= 0.5 and any(p in texto for p in PATRONES_TOTALES)])
+    if len(totales):
+        caja_totales = [totales[:, 0].min(), totales[:, 1].min(), 1.0, totales[:, 3].max()]
+    else:
+        caja_totales = [0.5, 0.5, 1.0, 1.0]  # el cuadrante de siempre
+    fin_cuerpo = caja_totales[1] if len(totales) else cajas[:, 3].max()
+
+    cajas_region = {
+        'cabecera': [0.0, 0.0, 1.0, corte],
+        'cuerpo': [0.0, corte, 1.0, fin_cuerpo],
+        'totales': caja_totales,
+    }
+    centros_x = (cajas[:, 0] + cajas[:, 2]) / 2
+    centros_y = (cajas[:, 1] + cajas[:, 3]) / 2
+    regiones = {}
+    for nombre, (x0, y0, x1, y1) in cajas_region.items():
+        caja = [
+            round(max(0.0, x0 - MARGEN_REGION), 4), round(max(0.0, y0 - MARGEN_REGION), 4),
+            round(min(1.0, x1 + MARGEN_REGION), 4), round(min(1.0, y1 + MARGEN_REGION), 4),
+        ]
+        dentro = (centros_x >= caja[0]) & (centros_x <= caja[2]) & (centros_y >= caja[1]) & (centros_y <= caja[3])
+        alturas = cajas[dentro, 3] - cajas[dentro, 1]
+        regiones[nombre] = {'caja': caja, 'dpi': _dpi_region(float(np.median(alturas)) if len(alturas) else None, alto_pulgadas)}
+    return regiones
+
+
+def _layout_documento(nombre_archivo):
+    """Layout de palabras (DocTR) o, si no hay, de líneas (PaddleOCR)."""
+    for metodo in ('doctr', 'paddleocr'):
+        layout = cargar_layout(nombre_archivo, metodo=metodo)
+        if layout is not None and len(layout['texto']):
+            return layout
+    return None
+
+
+def aprender_plantillas():
+    """
+    Recalcula el archivo de plantillas desde los documentos consolidados más
+    recientes de cada emisor. Las cajas de un emisor son la unión de las de sus
+    documentos (no se pierde texto) y su DPI el mayor. Retorna las plantillas.
+    """
+    import pymysql
+    conexion = pymysql.connect(
+        host=config.get('database', 'host'), user=config.get('database', 'user'),
+        password=config.get('database', 'password'), database=config.get('database', 'dbname'),
+        cursorclass=pymysql.cursors.DictCursor,
+    )
+    try:
+        with conexion.cursor() as cursor:
+            cursor.execute("""
+                SELECT d.nombre_archivo, c.valor AS rut_proveedor
+                FROM extraccion_campos_consolidada c
+                JOIN documentos d ON d.id = c.documento_id
+                WHERE c.campo = 'rut_proveedor' AND c.valor IS NOT NULL AND c.valor <> ''
+                ORDER BY d.id DESC
+            """)
+            filas = cursor.fetchall()
+    finally:
+        conexion.close()
+
+    por_emisor = {}
+    for fila in filas:
+        archivos = por_emisor.setdefault(fila['rut_proveedor'].strip().upper(), [])
+        if len(archivos) < PLANTILLAS_DOCUMENTOS_POR_EMISOR:
+            archivos.append(fila['nombre_archivo'])
+
+    plantillas = {}
+    for rut, archivos in por_emisor.items():
+        regiones, huellas = [], []
+        for archivo in archivos:
+            path_pdf = os.path.join(_ruta(CARPETA_PROCESADOS), archivo)
+            layout = _layout_documento(archivo)
+            if layout is None or not os.path.exists(path_pdf):
+                continue
+            with fitz.open(path_pdf) as doc:
+                if doc.page_count == 0:
+                    continue
+                pagina = doc[0]
+                huella = huella_pagina(pagina)
+                alto_pulgadas = pagina.rect.height / 72
+            regiones_documento = regiones_desde_layout(layout, alto_pulgadas)
+            if regiones_documento is None:
+                continue
+            regiones.append(regiones_documento)
+            huellas.append(huella)
+        if not regiones:
+            continue
+        huella = np.mean(huellas, axis=0)
+        huella /= np.linalg.norm(huella) or 1.0
+        plantillas[rut] = {
+            'documentos': len(regiones),
+            'regiones': {
+                nombre: {
+                    'caja': [
+                        min(r[nombre]['caja'][0] for r in regiones), min(r[nombre]['caja'][1] for r in regiones),
+                        max(r[nombre]['caja'][2] for r in regiones), max(r[nombre]['caja'][3] for r in regiones),
+                    ],
+                    'dpi': max(r[nombre]['dpi'] for r in regiones),
+                }
+                for nombre in REGIONES
+            },
+            'huella': [round(float(v), 5) for v in huella],
+            'actualizado': datetime.now().isoformat(timespec='seconds'),
+        }
+
+    ruta = _ruta(ARCHIVO_PLANTILLAS)
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    temporal = ruta + '.tmp'
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(plantillas, f, ensure_ascii=False, indent=1)
+    os.replace(temporal, ruta)
+    logging.info(f"Plantillas de regiones guardadas en {ruta}: {len(plantillas)} emisores")
+    return plantillas
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plantillas de regiones OCR por emisor (rut_proveedor).")
+    parser.add_argument("--aprender", action="store_true", help="Recalcula las plantillas desde los documentos consolidados")
+    parser.add_argument("--listar", action="store_true", help="Muestra las plantillas guardadas")
+    args = parser.parse_args()
+
+    if args.aprender:
+        plantillas = aprender_plantillas()
+        print(f"✅ {len(plantillas)} plantillas guardadas en {_ruta(ARCHIVO_PLANTILLAS)}")
+    if args.listar or not args.aprender:
+        ruta = _ruta(ARCHIVO_PLANTILLAS)
+        if not os.path.exists(ruta):
+            print(f"⚠️ No hay plantillas en {ruta}")
+            raise SystemExit(0)
+        with open(ruta, encoding='utf-8') as f:
+            for rut, plantilla in json.load(f).items():
+                regiones = ", ".join(f"{n} {r['caja']} @{r['dpi']}dpi" for n, r in plantilla['regiones'].items())
+                uso = "" if plantilla['documentos'] >= PLANTILLAS_MIN_DOCUMENTOS else " (sin uso: pocos documentos)"
+                print(f"{rut}: {plantilla['documentos']} documentos{uso} | {regiones}")
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# ===========================
+# Servicio OCR persistente: protocolo y cliente
+# ===========================
+#   Servidor (mantiene los modelos OCR cargados entre tandas):
+#       python3 3extract_text.py --servicio
+#   Cliente (lo usa orquestador_pipeline.py, o manualmente):
+#       python3 servicio_ocr.py --estado
+#       python3 servicio_ocr.py --procesar
+#
+# Este módulo solo usa la librería estándar para que el orquestador pueda
+# enviar trabajo sin importar PaddleOCR, DocTR ni configurar CUDA.
+import argparse
+import configparser
+import logging
+import os
+import secrets
+import stat
+from multiprocessing.managers import BaseManager
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+config = configparser.ConfigParser()
+config.read(os.path.join(BASE_DIR, '../config/config.cf'))
+USAR_SERVICIO_OCR = config.getboolean('ocr', 'usar_servicio_ocr', fallback=False)
+# El protocolo del gestor es pickle: ejecutar código es posible para quien conozca
+# la clave, así que el servicio solo escucha en la máquina local
+SERVICIO_OCR_HOST = '127.0.0.1'
+SERVICIO_OCR_PUERTO = config.getint('ocr', 'servicio_ocr_puerto', fallback=50551)
+SERVICIO_OCR_CLAVE = config.get('ocr', 'servicio_ocr_clave', fallback='').strip()
+ARCHIVO_CLAVE_SERVICIO = os.path.join(
+    BASE_DIR, config.get('ocr', 'servicio_ocr_archivo_clave', fallback='../config/servicio_ocr.key'))
+
+
+class GestorServicioOCR(BaseManager):
+    """Gestor compartido por servidor y cliente; el servidor registra 'servicio' con su callable."""
+    pass
+
+
+def clave_servicio(crear=False):
+    """
+    Clave del gestor: [ocr] servicio_ocr_clave si está definida; si no, la del
+    archivo servicio_ocr_archivo_clave, que el servidor genera (crear=True) con
+    permisos 0600. Retorna None si no hay clave o el archivo lo pueden leer otros.
+    """
+    if SERVICIO_OCR_CLAVE:
+        return SERVICIO_OCR_CLAVE.encode('utf-8')
+    if crear and not os.path.exists(ARCHIVO_CLAVE_SERVICIO):
+        try:
+            fd = os.open(ARCHIVO_CLAVE_SERVICIO, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                f.write(secrets.token_hex(32))
+            logging.info(f"🔑 Clave del servicio OCR generada en {ARCHIVO_CLAVE_SERVICIO}")
+        except FileExistsError:
+            pass
+    try:
+        if os.stat(ARCHIVO_CLAVE_SERVICIO).st_mode & (stat.S_IRWXG | stat.S_IRWXO):
+            logging.error(f"La clave del servicio OCR ({ARCHIVO_CLAVE_SERVICIO}) no debe ser legible por otros usuarios (chmod 600)")
+            return None
+        with open(ARCHIVO_CLAVE_SERVICIO, encoding='utf-8') as f:
+            clave = f.read().strip()
+    except FileNotFoundError:
+        logging.warning(f"Servicio OCR sin clave: no existe {ARCHIVO_CLAVE_SERVICIO}")
+        return None
+    return clave.encode('utf-8') or None
+
+
+def crear_gestor(clave):
+    return GestorServicioOCR(address=(SERVICIO_OCR_HOST, SERVICIO_OCR_PUERTO), authkey=clave)
+
+
+def conectar_servicio():
+    """
+    Retorna el proxy del servicio OCR o None si no hay servicio escuchando.
+    """
+    clave = clave_servicio()
+    if clave is None:
+        return None
+    GestorServicioOCR.register('servicio')
+    gestor = crear_gestor(clave)
+    try:
+        gestor.connect()
+    except (ConnectionRefusedError, OSError) as e:
+        logging.warning(f"Servicio OCR no disponible en {SERVICIO_OCR_HOST}:{SERVICIO_OCR_PUERTO}: {e}")
+        return None
+    return gestor.servicio()
+
+
+def procesar_en_servicio():
+    """
+    Encola el contenido actual de directorio_local_para_procesar en el servicio OCR
+    y espera a que termine. Retorna el resumen del lote (dict) o None si el
+    servicio no está disponible.
+    """
+    servicio = conectar_servicio()
+    if servicio is None:
+        return None
+    return servicio.procesar_directorio()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cliente del servicio OCR persistente.")
+    parser.add_argument("--estado", action="store_true", help="Muestra el estado del servicio")
+    parser.add_argument("--procesar", action="store_true", help="Procesa el directorio de entrada en el servicio")
+    args = parser.parse_args()
+
+    servicio = conectar_servicio()
+    if servicio is None:
+        print(f"❌ Servicio OCR no disponible en {SERVICIO_OCR_HOST}:{SERVICIO_OCR_PUERTO}")
+        raise SystemExit(1)
+    if args.procesar:
+        print(servicio.procesar_directorio())
+    else:
+        print(servicio.estado())
@@ -0,0 +1,11 @@
+-- Estado de cada método OCR por documento.
+--   ejecutado: el método corrió y su texto está en texto_extraccion
+--   omitido:   el método no corrió (cascada, ruta nativa, etc.); texto_extraccion queda vacío
+--   timeout:   alguna página se cortó por tiempo (tiempo_max_<motor>, tiempo_max_documento);
+--              texto_extraccion tiene el texto parcial, o queda vacío si no hubo ninguno
+--   error:     falló alguna tarea del método; texto_extraccion tiene el texto de las demás páginas
+-- motivo_ocr guarda la razón en omitido, timeout y error (p. ej. "cascada: tesseract6 suficiente (...)",
+-- "error en 1 parte(s) de 3 página(s)"); en ejecutado queda NULL.
+ALTER TABLE extracciones_texto_total
+    ADD COLUMN estado_ocr VARCHAR(20) NOT NULL DEFAULT 'ejecutado' AFTER entropia,
+    ADD COLUMN motivo_ocr VARCHAR(255) NULL AFTER estado_ocr;
@@ -0,0 +1,7 @@
+-- Vector de métricas de calidad por método OCR (JSON), calculado en 3extract_text.py
+-- con calidad_texto.metricas_calidad:
+--   entropia, caracteres, proporcion_alfabetica, proporcion_digitos,
+--   tasa_diccionario, confianza_media (PaddleOCR/DocTR, NULL en otros), lineas
+-- Los métodos omitidos quedan con metricas_calidad NULL.
+ALTER TABLE extracciones_texto_total
+    ADD COLUMN metricas_calidad JSON NULL AFTER entropia;
@@ -0,0 +1,6 @@
+-- Documentos sin contenido detectados por 3extract_text.py ([ocr] detectar_paginas_en_blanco):
+-- todas sus páginas quedaron bajo los umbrales de tinta/desviación en un render de baja resolución.
+-- No pasan por OCR: sus métodos quedan en extracciones_texto_total con estado_ocr = 'omitido'
+-- y el documento avanza a estado 2 con en_blanco = 1.
+ALTER TABLE documentos
+    ADD COLUMN en_blanco TINYINT(1) NOT NULL DEFAULT 0 AFTER resolucion_ppi;
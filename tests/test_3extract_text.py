@@ -0,0 +1,617 @@
+import collections
+import importlib.util
+import os
+import sys
+import time
+import types
+
+import pytest
+
+for _modulo in ('numpy', 'cv2', 'fitz', 'pymysql', 'pytesseract', 'PIL', 'tqdm'):
+    pytest.importorskip(_modulo)
+
+DIR_SCRIPTS = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+
+
+@pytest.fixture(scope='module')
+def extractor():
+    """Carga scripts/3extract_text.py (lee ../config/config.cf relativo al directorio de trabajo)."""
+    cwd = os.getcwd()
+    os.chdir(DIR_SCRIPTS)
+    sys.path.insert(0, DIR_SCRIPTS)
+    try:
+        spec = importlib.util.spec_from_file_location('extract_text', os.path.join(DIR_SCRIPTS, '3extract_text.py'))
+        modulo = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(modulo)
+    finally:
+        os.chdir(cwd)
+    return modulo
+
+
+class PoolSincrono:
+    """
+    Pool falso: responde cada tarea al enviarla con motores de texto fijo. Los
+    raster no crean bloques, salvo con rasterizar=True (corren ejecutar_tarea).
+    Las tareas de los motores en retener esperan a responder().
+    """
+
+    def __init__(self, texto="TEXTO OCR", rasterizar=False):
+        self.texto = texto
+        self.rasterizar = rasterizar
+        self.tareas = []
+        self.retener = set()
+        self.retenidas = []
+        self.al_retener = None
+
+    def apply_async(self, funcion, args, callback=None, error_callback=None):
+        tarea = args[0]
+        self.tareas.append(tarea)
+        if tarea.get('motor') in self.retener:
+            self.retenidas.append((funcion, tarea, callback))
+            if self.al_retener:
+                self.al_retener(tarea)
+        else:
+            self._responder(funcion, tarea, callback)
+
+    def responder(self, filtro=lambda tarea: True):
+        for funcion, tarea, callback in [r for r in self.retenidas if filtro(r[1])]:
+            self.retenidas.remove((funcion, tarea, callback))
+            self._responder(funcion, tarea, callback)
+
+    def _responder(self, funcion, tarea, callback):
+        if tarea['tipo'] == 'raster':
+            callback(funcion(tarea) if self.rasterizar else ({}, 0))
+        elif tarea['motor'] == 'tesseract':
+            callback(({metodo: self.texto for metodo in tarea['metodos']}, [], {}))
+        else:
+            callback((self.texto, [], {}))
+
+
+class ColaEventos:
+    """Cola de avisos de los workers con la interfaz de multiprocessing.SimpleQueue."""
+
+    def __init__(self):
+        self.eventos = collections.deque()
+
+    def put(self, evento):
+        self.eventos.append(evento)
+
+    def empty(self):
+        return not self.eventos
+
+    def get(self):
+        return self.eventos.popleft()
+
+
+def _crear_pdf(fitz, ruta, paginas=1):
+    doc = fitz.open()
+    for _ in range(paginas):
+        doc.new_page().insert_text((72, 72), "FACTURA")
+    doc.save(ruta)
+    doc.close()
+
+
+@pytest.fixture
+def planificador(extractor, monkeypatch, tmp_path):
+    """Planificador sin base de datos: guardar_textos_documento queda registrado en la lista guardados."""
+    guardados = []
+    monkeypatch.setattr(extractor, 'documento_pendiente', lambda path_pdf: {'id': 7, 'tipo_documento': 'nativo'})
+    monkeypatch.setattr(extractor, 'guardar_textos_documento',
+                        lambda documento_id, archivo, textos, *args, **kwargs: guardados.append(textos) or True)
+    monkeypatch.setattr(extractor, 'CARPETA_PROCESADOS', str(tmp_path / 'procesados'))
+    for nombre, valor in (('MODO_CASCADA', False), ('DETECTAR_PAGINAS_EN_BLANCO', False),
+                          ('OCR_POR_REGIONES', False), ('CACHE_OCR', False), ('GUARDAR_LAYOUT', False),
+                          ('TIEMPO_MAX_DOCUMENTO', 0), ('ORIENTACION_POR_PAGINA', False)):
+        monkeypatch.setattr(extractor, nombre, valor)
+    pool = PoolSincrono()
+    return extractor.PlanificadorPaginas(pool), pool, guardados
+
+
+def test_ruta_nativa_guarda_texto_nativo(extractor, planificador, monkeypatch, tmp_path):
+    planificador, pool, guardados = planificador
+    monkeypatch.setattr(extractor, 'RUTA_NATIVA', True)
+    monkeypatch.setattr(extractor, 'RUTA_NATIVA_OCR', 'tesseract6')
+    monkeypatch.setattr(extractor, 'motores_habilitados', lambda: ['paddleocr', 'tesseract6'])
+    monkeypatch.setattr(extractor, 'extraer_texto_nativo', lambda *args, **kwargs: "TEXTO NATIVO")
+    monkeypatch.setattr(extractor, 'texto_nativo_utilizable', lambda texto: True)
+    path_pdf = str(tmp_path / 'nativo.pdf')
+    _crear_pdf(extractor.fitz, path_pdf)
+
+    planificador.ejecutar([path_pdf])
+
+    assert [tarea['motor'] for tarea in pool.tareas if tarea['tipo'] == 'motor'] == ['tesseract']
+    assert guardados == [{'nativo': "TEXTO NATIVO", 'tesseract6': "TEXTO OCR"}]
+
+
+def test_fallo_al_guardar_envia_a_errores(extractor, planificador, monkeypatch, tmp_path):
+    planificador, _, _ = planificador
+    errores = []
+    monkeypatch.setattr(extractor, 'planificar_metodos', lambda path_pdf, doc: (['tesseract6'], {}))
+    monkeypatch.setattr(extractor, 'guardar_textos_documento', lambda *args, **kwargs: False)
+    monkeypatch.setattr(extractor, 'mover_a_errores', lambda path_pdf, mensaje_error="": errores.append(path_pdf))
+    path_pdf = str(tmp_path / 'sin_bd.pdf')
+    _crear_pdf(extractor.fitz, path_pdf)
+
+    planificador.ejecutar([path_pdf])
+
+    assert errores == [path_pdf]
+    assert not os.path.exists(os.path.join(extractor.CARPETA_PROCESADOS, 'sin_bd.pdf'))
+
+
+def test_fallar_saca_paginas_del_lote(extractor, planificador, monkeypatch, tmp_path):
+    planificador, _, _ = planificador
+    monkeypatch.setattr(extractor, 'mover_a_errores', lambda *args, **kwargs: None)
+    otro = str(tmp_path / 'otro.pdf')
+    d = {'path_pdf': str(tmp_path / 'fallido.pdf'), 'rasters': {}}
+    planificador.documentos[d['path_pdf']] = d
+    planificador.progreso = extractor.tqdm(disable=True)
+    planificador.buffers_lote['doctr'] = [(d['path_pdf'], 0, {}, None), (otro, 0, {}, None)]
+
+    planificador._fallar(d, "prueba")
+
+    assert planificador.buffers_lote['doctr'] == [(otro, 0, {}, None)]
+
+
+def test_orientacion_una_vez_por_pagina(extractor, planificador, monkeypatch, tmp_path):
+    planificador, pool, guardados = planificador
+    pool.rasterizar = True
+    osd = []
+    monkeypatch.setattr(extractor, 'detectar_orientacion', lambda rgb: osd.append(rgb.shape) or 90)
+    monkeypatch.setattr(extractor, 'ORIENTACION_POR_PAGINA', True)
+    monkeypatch.setattr(extractor, 'planificar_metodos', lambda path_pdf, doc: (['paddleocr', 'tesseract6'], {}))
+    monkeypatch.setattr(extractor, 'dpi_para_motor', lambda motor, ppi: {'paddleocr': 200, 'tesseract': 300}[motor])
+    path_pdf = str(tmp_path / 'girado.pdf')
+    _crear_pdf(extractor.fitz, path_pdf, paginas=2)
+
+    planificador.ejecutar([path_pdf])
+
+    rasters = [(tarea['pagina'], tarea['dpi'], tarea['rotacion']) for tarea in pool.tareas if tarea['tipo'] == 'raster']
+    # OSD (rotacion None) solo en el DPI más bajo de cada página; el otro DPI reusa el ángulo
+    assert sorted(rasters) == [(0, 200, None), (0, 300, 90), (1, 200, None), (1, 300, 90)]
+    # Una detección por página, sobre el raster de 200 dpi (A4: 1653 x 2339 px)
+    assert osd == [(2339, 1653, 3)] * 2
+    assert guardados == [{'paddleocr': "TEXTO OCR\nTEXTO OCR", 'tesseract6': "TEXTO OCR\nTEXTO OCR"}]
+
+
+def test_tarea_vencida_solo_mata_su_worker(extractor, planificador, monkeypatch, tmp_path):
+    planificador, pool, guardados = planificador
+    incompletos = {}
+    monkeypatch.setattr(extractor, 'guardar_textos_documento',
+                        lambda documento_id, archivo, textos, *args, **kwargs:
+                        guardados.append(textos) or incompletos.update(kwargs['incompletos']) or True)
+    eventos = ColaEventos()
+    monkeypatch.setattr(extractor, '_eventos_tareas', eventos)
+    monkeypatch.setitem(extractor.TIEMPOS_MAX_MOTOR, 'paddleocr', 10)
+    monkeypatch.setattr(extractor, 'planificar_metodos', lambda path_pdf, doc: (['paddleocr', 'tesseract6'], {}))
+    # La primera vigilancia llega cuando el pool deja de responder, con todas las páginas enviadas
+    planificador.vigilar = True
+    planificador.ultima_vigilancia = time.time()
+    pool.retener = {'paddleocr', 'tesseract'}
+    inicio = time.time() - 60
+
+    def al_retener(tarea):
+        if tarea['motor'] != 'paddleocr':
+            return
+        pid = 100 + tarea['pagina']
+        eventos.put(('inicio', tarea['id'], pid, inicio))
+        if tarea['pagina'] == 1:
+            # Terminó, pero su resultado aún no llega: el worker ya puede estar en otra tarea
+            eventos.put(('fin', tarea['id'], pid, time.time()))
+
+    muertos = []
+
+    def matar(pid, senal):
+        # Las tareas de Tesseract (no vigiladas) siguen pendientes al vencer la de PaddleOCR
+        assert sum(tarea['motor'] == 'tesseract' for _, tarea, _ in pool.retenidas) == 2
+        muertos.append(pid)
+        pool.responder(lambda tarea: tarea['motor'] == 'tesseract' or tarea['pagina'] == 1)
+
+    pool.al_retener = al_retener
+    monkeypatch.setattr(extractor.os, 'kill', matar)
+    path_pdf = str(tmp_path / 'lento.pdf')
+    _crear_pdf(extractor.fitz, path_pdf, paginas=2)
+
+    planificador.ejecutar([path_pdf])
+
+    assert muertos == [100] and planificador.tareas_abandonadas == 1
+    assert planificador.tareas_en_curso == 0
+    assert guardados == [{'paddleocr': "TEXTO OCR", 'tesseract6': "TEXTO OCR\nTEXTO OCR"}]
+    assert list(incompletos) == ['paddleocr'] and incompletos['paddleocr'][0] == 'timeout'
+
+
+def test_pixmap_a_array_sin_copia(extractor):
+    fitz, np = extractor.fitz, extractor.np
+    pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 4, 3), False)
+    pix.clear_with(200)
+    buffer = np.frombuffer(pix.samples_mv, dtype=np.uint8)
+
+    vista = extractor.pixmap_a_array(pix)
+    assert vista.shape == (3, 4, 3) and not vista.flags.writeable
+    assert np.shares_memory(vista, buffer)
+    copia = extractor.pixmap_a_array(pix, copiar=True)
+    assert not np.shares_memory(copia, buffer) and (copia == 200).all()
+
+
+def test_regiones_tesseract_en_un_solo_pool(extractor, monkeypatch):
+    np = extractor.np
+    pools = []
+
+    class Pool(extractor.ThreadPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            pools.append(self)
+            super().__init__(*args, **kwargs)
+
+    monkeypatch.setattr(extractor, 'ThreadPoolExecutor', Pool)
+    monkeypatch.setattr(extractor.pytesseract, 'image_to_string',
+                        lambda img, config, timeout: f"{config.split()[1]}:{img.shape[0]}")
+    pagina = np.full((1000, 800, 3), 255, dtype=np.uint8)
+    roi = {'dpi': 200, 'regiones': {
+        'cabecera': {'caja': [0.0, 0.0, 1.0, 0.2], 'dpi': 200},
+        'totales': {'caja': [0.0, 0.5, 1.0, 1.0], 'dpi': 200},
+    }}
+    tarea = {'motor': 'tesseract', 'metodos': ['tesseract4', 'tesseract6'], 'path_pdf': 'x.pdf',
+             'roi': roi, 'excedidos': {}}
+
+    textos, _ = extractor._ejecutar_motor_en_regiones(tarea, pagina)
+
+    assert len(pools) == 1
+    assert textos == {'tesseract4': "4:200\n4:500", 'tesseract6': "6:200\n6:500"}
+
+
+def test_resolucion_efectiva_de_imagen_escaneada(extractor, monkeypatch, tmp_path):
+    fitz = extractor.fitz
+    path_pdf = str(tmp_path / 'escaneo.pdf')
+    # 600 x 900 px dibujados en 3 x 4.5 pulgadas: 200 ppi
+    imagen = fitz.Pixmap(fitz.csGRAY, fitz.IRect(0, 0, 600, 900), False)
+    imagen.clear_with(200)
+    doc = fitz.open()
+    doc.new_page().insert_image(fitz.Rect(72, 72, 72 + 3 * 72, 72 + 4.5 * 72), stream=imagen.tobytes('png'))
+    doc.save(path_pdf)
+    doc.close()
+
+    assert extractor.resolucion_efectiva_ppi(path_pdf) == pytest.approx(200, abs=1)
+
+    monkeypatch.setattr(extractor, 'DPI_MOTORES', {'paddleocr': 'auto'})
+    monkeypatch.setattr(extractor, 'DPI_TOPE_MOTORES', {'paddleocr': 300})
+    monkeypatch.setattr(extractor, 'DPI_AUTO_MINIMO', 150)
+    assert extractor.dpi_para_motor('paddleocr', extractor.resolucion_efectiva_ppi(path_pdf)) == 200
+
+
+def test_resolucion_efectiva_sin_imagenes(extractor, tmp_path):
+    path_pdf = str(tmp_path / 'vectorial.pdf')
+    _crear_pdf(extractor.fitz, path_pdf)
+    assert extractor.resolucion_efectiva_ppi(path_pdf) == 0
+
+
+def test_unir_regiones_segun_motor(extractor):
+    textos = {'cabecera': "FACTURA", 'cuerpo': "ITEM 1", 'resto': "TIMBRE", 'totales': "TOTAL 100"}
+    assert extractor._unir_regiones(textos, 'tesseract') == "FACTURA\nITEM 1\nTIMBRE\nTOTAL 100"
+    assert extractor._unir_regiones(textos, 'doctr') == "FACTURA\nITEM 1\nTIMBRE\nTOTAL 100\n[SEGMENTO_TOTALES]\nTOTAL 100"
+
+
+def test_reciclaje_por_documentos_atendidos(extractor, monkeypatch):
+    monkeypatch.setattr(extractor, 'DOCUMENTOS_POR_WORKER', 2)
+    monkeypatch.setattr(extractor, 'RSS_MAX_WORKER_MB', 0)
+    monkeypatch.setattr(extractor, '_documentos_worker', set())
+
+    assert extractor.motivo_reciclaje({'path_pdf': 'a.pdf'}) is None
+    assert extractor.motivo_reciclaje({'path_pdf': 'a.pdf'}) is None
+    assert extractor.motivo_reciclaje({'path_pdf': 'b.pdf', 'claves': [('b.pdf', 0), ('a.pdf', 1)]}) is None
+    # Otra página de un documento ya atendido no recicla; uno nuevo sí
+    assert extractor.motivo_reciclaje({'path_pdf': 'b.pdf'}) is None
+    assert extractor.motivo_reciclaje({'path_pdf': 'c.pdf'}) == "2 documentos atendidos"
+
+
+def test_reciclaje_por_rss(extractor, monkeypatch):
+    monkeypatch.setattr(extractor, 'DOCUMENTOS_POR_WORKER', 0)
+    monkeypatch.setattr(extractor, 'RSS_MAX_WORKER_MB', 500)
+    monkeypatch.setattr(extractor, '_documentos_worker', set())
+    rss = [100]
+    monkeypatch.setattr(extractor, 'rss_worker_mb', lambda: rss[0])
+
+    assert extractor.motivo_reciclaje({'path_pdf': 'a.pdf'}) is None
+    rss[0] = 800
+    # El RSS solo se mide al entrar a un documento nuevo
+    assert extractor.motivo_reciclaje({'path_pdf': 'a.pdf'}) is None
+    assert extractor.motivo_reciclaje({'path_pdf': 'b.pdf'}) == "RSS 800 MB > 500 MB"
+
+
+def test_cache_ocr_por_firma_del_motor(extractor, monkeypatch, tmp_path):
+    monkeypatch.setattr(extractor, 'CACHE_OCR', True)
+    monkeypatch.setattr(extractor, 'DIRECTORIO_CACHE_OCR', str(tmp_path))
+    monkeypatch.setattr(extractor, 'USAR_PREPROCESAMIENTO_CV2', True)
+    monkeypatch.setattr(extractor, '_firmas_motor', {})
+    monkeypatch.setattr(extractor.pytesseract, 'get_tesseract_version', lambda: '5.3.0')
+
+    extractor.guardar_cache_ocr('abc', 'tesseract6', "TEXTO")
+    assert extractor.firma_motor('tesseract6').startswith('tesseract6|5.3.0|dpi=')
+    assert extractor.leer_cache_ocr('abc', 'tesseract6') == "TEXTO"
+    assert extractor.leer_cache_ocr('abc', 'tesseract4') is None
+    assert extractor.leer_cache_ocr('otro', 'tesseract6') is None
+
+    # Un flag de preprocesamiento distinto es otra clave: el resultado previo no sirve
+    monkeypatch.setattr(extractor, 'USAR_PREPROCESAMIENTO_CV2', False)
+    monkeypatch.setattr(extractor, '_firmas_motor', {})
+    assert 'cv2=0' in extractor.firma_motor('tesseract6')
+    assert extractor.leer_cache_ocr('abc', 'tesseract6') is None
+
+
+def test_podar_cache_ocr_desaloja_lo_mas_antiguo(extractor, monkeypatch, tmp_path):
+    monkeypatch.setattr(extractor, 'CACHE_OCR', True)
+    monkeypatch.setattr(extractor, 'DIRECTORIO_CACHE_OCR', str(tmp_path))
+    monkeypatch.setattr(extractor, 'CACHE_OCR_MAX_MB', 1)
+    rutas = []
+    for antiguedad, nombre in enumerate(('viejo', 'medio', 'nuevo')):
+        ruta = tmp_path / nombre[:2] / f"{nombre}.txt"
+        ruta.parent.mkdir()
+        ruta.write_bytes(b"x" * 400 * 1024)
+        os.utime(ruta, (1000 + antiguedad, 1000 + antiguedad))
+        rutas.append(ruta)
+
+    # 1.2 MB > 1 MB: se borra desde el más antiguo hasta quedar bajo 0.9 MB
+    extractor.podar_cache_ocr()
+
+    assert [ruta.exists() for ruta in rutas] == [False, True, True]
+
+
+def test_metricas_calidad(extractor, monkeypatch):
+    calidad_texto = sys.modules['calidad_texto']
+    monkeypatch.setattr(calidad_texto, '_vocabulario', {'ROJO', 'SANTIAGO'})
+    texto = "ROJO 123\n\nSantiago XYZW"
+
+    metricas = extractor.metricas_calidad(texto, confianza_media=0.912345)
+
+    assert metricas == {
+        'entropia': pytest.approx(extractor.calcular_entropia(texto)),
+        'caracteres': 19,
+        'proporcion_alfabetica': round(16 / 19, 4),
+        'proporcion_digitos': round(3 / 19, 4),
+        'tasa_diccionario': round(2 / 3, 4),
+        'confianza_media': 0.9123,
+        'lineas': 2,
+    }
+    assert calidad_texto.leer_metricas(extractor.serializar_metricas(metricas)) == metricas
+    vacio = extractor.metricas_calidad("")
+    assert vacio['entropia'] == 0.0 and vacio['caracteres'] == 0 and vacio['confianza_media'] is None
+
+
+def test_layout_npz_ida_y_vuelta(extractor, monkeypatch, tmp_path):
+    layout_ocr = sys.modules['layout_ocr']
+    monkeypatch.setattr(layout_ocr, 'DIRECTORIO_LAYOUT', str(tmp_path))
+    layout = {
+        'doctr': [(0, "TOTAL", 0.1, 0.2, 0.3, 0.25, 0.98), (1, "IVA", 0.5, 0.6, 0.7, 0.65, 0.75)],
+        'paddleocr': [(0, "FACTURA ELECTRONICA", 0.0, 0.0, 1.0, 0.1, 0.9)],
+    }
+
+    ruta = extractor.guardar_layout(7, 'factura.pdf', layout)
+
+    assert ruta == str(tmp_path / 'factura.npz')
+    datos = layout_ocr.cargar_layout('factura.pdf')
+    assert int(datos['documento_id']) == 7
+    assert datos['metodo'].tolist() == ['doctr', 'doctr', 'paddleocr']
+    assert datos['pagina'].dtype == extractor.np.int16 and datos['pagina'].tolist() == [0, 1, 0]
+    assert datos['caja'].shape == (3, 4) and datos['caja'][1].tolist() == pytest.approx([0.5, 0.6, 0.7, 0.65])
+    assert datos['confianza'].tolist() == pytest.approx([0.98, 0.75, 0.9])
+    assert layout_ocr.cargar_layout('factura.pdf', metodo='doctr')['texto'].tolist() == ["TOTAL", "IVA"]
+    assert extractor.guardar_layout(8, 'vacio.pdf', {'doctr': []}) is None
+    assert layout_ocr.cargar_layout('vacio.pdf') is None
+
+
+def test_presupuesto_hilos_reparte_los_nucleos(extractor, monkeypatch):
+    monkeypatch.setattr(extractor, 'NUCLEOS_OCR', 8)
+    monkeypatch.setattr(extractor, 'HILOS_POR_WORKER', 0)
+    monkeypatch.setattr(extractor, 'PROCESAMIENTO_SIMULTANEO', 3)
+    assert extractor.presupuesto_hilos() == 2
+    assert extractor.presupuesto_hilos(2) == 4
+    assert extractor.presupuesto_hilos(16) == 1
+
+    for variable in extractor.VARIABLES_HILOS + ('EXTRACT_HILOS_WORKER',):
+        monkeypatch.setenv(variable, '')
+    assert extractor.coordinar_hilos(4) == 2
+    assert {os.environ[variable] for variable in extractor.VARIABLES_HILOS} == {'2'}
+    # Los workers heredan el reparto del coordinador, no el de configuración
+    assert extractor.hilos_worker() == 2
+
+    monkeypatch.setattr(extractor, 'HILOS_POR_WORKER', 5)
+    assert extractor.presupuesto_hilos(4) == 5
+
+
+def test_umbrales_de_pagina_en_blanco(extractor, monkeypatch):
+    fitz = extractor.fitz
+    for nombre, valor in (('BLANCO_DPI', 36), ('BLANCO_MARGEN', 0.05), ('BLANCO_CONTRASTE', 60),
+                          ('BLANCO_MAX_TINTA', 0.002), ('BLANCO_MAX_DESVIACION', 4.0)):
+        monkeypatch.setattr(extractor, nombre, valor)
+    doc = fitz.open()
+    blanca = doc.new_page()
+    # Borde oscuro del escáner: queda dentro del margen que no se mide
+    borde = doc.new_page()
+    borde.draw_rect(fitz.Rect(0, 0, borde.rect.width, 10), color=(0, 0, 0), fill=(0, 0, 0))
+    # Una mancha mínima (ruido) no supera blanco_max_tinta
+    mota = doc.new_page()
+    mota.draw_rect(fitz.Rect(300, 400, 304, 404), color=(0, 0, 0), fill=(0, 0, 0))
+    tinta = doc.new_page()
+    tinta.draw_rect(fitz.Rect(200, 300, 400, 500), color=(0, 0, 0), fill=(0, 0, 0))
+    texto = doc.new_page()
+    texto.insert_text((72, 72), "FACTURA")
+
+    medidas = [extractor.medir_pagina_en_blanco(page) for page in doc]
+
+    assert [en_blanco for en_blanco, _ in medidas] == [True, True, True, False, False]
+    assert medidas[4][1] == "capa de texto"
+    doc.close()
+
+
+def test_texto_nativo_utilizable(extractor, monkeypatch):
+    monkeypatch.setattr(extractor, 'RUTA_NATIVA_MIN_CARACTERES', 20)
+    monkeypatch.setattr(extractor, 'RUTA_NATIVA_MIN_ALFANUMERICO', 0.6)
+    assert extractor.texto_nativo_utilizable("FACTURA ELECTRONICA N 12345 TOTAL 990")
+    assert not extractor.texto_nativo_utilizable("FACTURA 123")
+    # Fuente sin mapa Unicode: mucho texto, pero casi todo símbolos
+    assert not extractor.texto_nativo_utilizable("���� A1 " * 10)
+
+
+def test_tesseract_modos_cuenta_paginas_excedidas(extractor, monkeypatch):
+    np = extractor.np
+
+    def image_to_string(img, config, timeout):
+        if img.shape[0] == 20 and '--psm 6' in config:
+            raise RuntimeError("Tesseract process timeout")
+        return f"{config.split()[1]}:{img.shape[0]}"
+
+    monkeypatch.setattr(extractor.pytesseract, 'image_to_string', image_to_string)
+    paginas = [np.full((alto, 30, 3), 255, dtype=np.uint8) for alto in (10, 20, 30)]
+    excedidos = {}
+
+    textos = extractor.extraer_texto_tesseract_modos('x.pdf', ['tesseract4', 'tesseract6'], paginas=paginas,
+                                                     timeout=5, excedidos=excedidos)
+
+    assert textos == {'tesseract4': "4:10\n4:20\n4:30", 'tesseract6': "6:10\n6:30"}
+    assert excedidos == {'tesseract6': 1}
+
+
+def test_variantes_se_calculan_una_vez(extractor, monkeypatch):
+    np = extractor.np
+    binarizar = extractor._binarizar
+    llamadas = []
+    monkeypatch.setattr(extractor, '_binarizar', lambda gris: llamadas.append(1) or binarizar(gris))
+    pagina = extractor.VariantesPagina(np.full((40, 30, 3), 255, dtype=np.uint8))
+
+    binarizada = pagina.para_motor('tesseract')
+    assert pagina.obtener('binarizada') is binarizada
+    # DocTR parte de la binarizada ya calculada
+    assert pagina.obtener('enderezada').shape == (40, 30)
+    assert len(llamadas) == 1
+    # Las precalculadas (memoria compartida) no se recalculan
+    assert extractor.VariantesPagina(pagina.rgb, {'binarizada': binarizada}).obtener('binarizada') is binarizada
+    assert len(llamadas) == 1
+
+
+def test_angulo_deskew_en_baja_resolucion(extractor, monkeypatch):
+    np, cv2 = extractor.np, extractor.cv2
+    binarizada = np.zeros((2000, 1500), dtype=np.uint8)
+    # Bloque de texto (tinta = 255) inclinado 3 grados
+    caja = cv2.boxPoints(((750, 1000), (1000, 400), 3.0)).astype(np.int32)
+    cv2.fillPoly(binarizada, [caja], 255)
+
+    monkeypatch.setattr(extractor, 'DESKEW_LADO_MAX', 4000)
+    completo = extractor.estimar_angulo_deskew(binarizada)
+    monkeypatch.setattr(extractor, 'DESKEW_LADO_MAX', 400)
+    reducido = extractor.estimar_angulo_deskew(binarizada)
+
+    assert abs(completo) == pytest.approx(3.0, abs=0.2)
+    assert reducido == pytest.approx(completo, abs=0.5)
+    assert extractor.estimar_angulo_deskew(np.zeros((100, 100), dtype=np.uint8)) is None
+
+
+def test_omp_thread_limit_solo_en_el_subproceso_de_tesseract(extractor, monkeypatch):
+    monkeypatch.delenv('OMP_THREAD_LIMIT', raising=False)
+    argumentos = extractor.pytesseract.pytesseract.subprocess_args()
+    assert argumentos['env']['OMP_THREAD_LIMIT'] == '1'
+    assert 'OMP_THREAD_LIMIT' not in os.environ
+
+
+def test_limites_torch_una_vez_tras_cargar_el_modelo(extractor, monkeypatch):
+    llamadas = []
+    torch = type(sys)('torch')
+    torch.set_num_threads = lambda hilos: llamadas.append(('intra', hilos))
+    torch.set_num_interop_threads = lambda hilos: llamadas.append(('inter', hilos))
+    monkeypatch.setattr(extractor, '_limites_torch_aplicados', False)
+    monkeypatch.setenv('EXTRACT_HILOS_WORKER', '3')
+
+    monkeypatch.delitem(sys.modules, 'torch', raising=False)
+    extractor.aplicar_limites_torch()
+    assert llamadas == []
+    monkeypatch.setitem(sys.modules, 'torch', torch)
+    extractor.aplicar_limites_torch()
+    extractor.aplicar_limites_torch()
+    assert llamadas == [('intra', 3), ('inter', 1)]
+
+
+class ModeloDoctrFalso:
+    """Predictor DocTR falso: una palabra 'P<alto>' en el cuadrante inferior derecho de cada imagen."""
+
+    def __init__(self, falla_con_alto=None):
+        self.falla_con_alto = falla_con_alto
+        self.lotes = []
+
+    def __call__(self, imagenes):
+        altos = [imagen.shape[0] for imagen in imagenes]
+        self.lotes.append(altos)
+        if self.falla_con_alto in altos:
+            raise RuntimeError("lote inválido")
+        return types.SimpleNamespace(pages=[
+            types.SimpleNamespace(blocks=[types.SimpleNamespace(lines=[types.SimpleNamespace(words=[
+                types.SimpleNamespace(value=f"P{alto}", geometry=((0.6, 0.6), (0.8, 0.7)), confidence=0.9),
+            ])])])
+            for alto in altos
+        ])
+
+
+def test_doctr_en_lotes_entre_documentos(extractor, monkeypatch):
+    np = extractor.np
+    monkeypatch.setattr(extractor, 'SEGMENTO_TOTALES_DESDE_PAGINA', True)
+    modelo = ModeloDoctrFalso(falla_con_alto=30)
+    documentos = {
+        'a': [np.full((10, 30, 3), 255, dtype=np.uint8), np.full((20, 30, 3), 255, dtype=np.uint8)],
+        'b': [np.full((30, 30, 3), 255, dtype=np.uint8)],
+    }
+    layout = {}
+
+    textos = extractor.extraer_texto_doctr_lote(documentos, modelo, tamano_lote=2, layout=layout)
+
+    assert modelo.lotes == [[10, 20], [30]]
+    assert textos == {
+        'a': "P10\n\n[SEGMENTO_TOTALES]\nP10\nP20\n\n[SEGMENTO_TOTALES]\nP20",
+        # El lote con error deja vacíos solo sus documentos
+        'b': "",
+    }
+    assert layout == {'a': [(0, "P10", 0.6, 0.6, 0.8, 0.7, 0.9), (1, "P20", 0.6, 0.6, 0.8, 0.7, 0.9)]}
+
+
+def test_segmento_totales_desde_cajas_de_pagina(extractor):
+    # PaddleOCR: [[caja, (texto, confianza)], ...] por imagen, en píxeles
+    resultados = [[
+        [[[10, 10], [90, 10], [90, 30], [10, 30]], ("FACTURA", 0.9)],
+        [[[600, 900], [780, 900], [780, 930], [600, 930]], ("TOTAL 1.190", 0.95)],
+        [[[100, 900], [360, 900], [360, 930], [100, 930]], ("TIMBRE", 0.8)],
+    ], None]
+    assert extractor._lineas_paddle_en_segmento_totales(resultados, 800, 1000) == ["TOTAL 1.190"]
+    # DocTR: geometría normalizada
+    assert extractor._centro_en_segmento_totales(((0.5, 0.6), (0.9, 0.7)))
+    assert not extractor._centro_en_segmento_totales(((0.1, 0.6), (0.5, 0.7)))
+
+
+def test_easyocr_agrupa_paginas_por_forma(extractor):
+    np = extractor.np
+    llamadas = []
+
+    class LectorFalso:
+        def readtext(self, imagen, detail, batch_size):
+            llamadas.append(('readtext', imagen.shape[0]))
+            return [f"R{imagen.shape[0]}"]
+
+        def readtext_batched(self, imagenes, detail, batch_size):
+            llamadas.append(('batched', [imagen.shape[0] for imagen in imagenes]))
+            return [[f"B{imagen.shape[0]}", "X"] for imagen in imagenes]
+
+    documentos = {
+        'a': [np.full((10, 30, 3), 255, dtype=np.uint8), np.full((20, 30, 3), 255, dtype=np.uint8)],
+        'b': [np.full((10, 30, 3), 255, dtype=np.uint8)],
+    }
+
+    textos = extractor.extraer_texto_easyocr_lote(documentos, LectorFalso(), tamano_lote=4)
+
+    # readtext_batched exige imágenes de igual forma: las de 10 px van juntas aunque sean de otro documento
+    assert sorted(llamadas, key=str) == [('batched', [10, 10]), ('readtext', 20)]
+    assert textos == {'a': "B10 X\nR20", 'b': "B10 X"}
+
+
+def test_paddle_onnx_respeta_el_formato_de_paddleocr(extractor):
+    np = extractor.np
+    modelo = object.__new__(extractor.PaddleOCROnnx)
+    caja = [[0, 0], [10, 0], [10, 5], [0, 5]]
+    modelo.motor = lambda img, use_cls: ([(caja, "TOTAL", np.float32(0.5))], None)
+    assert modelo.ocr(None) == [[[caja, ("TOTAL", 0.5)]]]
+    # Sin detecciones PaddleOCR retorna [None]
+    modelo.motor = lambda img, use_cls: (None, None)
+    assert modelo.ocr(None) == [None]
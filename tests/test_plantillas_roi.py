@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+for _modulo in ('numpy', 'cv2', 'fitz'):
+    pytest.importorskip(_modulo)
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts')))
+
+import plantillas_roi  # noqa: E402
+
+
+def test_regiones_de_respaldo_cubren_la_franja_de_totales():
+    regiones = {
+        'cabecera': {'caja': [0.0, 0.0, 1.0, 0.3], 'dpi': 200},
+        'cuerpo': {'caja': [0.0, 0.3, 1.0, 0.7], 'dpi': 175},
+        'totales': {'caja': [0.6, 0.7, 1.0, 0.9], 'dpi': 250},
+    }
+    respaldo = plantillas_roi.regiones_de_respaldo(regiones)
+    assert respaldo['resto'] == {'caja': [0.0, 0.7, 0.6, 0.9], 'dpi': 175}
+    assert respaldo['pie'] == {'caja': [0.0, 0.9, 1.0, 1.0], 'dpi': 175}
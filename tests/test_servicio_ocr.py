@@ -0,0 +1,30 @@
+import os
+import stat
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts')))
+
+import servicio_ocr  # noqa: E402
+
+
+def test_clave_generada_con_permisos_0600(monkeypatch, tmp_path):
+    archivo = tmp_path / 'servicio_ocr.key'
+    monkeypatch.setattr(servicio_ocr, 'SERVICIO_OCR_CLAVE', '')
+    monkeypatch.setattr(servicio_ocr, 'ARCHIVO_CLAVE_SERVICIO', str(archivo))
+
+    # El cliente no inventa una clave
+    assert servicio_ocr.clave_servicio() is None
+    clave = servicio_ocr.clave_servicio(crear=True)
+    assert len(clave) == 64
+    assert stat.S_IMODE(os.stat(archivo).st_mode) == 0o600
+    assert servicio_ocr.clave_servicio() == clave
+
+    os.chmod(archivo, 0o644)
+    assert servicio_ocr.clave_servicio() is None
+
+
+def test_clave_configurada(monkeypatch, tmp_path):
+    monkeypatch.setattr(servicio_ocr, 'SERVICIO_OCR_CLAVE', 'secreta')
+    monkeypatch.setattr(servicio_ocr, 'ARCHIVO_CLAVE_SERVICIO', str(tmp_path / 'servicio_ocr.key'))
+    assert servicio_ocr.clave_servicio(crear=True) == b'secreta'
+    assert not (tmp_path / 'servicio_ocr.key').exists()